@@ -0,0 +1,73 @@
+"""Seeded synthetic datasets for the benchmark suite.
+
+The same parameters and seed always produce the same database, so runs on
+different commits measure the same data.
+"""
+import os
+import random
+import sys
+from typing import Dict, Iterator
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from feature_flag_service import FlagRow, SQLiteFeatureFlagStore  # noqa: E402
+
+SCALES: Dict[str, Dict[str, float]] = {
+    "small": {"customers": 1_000, "features": 20, "customer_override_density": 0.05, "user_override_density": 0.02},
+    "medium": {"customers": 50_000, "features": 100, "customer_override_density": 0.02, "user_override_density": 0.01},
+    "large": {"customers": 1_000_000, "features": 200, "customer_override_density": 0.005, "user_override_density": 0.002},
+}
+
+USERS_PER_CUSTOMER = 10
+GLOBAL_ENABLED_RATIO = 0.5
+# User ids are derived from customer ids so users never span customers
+USER_ID_STRIDE = 1000
+# One extra feature, off by default, rolled out to a share of customers
+ROLLOUT_FEATURE = "rollout_feature"
+ROLLOUT_PERCENTAGE = 50.0
+# Bumped whenever the same parameters would produce a different database
+DATASET_VERSION = 2
+
+
+def feature_name(index: int) -> str:
+    return f"feature_{index:04d}"
+
+
+def _flag_rows(rng: random.Random, customers: int, features: int,
+               customer_override_density: float, user_override_density: float) -> Iterator[FlagRow]:
+    for index in range(features):
+        name = feature_name(index)
+        customer_sample = rng.sample(range(customers), int(customers * customer_override_density))
+        for customer_id in customer_sample:
+            yield name, customer_id, None, rng.random() < 0.5
+        user_sample = rng.sample(range(customers * USERS_PER_CUSTOMER), int(customers * user_override_density))
+        for user_index in user_sample:
+            customer_id, user_offset = divmod(user_index, USERS_PER_CUSTOMER)
+            yield name, customer_id, customer_id * USER_ID_STRIDE + user_offset, rng.random() < 0.5
+
+
+def generate_dataset(db_path: str, customers: int, features: int, customer_override_density: float,
+                     user_override_density: float, seed: int = 0) -> Dict[str, float]:
+    """Build a fresh database at db_path and return the parameters used."""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    rng = random.Random(seed)
+    store = SQLiteFeatureFlagStore(db_path)
+    try:
+        with store.transaction():
+            store.add_customers_bulk(range(customers))
+            for index in range(features):
+                store.add_feature(feature_name(index), default_enabled=rng.random() < GLOBAL_ENABLED_RATIO)
+            store.set_flags_bulk(_flag_rows(rng, customers, features, customer_override_density, user_override_density))
+            store.add_feature(ROLLOUT_FEATURE, default_enabled=False)
+            store.set_rollout(ROLLOUT_FEATURE, ROLLOUT_PERCENTAGE)
+        store.conn.execute("VACUUM")
+    finally:
+        store.close()
+    return {
+        "customers": customers,
+        "features": features,
+        "customer_override_density": customer_override_density,
+        "user_override_density": user_override_density,
+        "seed": seed,
+    }
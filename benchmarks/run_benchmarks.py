@@ -0,0 +1,267 @@
+"""Time every FeatureFlagStore method against a seeded synthetic database.
+
+    python benchmarks/run_benchmarks.py --scale medium --output results.json
+    python benchmarks/run_benchmarks.py --scale medium --baseline results.json --fail-threshold 0.2
+
+Each method is called until it reaches --iterations calls or uses up its
+--time-budget. The run reports p50/p99 latency, throughput and the largest
+Python allocation of a single call, plus the process's peak RSS. Methods
+that write run after all reads, on a scratch copy of the cached dataset.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from dataset import DATASET_VERSION, ROLLOUT_FEATURE, SCALES, USER_ID_STRIDE, feature_name, generate_dataset  # noqa: E402
+from feature_flag_service import PAGE_SIZE, FeatureFlagService, SQLiteFeatureFlagStore  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+Case = Tuple[str, Callable[[FeatureFlagService, random.Random, int], object]]
+
+
+def build_cases(customers: int, features: int) -> List[Case]:
+    def feature(rng):
+        return feature_name(rng.randrange(features))
+
+    def customer(rng):
+        return rng.randrange(customers)
+
+    def user(rng):
+        return customer(rng) * USER_ID_STRIDE + rng.randrange(10)
+
+    def rename(service, rng, i):
+        names = (feature_name(0), "bench_renamed")
+        service.rename_feature(names[i % 2], names[(i + 1) % 2])
+
+    def drain(iterator):
+        return sum(1 for _ in iterator)
+
+    def rebuild_snapshot(service, rng, i):
+        service.invalidate_snapshot()
+        return service.sync_snapshot()
+
+    def grouped_writes(service, rng, i):
+        with service.transaction():
+            for _ in range(10):
+                service.set_flag(feature(rng), customer(rng), None, rng.random() < 0.5)
+
+    reads: List[Case] = [
+        ("list_all_features", lambda service, rng, i: service.list_all_features()),
+        ("list_all_customers", lambda service, rng, i: service.list_all_customers()),
+        ("describe_all_features", lambda service, rng, i: service.describe_all_features()),
+        ("list_customers_with_feature", lambda service, rng, i: service.list_customers_with_feature(feature(rng))),
+        ("count_customers_with_feature", lambda service, rng, i: service.count_customers_with_feature(feature(rng))),
+        ("list_customers_with_feature_explicitly_enabled",
+         lambda service, rng, i: service.list_customers_with_feature_explicitly_enabled(feature(rng))),
+        ("list_customers_with_feature_explicitly_disabled",
+         lambda service, rng, i: service.list_customers_with_feature_explicitly_disabled(feature(rng))),
+        ("page_all_customers", lambda service, rng, i: service.page_all_customers(customer(rng), PAGE_SIZE)),
+        ("page_customers_with_feature",
+         lambda service, rng, i: service.page_customers_with_feature(feature(rng), customer(rng), PAGE_SIZE)),
+        ("page_customers_with_feature_explicitly_enabled",
+         lambda service, rng, i: service.page_customers_with_feature_explicitly_enabled(feature(rng), customer(rng), PAGE_SIZE)),
+        ("page_customers_with_feature_explicitly_disabled",
+         lambda service, rng, i: service.page_customers_with_feature_explicitly_disabled(feature(rng), customer(rng), PAGE_SIZE)),
+        ("iter_all_customers", lambda service, rng, i: drain(service.iter_all_customers())),
+        ("iter_customers_with_feature", lambda service, rng, i: drain(service.iter_customers_with_feature(feature(rng)))),
+        ("iter_customers_with_feature_explicitly_enabled",
+         lambda service, rng, i: drain(service.iter_customers_with_feature_explicitly_enabled(feature(rng)))),
+        ("iter_customers_with_feature_explicitly_disabled",
+         lambda service, rng, i: drain(service.iter_customers_with_feature_explicitly_disabled(feature(rng)))),
+        ("list_features_for_customer", lambda service, rng, i: service.list_features_for_customer(customer(rng))),
+        ("list_rollouts", lambda service, rng, i: service.list_rollouts()),
+        ("list_customers_with_feature[rollout]",
+         lambda service, rng, i: service.list_customers_with_feature(ROLLOUT_FEATURE)),
+        ("count_customers_with_feature[rollout]",
+         lambda service, rng, i: service.count_customers_with_feature(ROLLOUT_FEATURE)),
+        ("evaluate_many", lambda service, rng, i: service.evaluate_many(feature(rng), range(0, customers, 10))),
+        ("evaluate_many[rollout]", lambda service, rng, i: service.evaluate_many(ROLLOUT_FEATURE, range(0, customers, 10))),
+        ("evaluate_matrix",
+         lambda service, rng, i: service.evaluate_matrix(range(0, customers, 100), [feature(rng) for _ in range(10)])),
+        ("evaluate_matrix[rollout]",
+         lambda service, rng, i: service.evaluate_matrix(range(0, customers, 100), [ROLLOUT_FEATURE, feature(rng)])),
+        ("export_flags", lambda service, rng, i: service.export_flags()),
+        ("current_version", lambda service, rng, i: service.current_version()),
+        ("changes_since", lambda service, rng, i: service.changes_since(max(0, service.current_version() - 1000))),
+        ("is_enabled", lambda service, rng, i: service.is_enabled(feature(rng), customer(rng), user(rng))),
+        ("is_enabled[rollout]", lambda service, rng, i: service.is_enabled(ROLLOUT_FEATURE, customer(rng), user(rng))),
+        ("sync_snapshot[rebuild]", rebuild_snapshot),
+    ]
+    writes: List[Case] = [
+        ("add_customer", lambda service, rng, i: service.add_customer(customers + i)),
+        ("add_customers_bulk",
+         lambda service, rng, i: service.add_customers_bulk(range(customers + 1_000_000 * (i + 1), customers + 1_000_000 * (i + 1) + 1000))),
+        ("add_feature", lambda service, rng, i: service.add_feature(f"bench_feature_{i}", default_enabled=False)),
+        ("set_global_flag", lambda service, rng, i: service.set_global_flag(feature(rng), rng.random() < 0.5)),
+        ("set_flag", lambda service, rng, i: service.set_flag(feature(rng), customer(rng), None, rng.random() < 0.5)),
+        ("set_flags_bulk",
+         lambda service, rng, i: service.set_flags_bulk([(feature(rng), customer(rng), None, rng.random() < 0.5) for _ in range(1000)])),
+        ("set_rollout", lambda service, rng, i: service.set_rollout(feature(rng), rng.random() * 100)),
+        ("clear_rollout", lambda service, rng, i: service.clear_rollout(feature(rng))),
+        ("transaction", grouped_writes),
+        ("rename_feature", rename),
+        ("remove_user", lambda service, rng, i: service.remove_user(user(rng))),
+        ("remove_customer", lambda service, rng, i: service.remove_customer(customer(rng))),
+        ("remove_feature", lambda service, rng, i: service.remove_feature(f"bench_feature_{i}")),
+        ("compact_changes", lambda service, rng, i: service.compact_changes(service.current_version())),
+    ]
+    return reads + writes
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    # Nearest-rank percentile
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def peak_rss_kib() -> Optional[int]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def run_case(service: FeatureFlagService, call, seed: int, iterations: int, time_budget: float) -> Dict[str, float]:
+    rng = random.Random(seed)
+    call(service, rng, 0)  # warm-up: page cache, statement cache
+    latencies = []
+    started = time.perf_counter()
+    for i in range(1, iterations + 1):
+        begin = time.perf_counter()
+        call(service, rng, i)
+        latencies.append(time.perf_counter() - begin)
+        if time.perf_counter() - started > time_budget and len(latencies) >= 5:
+            break
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    call(service, rng, len(latencies) + 1)
+    _, peak_alloc = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "iterations": len(latencies),
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "throughput_per_s": len(latencies) / elapsed if elapsed else float("inf"),
+        "peak_alloc_kib": peak_alloc / 1024,
+    }
+
+
+def run_benchmarks(params: Dict[str, float], iterations: int, time_budget: float, only: Optional[List[str]] = None,
+                   regenerate: bool = False, bitmap_index: bool = False) -> dict:
+    os.makedirs(DATA_DIR, exist_ok=True)
+    key = "_".join(f"{name}-{params[name]}" for name in sorted(params))
+    cached_path = os.path.join(DATA_DIR, f"dataset_v{DATASET_VERSION}_{key}.db")
+    if regenerate or not os.path.exists(cached_path):
+        generate_dataset(cached_path, **params)
+    work_path = os.path.join(DATA_DIR, "work.db")
+    shutil.copyfile(cached_path, work_path)
+
+    service = FeatureFlagService(SQLiteFeatureFlagStore(work_path, bitmap_index=bitmap_index))
+    results = {}
+    try:
+        for index, (name, call) in enumerate(build_cases(int(params["customers"]), int(params["features"]))):
+            if only and name not in only:
+                continue
+            results[name] = run_case(service, call, params["seed"] + index, iterations, time_budget)
+            print(f"{name:50s} p50 {results[name]['p50_ms']:10.3f} ms   p99 {results[name]['p99_ms']:10.3f} ms", file=sys.stderr)
+    finally:
+        service.close()
+        os.remove(work_path)
+
+    return {
+        "meta": {
+            "params": params,
+            "iterations": iterations,
+            "time_budget_s": time_budget,
+            "bitmap_index": bitmap_index,
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+        "peak_rss_kib": peak_rss_kib(),
+        "results": results,
+    }
+
+
+def compare(report: dict, baseline: dict, threshold: Optional[float]) -> List[str]:
+    """Print p50/p99 ratios against the baseline; return the methods that regressed past threshold."""
+    regressions = []
+    print(f"{'method':50s} {'p50 ratio':>10s} {'p99 ratio':>10s}", file=sys.stderr)
+    for name, result in report["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if not old:
+            continue
+        p50_ratio = result["p50_ms"] / old["p50_ms"] if old["p50_ms"] else float("inf")
+        p99_ratio = result["p99_ms"] / old["p99_ms"] if old["p99_ms"] else float("inf")
+        flag = ""
+        if threshold is not None and p50_ratio > 1 + threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:50s} {p50_ratio:10.2f} {p99_ratio:10.2f}{flag}", file=sys.stderr)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Feature flag store benchmarks")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--customers", type=int, help="Override the scale's customer count")
+    parser.add_argument("--features", type=int, help="Override the scale's feature count")
+    parser.add_argument("--customer-override-density", type=float, help="Customer-level overrides per customer and feature")
+    parser.add_argument("--user-override-density", type=float, help="User-level overrides per customer and feature")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--time-budget", type=float, default=2.0, help="Seconds per method before stopping early")
+    parser.add_argument("--only", nargs="+", help="Benchmark only these methods")
+    parser.add_argument("--bitmap-index", action="store_true")
+    parser.add_argument("--regenerate", action="store_true", help="Rebuild the cached dataset")
+    parser.add_argument("--output", help="Write the JSON report here (default: stdout)")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument("--fail-threshold", type=float, help="Exit 1 if any p50 is this fraction slower than baseline")
+    args = parser.parse_args()
+
+    params = dict(SCALES[args.scale])
+    for name in ("customers", "features", "customer_override_density", "user_override_density"):
+        if getattr(args, name) is not None:
+            params[name] = getattr(args, name)
+    params["customers"], params["features"] = int(params["customers"]), int(params["features"])
+    params["seed"] = args.seed
+
+    report = run_benchmarks(params, args.iterations, args.time_budget, args.only, args.regenerate, args.bitmap_index)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.fail_threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+from abc import ABC, abstractmethod
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from feature_flag_service import (
+    BULK_CHUNK_SIZE, PAGE_SIZE, FeatureFlagService, FeatureFlagSnapshot, FeatureFlagStore, FlagRow,
+    PooledSQLiteFeatureFlagStore, Rollout,
+)
+
+
+async def iter_pages(fetch_page: Callable[[Optional[int]], Awaitable[List[int]]], page_size: int) -> AsyncIterator[int]:
+    after = None
+    while True:
+        page = await fetch_page(after)
+        for item in page:
+            yield item
+        if len(page) < page_size:
+            return
+        after = page[-1]
+
+
+class AsyncFeatureFlagStore(ABC):
+    @abstractmethod
+    async def add_customer(self, customer_id: int): pass
+
+    @abstractmethod
+    async def add_feature(self, feature_name: str, default_enabled: bool = True): pass
+
+    @abstractmethod
+    async def set_global_flag(self, feature_name: str, is_enabled: bool): pass
+
+    @abstractmethod
+    async def remove_feature(self, feature_name: str): pass
+
+    @abstractmethod
+    async def rename_feature(self, old_name: str, new_name: str): pass
+
+    @abstractmethod
+    async def set_flag(self, feature_name: str, customer_id: Optional[int], user_id: Optional[int], is_enabled: bool): pass
+
+    @abstractmethod
+    async def set_flags_bulk(self, flags: Iterable[FlagRow], chunk_size: int = BULK_CHUNK_SIZE) -> int: pass
+
+    @abstractmethod
+    async def add_customers_bulk(self, customer_ids: Iterable[int], chunk_size: int = BULK_CHUNK_SIZE) -> int: pass
+
+    @abstractmethod
+    async def set_rollout(self, feature_name: str, percentage: float, salt: Optional[str] = None,
+                          min_customer_id: Optional[int] = None, max_customer_id: Optional[int] = None): pass
+
+    @abstractmethod
+    async def clear_rollout(self, feature_name: str): pass
+
+    @abstractmethod
+    async def list_rollouts(self) -> Dict[str, Rollout]: pass
+
+    @abstractmethod
+    async def remove_customer(self, customer_id: int): pass
+
+    @abstractmethod
+    async def remove_user(self, user_id: int): pass
+
+    @abstractmethod
+    async def list_customers_with_feature(self, feature_name: str) -> List[int]: pass
+
+    @abstractmethod
+    async def count_customers_with_feature(self, feature_name: str) -> int: pass
+
+    @abstractmethod
+    async def list_customers_with_feature_explicitly_enabled(self, feature_name: str) -> List[int]: pass
+
+    @abstractmethod
+    async def list_customers_with_feature_explicitly_disabled(self, feature_name: str) -> List[int]: pass
+
+    @abstractmethod
+    async def page_all_customers(self, after: Optional[int] = None, limit: int = PAGE_SIZE) -> List[int]: pass
+
+    @abstractmethod
+    async def page_customers_with_feature(self, feature_name: str, after: Optional[int] = None,
+                                          limit: int = PAGE_SIZE) -> List[int]: pass
+
+    @abstractmethod
+    async def page_customers_with_feature_explicitly_enabled(self, feature_name: str, after: Optional[int] = None,
+                                                             limit: int = PAGE_SIZE) -> List[int]: pass
+
+    @abstractmethod
+    async def page_customers_with_feature_explicitly_disabled(self, feature_name: str, after: Optional[int] = None,
+                                                              limit: int = PAGE_SIZE) -> List[int]: pass
+
+    def iter_all_customers(self, page_size: int = PAGE_SIZE) -> AsyncIterator[int]:
+        return iter_pages(lambda after: self.page_all_customers(after, page_size), page_size)
+
+    def iter_customers_with_feature(self, feature_name: str, page_size: int = PAGE_SIZE) -> AsyncIterator[int]:
+        return iter_pages(lambda after: self.page_customers_with_feature(feature_name, after, page_size), page_size)
+
+    def iter_customers_with_feature_explicitly_enabled(self, feature_name: str,
+                                                       page_size: int = PAGE_SIZE) -> AsyncIterator[int]:
+        return iter_pages(
+            lambda after: self.page_customers_with_feature_explicitly_enabled(feature_name, after, page_size), page_size)
+
+    def iter_customers_with_feature_explicitly_disabled(self, feature_name: str,
+                                                        page_size: int = PAGE_SIZE) -> AsyncIterator[int]:
+        return iter_pages(
+            lambda after: self.page_customers_with_feature_explicitly_disabled(feature_name, after, page_size), page_size)
+
+    @abstractmethod
+    async def list_features_for_customer(self, customer_id: int) -> List[str]: pass
+
+    @abstractmethod
+    async def list_all_features(self) -> List[str]: pass
+
+    @abstractmethod
+    async def describe_all_features(self) -> List[Dict[str, Union[str, bool, List[int]]]]: pass
+
+    @abstractmethod
+    async def list_all_customers(self) -> List[int]: pass
+
+    @abstractmethod
+    async def evaluate_many(self, feature_name: str, customer_ids: Iterable[int]) -> Dict[int, bool]: pass
+
+    @abstractmethod
+    async def evaluate_matrix(self, customer_ids: Iterable[int], feature_names: Iterable[str]) -> Dict[int, Dict[str, bool]]: pass
+
+    @abstractmethod
+    async def export_flags(self) -> Tuple[Dict[str, bool], List[FlagRow]]: pass
+
+    @abstractmethod
+    async def current_version(self) -> int: pass
+
+    @abstractmethod
+    async def changes_since(self, version: int, limit: Optional[int] = None) -> List[Dict[str, Any]]: pass
+
+    @abstractmethod
+    async def compact_changes(self, through_version: int) -> int: pass
+
+    @abstractmethod
+    async def close(self): pass
+
+
+class ExecutorFeatureFlagStore(AsyncFeatureFlagStore):
+    """Runs a blocking FeatureFlagStore on a bounded thread pool.
+
+    The wrapped store must be usable from the pool's threads, e.g. a
+    PooledSQLiteFeatureFlagStore. Identical reads issued while one is already
+    running share its result, so callers must treat results as read-only.
+    A read issued after a write through this store started never shares a
+    read that was issued before it.
+    """
+
+    WRITE_METHODS = FeatureFlagService.MUTATING_METHODS | {"compact_changes"}
+
+    def __init__(self, store: FeatureFlagStore, max_workers: int = 4):
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="feature-flags")
+        self._in_flight: Dict[tuple, asyncio.Future] = {}
+        # Bumped when a write starts and when it finishes; part of the
+        # coalescing key
+        self._write_generation = 0
+
+    @classmethod
+    def open(cls, db_path: str = "feature_flags.db", max_workers: int = 4, **pool_options) -> "ExecutorFeatureFlagStore":
+        return cls(PooledSQLiteFeatureFlagStore(db_path, **pool_options), max_workers=max_workers)
+
+    async def _run(self, method: str, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        call = functools.partial(getattr(self.store, method), *args)
+        if method not in self.WRITE_METHODS:
+            return await loop.run_in_executor(self._executor, call)
+        self._write_generation += 1
+        try:
+            return await loop.run_in_executor(self._executor, call)
+        finally:
+            self._write_generation += 1
+
+    async def _read(self, method: str, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        key = (loop, self._write_generation, method, args)
+        future = self._in_flight.get(key)
+        if future is None:
+            future = loop.create_task(self._run(method, *args))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # Shield so one cancelled caller does not cancel the query for the rest
+        return await asyncio.shield(future)
+
+    async def add_customer(self, customer_id: int):
+        return await self._run("add_customer", customer_id)
+
+    async def add_feature(self, feature_name: str, default_enabled: bool = True):
+        return await self._run("add_feature", feature_name, default_enabled)
+
+    async def set_global_flag(self, feature_name: str, is_enabled: bool):
+        return await self._run("set_global_flag", feature_name, is_enabled)
+
+    async def remove_feature(self, feature_name: str):
+        return await self._run("remove_feature", feature_name)
+
+    async def rename_feature(self, old_name: str, new_name: str):
+        return await self._run("rename_feature", old_name, new_name)
+
+    async def set_flag(self, feature_name: str, customer_id: Optional[int], user_id: Optional[int], is_enabled: bool):
+        return await self._run("set_flag", feature_name, customer_id, user_id, is_enabled)
+
+    async def set_flags_bulk(self, flags: Iterable[FlagRow], chunk_size: int = BULK_CHUNK_SIZE) -> int:
+        return await self._run("set_flags_bulk", flags, chunk_size)
+
+    async def add_customers_bulk(self, customer_ids: Iterable[int], chunk_size: int = BULK_CHUNK_SIZE) -> int:
+        return await self._run("add_customers_bulk", customer_ids, chunk_size)
+
+    async def set_rollout(self, feature_name: str, percentage: float, salt: Optional[str] = None,
+                          min_customer_id: Optional[int] = None, max_customer_id: Optional[int] = None):
+        return await self._run("set_rollout", feature_name, percentage, salt, min_customer_id, max_customer_id)
+
+    async def clear_rollout(self, feature_name: str):
+        return await self._run("clear_rollout", feature_name)
+
+    async def list_rollouts(self) -> Dict[str, Rollout]:
+        return await self._read("list_rollouts")
+
+    async def remove_customer(self, customer_id: int):
+        return await self._run("remove_customer", customer_id)
+
+    async def remove_user(self, user_id: int):
+        return await self._run("remove_user", user_id)
+
+    async def list_customers_with_feature(self, feature_name: str) -> List[int]:
+        return await self._read("list_customers_with_feature", feature_name)
+
+    async def count_customers_with_feature(self, feature_name: str) -> int:
+        return await self._read("count_customers_with_feature", feature_name)
+
+    async def list_customers_with_feature_explicitly_enabled(self, feature_name: str) -> List[int]:
+        return await self._read("list_customers_with_feature_explicitly_enabled", feature_name)
+
+    async def list_customers_with_feature_explicitly_disabled(self, feature_name: str) -> List[int]:
+        return await self._read("list_customers_with_feature_explicitly_disabled", feature_name)
+
+    async def page_all_customers(self, after: Optional[int] = None, limit: int = PAGE_SIZE) -> List[int]:
+        return await self._read("page_all_customers", after, limit)
+
+    async def page_customers_with_feature(self, feature_name: str, after: Optional[int] = None,
+                                          limit: int = PAGE_SIZE) -> List[int]:
+        return await self._read("page_customers_with_feature", feature_name, after, limit)
+
+    async def page_customers_with_feature_explicitly_enabled(self, feature_name: str, after: Optional[int] = None,
+                                                             limit: int = PAGE_SIZE) -> List[int]:
+        return await self._read("page_customers_with_feature_explicitly_enabled", feature_name, after, limit)
+
+    async def page_customers_with_feature_explicitly_disabled(self, feature_name: str, after: Optional[int] = None,
+                                                              limit: int = PAGE_SIZE) -> List[int]:
+        return await self._read("page_customers_with_feature_explicitly_disabled", feature_name, after, limit)
+
+    async def list_features_for_customer(self, customer_id: int) -> List[str]:
+        return await self._read("list_features_for_customer", customer_id)
+
+    async def list_all_features(self) -> List[str]:
+        return await self._read("list_all_features")
+
+    async def describe_all_features(self) -> List[Dict[str, Union[str, bool, List[int]]]]:
+        return await self._read("describe_all_features")
+
+    async def list_all_customers(self) -> List[int]:
+        return await self._read("list_all_customers")
+
+    async def evaluate_many(self, feature_name: str, customer_ids: Iterable[int]) -> Dict[int, bool]:
+        return await self._read("evaluate_many", feature_name, tuple(customer_ids))
+
+    async def evaluate_matrix(self, customer_ids: Iterable[int], feature_names: Iterable[str]) -> Dict[int, Dict[str, bool]]:
+        return await self._read("evaluate_matrix", tuple(customer_ids), tuple(feature_names))
+
+    async def export_flags(self) -> Tuple[Dict[str, bool], List[FlagRow]]:
+        return await self._read("export_flags")
+
+    async def current_version(self) -> int:
+        return await self._read("current_version")
+
+    async def changes_since(self, version: int, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        return await self._read("changes_since", version, limit)
+
+    async def compact_changes(self, through_version: int) -> int:
+        return await self._run("compact_changes", through_version)
+
+    async def close(self):
+        try:
+            await self._run("close")
+        finally:
+            self._executor.shutdown(wait=False)
+
+
+class AsyncFeatureFlagService:
+    MUTATING_METHODS = FeatureFlagService.MUTATING_METHODS
+
+    def __init__(self, store: AsyncFeatureFlagStore):
+        self.store = store
+        self._snapshot: Optional[FeatureFlagSnapshot] = None
+        self._snapshot_task: Optional[asyncio.Future] = None
+
+    def __getattr__(self, item):
+        attr = getattr(self.store, item)
+        if item not in self.MUTATING_METHODS:
+            return attr
+
+        async def mutator(*args, **kwargs):
+            try:
+                return await attr(*args, **kwargs)
+            finally:
+                self.invalidate_snapshot()
+        return mutator
+
+    async def _build_snapshot(self) -> FeatureFlagSnapshot:
+        global_flags, overrides = await self.store.export_flags()
+        return FeatureFlagSnapshot(global_flags, overrides, rollouts=await self.store.list_rollouts())
+
+    async def snapshot(self) -> FeatureFlagSnapshot:
+        if self._snapshot is not None:
+            return self._snapshot
+        # Concurrent first lookups wait on a single rebuild
+        task = self._snapshot_task
+        if task is None:
+            task = self._snapshot_task = asyncio.ensure_future(self._build_snapshot())
+        snapshot = await asyncio.shield(task)
+        if self._snapshot_task is task:
+            self._snapshot, self._snapshot_task = snapshot, None
+        return snapshot
+
+    def invalidate_snapshot(self):
+        self._snapshot = None
+        self._snapshot_task = None
+
+    async def is_enabled(self, feature_name: str, customer_id: Optional[int], user_id: Optional[int] = None) -> bool:
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = await self.snapshot()
+        return snapshot.is_enabled(feature_name, customer_id, user_id)
@@ -0,0 +1,220 @@
+"""Memory-mapped binary flag snapshots.
+
+``write_binary_snapshot`` serializes a store into one file that worker
+processes open with ``BinarySnapshot``. The file is mapped read-only, so every
+worker shares the same page-cache pages and opening it costs the same no
+matter how many overrides it holds; lookups binary-search the mapped arrays.
+
+Layout (little-endian, every section 8-byte aligned)::
+
+    header    magic, format version, feature count, store version
+    features  one fixed-size entry per feature, sorted by name, including
+              its rollout rule if any
+    names     UTF-8 feature names and rollout salts, referenced by offset
+              from the entries
+    arrays    per feature: customer ids (int64, sorted) + states (uint8),
+              user ids (int64) + their customer ids (int64, NO_CUSTOMER for
+              none), sorted by (user id, customer id), + states (uint8)
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+import mmap
+import os
+import struct
+import sys
+from typing import Dict, List, Optional
+
+from feature_flag_service import MAX_CUSTOMER_ID, MIN_CUSTOMER_ID, FeatureFlagSnapshot, FeatureFlagStore, Rollout
+
+MAGIC = b"FFSNAP\x00\x00"
+FORMAT_VERSION = 2
+NO_CUSTOMER = -(1 << 63)
+
+HEADER = struct.Struct("<8sIIQ")
+# name offset, name length, global flag, has rollout, customer offset/count,
+# user offset/count, rollout percentage, min/max customer id, salt offset/length
+FEATURE_ENTRY = struct.Struct("<QIBB2xQQQQdqqQI4x")
+
+
+def _align(size: int) -> int:
+    return (size + 7) & ~7
+
+
+def _int64_bytes(values) -> bytes:
+    data = array("q", values)
+    if sys.byteorder != "little":
+        data.byteswap()
+    return data.tobytes()
+
+
+def write_binary_snapshot(store: FeatureFlagStore, path: str) -> FeatureFlagSnapshot:
+    """Write the store's current flags to ``path``, atomically replacing it."""
+    snapshot = FeatureFlagSnapshot.from_store(store)
+    customer_overrides: Dict[str, Dict[int, bool]] = {}
+    for (name, customer_id), is_enabled in snapshot.customer_overrides.items():
+        customer_overrides.setdefault(name, {})[customer_id] = is_enabled
+    user_overrides: Dict[str, Dict[tuple, bool]] = {}
+    for (name, customer_id, user_id), is_enabled in snapshot.user_overrides.items():
+        key = (user_id, NO_CUSTOMER if customer_id is None else customer_id)
+        user_overrides.setdefault(name, {})[key] = is_enabled
+
+    rollouts = snapshot.rollouts
+    names = sorted(set(snapshot.global_flags) | set(customer_overrides) | set(user_overrides) | set(rollouts))
+    encoded_names = [name.encode() for name in names]
+    encoded_salts = [rollouts[name].salt.encode() if name in rollouts else b"" for name in names]
+    names_offset = _align(HEADER.size + FEATURE_ENTRY.size * len(names))
+    names_blob = b"".join(encoded_names) + b"".join(encoded_salts)
+    arrays_offset = _align(names_offset + len(names_blob))
+
+    entries, chunks = [], []
+    name_offset, position = names_offset, arrays_offset
+    salt_offset = names_offset + sum(len(encoded) for encoded in encoded_names)
+    for name, encoded, encoded_salt in zip(names, encoded_names, encoded_salts):
+        customers = sorted(customer_overrides.get(name, {}).items())
+        users = sorted(user_overrides.get(name, {}).items())
+        customer_offset = position
+        chunk = _int64_bytes(customer_id for customer_id, _ in customers)
+        chunk += bytes(is_enabled for _, is_enabled in customers)
+        chunk += b"\0" * (_align(len(chunk)) - len(chunk))
+        user_offset = customer_offset + len(chunk)
+        user_chunk = _int64_bytes(user_id for (user_id, _), _ in users)
+        user_chunk += _int64_bytes(customer_id for (_, customer_id), _ in users)
+        user_chunk += bytes(is_enabled for _, is_enabled in users)
+        user_chunk += b"\0" * (_align(len(user_chunk)) - len(user_chunk))
+        chunks.append(chunk + user_chunk)
+        position = user_offset + len(user_chunk)
+        rollout = rollouts.get(name)
+        entries.append(FEATURE_ENTRY.pack(
+            name_offset, len(encoded), snapshot.global_flags.get(name, False), rollout is not None,
+            customer_offset, len(customers), user_offset, len(users),
+            rollout.percentage if rollout else 0.0,
+            MIN_CUSTOMER_ID if rollout is None or rollout.min_customer_id is None else rollout.min_customer_id,
+            MAX_CUSTOMER_ID if rollout is None or rollout.max_customer_id is None else rollout.max_customer_id,
+            salt_offset, len(encoded_salt),
+        ))
+        name_offset += len(encoded)
+        salt_offset += len(encoded_salt)
+
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(names), snapshot.version))
+        f.write(b"".join(entries))
+        f.write(b"\0" * (names_offset - f.tell()))
+        f.write(names_blob)
+        f.write(b"\0" * (arrays_offset - f.tell()))
+        for chunk in chunks:
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    # Readers keep their old mapping until they reopen
+    os.replace(tmp_path, path)
+    return snapshot
+
+
+class _FeatureArrays:
+    __slots__ = ("global_enabled", "rollout", "customer_ids", "customer_states", "user_ids", "user_customer_ids",
+                 "user_states")
+
+
+class BinarySnapshot:
+    """Read-only view over a file written by write_binary_snapshot."""
+
+    def __init__(self, path: str):
+        if sys.byteorder != "little":
+            raise RuntimeError("Binary snapshots can only be mapped on little-endian hosts")
+        self.path = path
+        with open(path, "rb") as f:
+            self._stat = os.fstat(f.fileno())
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views: List[memoryview] = []
+        view = self._view(0, len(self._mmap))
+        magic, format_version, feature_count, self.version = HEADER.unpack_from(view, 0)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} feature flag snapshot")
+
+        self._features: Dict[str, _FeatureArrays] = {}
+        for index in range(feature_count):
+            (name_offset, name_length, global_enabled, has_rollout, customer_offset, customer_count,
+             user_offset, user_count, percentage, min_customer_id, max_customer_id, salt_offset,
+             salt_length) = FEATURE_ENTRY.unpack_from(view, HEADER.size + index * FEATURE_ENTRY.size)
+            feature = _FeatureArrays()
+            feature.global_enabled = bool(global_enabled)
+            feature.rollout = None
+            if has_rollout:
+                feature.rollout = Rollout(
+                    percentage, bytes(view[salt_offset:salt_offset + salt_length]).decode(),
+                    None if min_customer_id == MIN_CUSTOMER_ID else min_customer_id,
+                    None if max_customer_id == MAX_CUSTOMER_ID else max_customer_id,
+                )
+            feature.customer_ids = self._view(customer_offset, customer_count * 8, "q")
+            feature.customer_states = self._view(customer_offset + customer_count * 8, customer_count)
+            feature.user_ids = self._view(user_offset, user_count * 8, "q")
+            feature.user_customer_ids = self._view(user_offset + user_count * 8, user_count * 8, "q")
+            feature.user_states = self._view(user_offset + user_count * 16, user_count)
+            name = sys.intern(bytes(view[name_offset:name_offset + name_length]).decode())
+            self._features[name] = feature
+
+    def _view(self, offset: int, length: int, fmt: str = "B") -> memoryview:
+        view = memoryview(self._mmap)[offset:offset + length]
+        if fmt != "B":
+            view = view.cast(fmt)
+        self._views.append(view)
+        return view
+
+    @property
+    def feature_names(self) -> List[str]:
+        return list(self._features)
+
+    def is_enabled(self, feature_name: str, customer_id: Optional[int], user_id: Optional[int] = None) -> bool:
+        # Same precedence as FeatureFlagSnapshot.is_enabled
+        feature = self._features.get(feature_name)
+        if feature is None:
+            return False
+        if user_id is not None:
+            user_ids = feature.user_ids
+            start = bisect_left(user_ids, user_id)
+            end = bisect_right(user_ids, user_id, start)
+            if start != end:
+                # Users rarely have more than a handful of rows per feature
+                fallback = None
+                for index in range(start, end):
+                    row_customer_id = feature.user_customer_ids[index]
+                    if row_customer_id == customer_id:
+                        return bool(feature.user_states[index])
+                    if row_customer_id == NO_CUSTOMER:
+                        fallback = bool(feature.user_states[index])
+                if fallback is not None:
+                    return fallback
+        if customer_id is not None:
+            customer_ids = feature.customer_ids
+            index = bisect_left(customer_ids, customer_id)
+            if index < len(customer_ids) and customer_ids[index] == customer_id:
+                return bool(feature.customer_states[index])
+        if feature.global_enabled:
+            return True
+        return feature.rollout is not None and customer_id is not None and feature.rollout.includes(customer_id)
+
+    def enabled_features(self, customer_id: Optional[int], user_id: Optional[int] = None) -> List[str]:
+        return [name for name in self._features if self.is_enabled(name, customer_id, user_id)]
+
+    def changed_on_disk(self) -> bool:
+        # True once a newer snapshot has replaced the mapped file
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return True
+        return (stat.st_ino, stat.st_mtime_ns) != (self._stat.st_ino, self._stat.st_mtime_ns)
+
+    def close(self):
+        self._features = {}
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mmap.close()
+
+    def __enter__(self) -> "BinarySnapshot":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
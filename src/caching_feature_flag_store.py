@@ -0,0 +1,311 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from feature_flag_service import BULK_CHUNK_SIZE, PAGE_SIZE, FeatureFlagStore, FlagRow, Rollout
+
+# Invalidation tags. A cached read is tagged with everything its result
+# depends on; a write drops exactly the entries carrying the tags it touches.
+CUSTOMERS = ("customers",)      # the set of registered customers
+GLOBAL_FLAGS = ("global_flags",)  # the global flag table, i.e. which features exist
+OVERRIDES = ("overrides",)      # any per-customer or per-user override
+ROLLOUTS = ("rollouts",)        # any rollout
+# remove_customer and remove_user delete overrides without saying which
+# features they belonged to, so they drop every read that depends on overrides.
+REMOVALS = ("removals",)
+
+
+def feature_tag(feature_name: str) -> Tuple[str, str]:
+    return ("feature", feature_name)
+
+
+def customer_tag(customer_id: int) -> Tuple[str, int]:
+    return ("customer", customer_id)
+
+
+class CachingFeatureFlagStore(FeatureFlagStore):
+    """Read-through LRU cache in front of another store.
+
+    Reads are served from up to ``max_entries`` cached results, each kept for
+    at most ``ttl`` seconds. Writes go straight to the inner store and evict
+    the cached results they affect, so this process always reads its own
+    writes; the TTL bounds how long writes made through other stores or
+    processes can go unseen. The change log and export_flags() are never
+    cached, so snapshots stay exact. Cached results are shared between
+    callers and must be treated as read-only. Attributes the wrapper does not
+    define, such as storage_stats(), are forwarded to the inner store.
+    """
+
+    def __init__(self, inner: FeatureFlagStore, max_entries: int = 10000, ttl: float = 60.0,
+                 clock: Callable[[], float] = time.monotonic):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1.")
+        self.inner = inner
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> (result, expires_at, tags), least recently used first
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float, Tuple[Hashable, ...]]]" = OrderedDict()
+        self._keys_by_tag: Dict[Hashable, Set[Hashable]] = {}
+        # tag -> [loads in progress, generation]; invalidate() bumps the
+        # generation so a load that raced a write is not cached
+        self._loading: Dict[Hashable, List[int]] = {}
+        # Per thread: tags written by its open transaction, if any
+        self._local = threading.local()
+
+    def __getattr__(self, item):
+        if item == "inner":
+            raise AttributeError(item)
+        return getattr(self.inner, item)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _cached(self, key: Hashable, tags: Tuple[Hashable, ...], load: Callable[[], Any]) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > self.clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                self._evict(key)
+            self.misses += 1
+            generations = []
+            for tag in tags:
+                state = self._loading.setdefault(tag, [0, 0])
+                state[0] += 1
+                generations.append(state[1])
+        try:
+            result = load()
+        except BaseException:
+            with self._lock:
+                self._end_load(tags)
+            raise
+        with self._lock:
+            if self._end_load(tags) != generations:
+                return result
+            self._evict(key)
+            self._entries[key] = (result, self.clock() + self.ttl, tags)
+            for tag in tags:
+                self._keys_by_tag.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._evict(next(iter(self._entries)))
+        return result
+
+    def _end_load(self, tags: Tuple[Hashable, ...]) -> List[int]:
+        # Caller holds the lock; returns the tags' current generations
+        generations = []
+        for tag in tags:
+            state = self._loading[tag]
+            generations.append(state[1])
+            state[0] -= 1
+            if not state[0]:
+                del self._loading[tag]
+        return generations
+
+    def _evict(self, key: Hashable):
+        # Caller holds the lock
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._keys_by_tag[tag]
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_tag[tag]
+
+    def invalidate(self, *tags: Hashable):
+        with self._lock:
+            for tag in tags:
+                state = self._loading.get(tag)
+                if state is not None:
+                    state[1] += 1
+                for key in list(self._keys_by_tag.get(tag, ())):
+                    self._evict(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_tag.clear()
+            for state in self._loading.values():
+                state[1] += 1
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        outermost = getattr(self._local, "written", None) is None
+        if outermost:
+            self._local.written = {}
+        try:
+            with self.inner.transaction():
+                yield
+        except BaseException:
+            # Reads inside the transaction may have cached rolled-back writes
+            if outermost:
+                self._local.written = None
+            self.clear()
+            raise
+        if outermost:
+            # Other threads may have cached the pre-commit state since the
+            # writes invalidated it
+            written, self._local.written = self._local.written, None
+            self.invalidate(*written)
+
+    def _write(self, tags: Iterable[Hashable], write: Callable[[], Any]) -> Any:
+        # Evict after the write too, in case a read cached the old value in between
+        tags = tuple(tags)
+        written = getattr(self._local, "written", None)
+        if written is not None:
+            written.update(dict.fromkeys(tags))
+        self.invalidate(*tags)
+        try:
+            return write()
+        finally:
+            self.invalidate(*tags)
+
+    def add_customer(self, customer_id: int):
+        self._write((CUSTOMERS,), lambda: self.inner.add_customer(customer_id))
+
+    def add_customers_bulk(self, customer_ids: Iterable[int], chunk_size: int = BULK_CHUNK_SIZE) -> int:
+        return self._write((CUSTOMERS,), lambda: self.inner.add_customers_bulk(customer_ids, chunk_size))
+
+    def add_feature(self, feature_name: str, default_enabled: bool = True):
+        self._write((feature_tag(feature_name), GLOBAL_FLAGS),
+                    lambda: self.inner.add_feature(feature_name, default_enabled))
+
+    def set_global_flag(self, feature_name: str, is_enabled: bool):
+        self._write((feature_tag(feature_name), GLOBAL_FLAGS),
+                    lambda: self.inner.set_global_flag(feature_name, is_enabled))
+
+    def remove_feature(self, feature_name: str):
+        self._write((feature_tag(feature_name), GLOBAL_FLAGS, OVERRIDES, ROLLOUTS),
+                    lambda: self.inner.remove_feature(feature_name))
+
+    def rename_feature(self, old_name: str, new_name: str):
+        self._write((feature_tag(old_name), feature_tag(new_name), GLOBAL_FLAGS, OVERRIDES, ROLLOUTS),
+                    lambda: self.inner.rename_feature(old_name, new_name))
+
+    @staticmethod
+    def _flag_tags(feature_name: str, customer_id: Optional[int]) -> List[Hashable]:
+        tags: List[Hashable] = [feature_tag(feature_name), OVERRIDES]
+        if customer_id is not None:
+            tags.append(customer_tag(customer_id))
+        return tags
+
+    def set_flag(self, feature_name: str, customer_id: Optional[int], user_id: Optional[int], is_enabled: bool):
+        self._write(self._flag_tags(feature_name, customer_id),
+                    lambda: self.inner.set_flag(feature_name, customer_id, user_id, is_enabled))
+
+    def set_flags_bulk(self, flags: Iterable[FlagRow], chunk_size: int = BULK_CHUNK_SIZE) -> int:
+        flags = list(flags)
+        tags = dict.fromkeys(tag for feature_name, customer_id, _, _ in flags
+                             for tag in self._flag_tags(feature_name, customer_id))
+        return self._write(tags, lambda: self.inner.set_flags_bulk(flags, chunk_size))
+
+    def set_rollout(self, feature_name: str, percentage: float, salt: Optional[str] = None,
+                    min_customer_id: Optional[int] = None, max_customer_id: Optional[int] = None):
+        self._write((feature_tag(feature_name), ROLLOUTS), lambda: self.inner.set_rollout(
+            feature_name, percentage, salt, min_customer_id, max_customer_id))
+
+    def clear_rollout(self, feature_name: str):
+        self._write((feature_tag(feature_name), ROLLOUTS), lambda: self.inner.clear_rollout(feature_name))
+
+    def remove_customer(self, customer_id: int):
+        self._write((CUSTOMERS, customer_tag(customer_id), OVERRIDES, REMOVALS),
+                    lambda: self.inner.remove_customer(customer_id))
+
+    def remove_user(self, user_id: int):
+        self._write((OVERRIDES, REMOVALS), lambda: self.inner.remove_user(user_id))
+
+    def list_rollouts(self) -> Dict[str, Rollout]:
+        return self.inner.list_rollouts()
+
+    def list_customers_with_feature(self, feature_name: str) -> List[int]:
+        return self._cached(("list_customers_with_feature", feature_name),
+                            (feature_tag(feature_name), CUSTOMERS, REMOVALS),
+                            lambda: self.inner.list_customers_with_feature(feature_name))
+
+    def count_customers_with_feature(self, feature_name: str) -> int:
+        return self._cached(("count_customers_with_feature", feature_name),
+                            (feature_tag(feature_name), CUSTOMERS, REMOVALS),
+                            lambda: self.inner.count_customers_with_feature(feature_name))
+
+    def list_customers_with_feature_explicitly_enabled(self, feature_name: str) -> List[int]:
+        return self._cached(("list_customers_with_feature_explicitly_enabled", feature_name),
+                            (feature_tag(feature_name), REMOVALS),
+                            lambda: self.inner.list_customers_with_feature_explicitly_enabled(feature_name))
+
+    def list_customers_with_feature_explicitly_disabled(self, feature_name: str) -> List[int]:
+        return self._cached(("list_customers_with_feature_explicitly_disabled", feature_name),
+                            (feature_tag(feature_name), REMOVALS),
+                            lambda: self.inner.list_customers_with_feature_explicitly_disabled(feature_name))
+
+    def page_all_customers(self, after: Optional[int] = None, limit: int = PAGE_SIZE) -> List[int]:
+        return self._cached(("page_all_customers", after, limit), (CUSTOMERS,),
+                            lambda: self.inner.page_all_customers(after, limit))
+
+    def page_customers_with_feature(self, feature_name: str, after: Optional[int] = None,
+                                    limit: int = PAGE_SIZE) -> List[int]:
+        return self._cached(("page_customers_with_feature", feature_name, after, limit),
+                            (feature_tag(feature_name), CUSTOMERS, REMOVALS),
+                            lambda: self.inner.page_customers_with_feature(feature_name, after, limit))
+
+    def page_customers_with_feature_explicitly_enabled(self, feature_name: str, after: Optional[int] = None,
+                                                       limit: int = PAGE_SIZE) -> List[int]:
+        return self._cached(("page_customers_with_feature_explicitly_enabled", feature_name, after, limit),
+                            (feature_tag(feature_name), REMOVALS),
+                            lambda: self.inner.page_customers_with_feature_explicitly_enabled(feature_name, after, limit))
+
+    def page_customers_with_feature_explicitly_disabled(self, feature_name: str, after: Optional[int] = None,
+                                                        limit: int = PAGE_SIZE) -> List[int]:
+        return self._cached(("page_customers_with_feature_explicitly_disabled", feature_name, after, limit),
+                            (feature_tag(feature_name), REMOVALS),
+                            lambda: self.inner.page_customers_with_feature_explicitly_disabled(feature_name, after, limit))
+
+    def list_features_for_customer(self, customer_id: int) -> List[str]:
+        return self._cached(("list_features_for_customer", customer_id),
+                            (customer_tag(customer_id), GLOBAL_FLAGS, ROLLOUTS, REMOVALS),
+                            lambda: self.inner.list_features_for_customer(customer_id))
+
+    def list_all_features(self) -> List[str]:
+        return self._cached(("list_all_features",), (GLOBAL_FLAGS,), self.inner.list_all_features)
+
+    def describe_all_features(self) -> List[Dict[str, Union[str, bool, List[int]]]]:
+        return self._cached(("describe_all_features",), (GLOBAL_FLAGS, OVERRIDES), self.inner.describe_all_features)
+
+    def list_all_customers(self) -> List[int]:
+        return self._cached(("list_all_customers",), (CUSTOMERS,), self.inner.list_all_customers)
+
+    def evaluate_many(self, feature_name: str, customer_ids: Iterable[int]) -> Dict[int, bool]:
+        customer_ids = tuple(customer_ids)
+        return self._cached(("evaluate_many", feature_name, customer_ids),
+                            (feature_tag(feature_name), REMOVALS),
+                            lambda: self.inner.evaluate_many(feature_name, customer_ids))
+
+    def evaluate_matrix(self, customer_ids: Iterable[int], feature_names: Iterable[str]) -> Dict[int, Dict[str, bool]]:
+        customer_ids = tuple(customer_ids)
+        feature_names = tuple(dict.fromkeys(feature_names))
+        tags = tuple(feature_tag(feature_name) for feature_name in feature_names) + (REMOVALS,)
+        return self._cached(("evaluate_matrix", customer_ids, feature_names), tags,
+                            lambda: self.inner.evaluate_matrix(customer_ids, feature_names))
+
+    def export_flags(self) -> Tuple[Dict[str, bool], List[FlagRow]]:
+        return self.inner.export_flags()
+
+    def current_version(self) -> int:
+        return self.inner.current_version()
+
+    def changes_since(self, version: int, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        return self.inner.changes_since(version, limit)
+
+    def compact_changes(self, through_version: int) -> int:
+        return self.inner.compact_changes(through_version)
+
+    def close(self):
+        self.clear()
+        self.inner.close()
@@ -0,0 +1,101 @@
+from typing import Dict, Iterable, Iterator, List, Optional
+
+CHUNK_BITS = 16
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+if hasattr(int, "bit_count"):
+    _popcount = int.bit_count
+else:  # Python < 3.10
+    def _popcount(value: int) -> int:
+        return bin(value).count("1")
+
+
+class CustomerBitmap:
+    """Compressed set of integer ids.
+
+    Ids are split into a high key and a 16-bit offset, and each key maps to a
+    Python int used as a 65536-bit bitmap, so sparse id ranges cost nothing
+    and set algebra runs chunk by chunk on machine words.
+    """
+
+    __slots__ = ("_chunks",)
+
+    def __init__(self, ids: Iterable[int] = ()):
+        self._chunks: Dict[int, int] = {}
+        for customer_id in ids:
+            self.add(customer_id)
+
+    @classmethod
+    def _from_chunks(cls, chunks: Dict[int, int]) -> "CustomerBitmap":
+        bitmap = cls()
+        bitmap._chunks = {key: bits for key, bits in chunks.items() if bits}
+        return bitmap
+
+    def add(self, customer_id: int):
+        key = customer_id >> CHUNK_BITS
+        self._chunks[key] = self._chunks.get(key, 0) | (1 << (customer_id & CHUNK_MASK))
+
+    def discard(self, customer_id: int):
+        key = customer_id >> CHUNK_BITS
+        bits = self._chunks.get(key)
+        if bits is None:
+            return
+        bits &= ~(1 << (customer_id & CHUNK_MASK))
+        if bits:
+            self._chunks[key] = bits
+        else:
+            del self._chunks[key]
+
+    def copy(self) -> "CustomerBitmap":
+        return self._from_chunks(self._chunks)
+
+    def __contains__(self, customer_id: int) -> bool:
+        return bool(self._chunks.get(customer_id >> CHUNK_BITS, 0) >> (customer_id & CHUNK_MASK) & 1)
+
+    def __len__(self) -> int:
+        return sum(_popcount(bits) for bits in self._chunks.values())
+
+    def __bool__(self) -> bool:
+        return bool(self._chunks)
+
+    def __iter__(self) -> Iterator[int]:
+        return self._iter_chunks(sorted(self._chunks))
+
+    def iter_from(self, start: int) -> Iterator[int]:
+        """Ids >= start in ascending order, skipping whole chunks below it."""
+        start_key = start >> CHUNK_BITS
+        keys = [key for key in sorted(self._chunks) if key >= start_key]
+        return self._iter_chunks(keys, start_key, ~((1 << (start & CHUNK_MASK)) - 1))
+
+    def _iter_chunks(self, keys: List[int], first_key: Optional[int] = None, first_mask: int = -1) -> Iterator[int]:
+        for key in keys:
+            base = key << CHUNK_BITS
+            bits = self._chunks[key]
+            if key == first_key:
+                bits &= first_mask
+            while bits:
+                lowest = bits & -bits
+                yield base | (lowest.bit_length() - 1)
+                bits ^= lowest
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, CustomerBitmap):
+            return NotImplemented
+        return self._chunks == other._chunks
+
+    def __or__(self, other: "CustomerBitmap") -> "CustomerBitmap":
+        chunks = dict(self._chunks)
+        for key, bits in other._chunks.items():
+            chunks[key] = chunks.get(key, 0) | bits
+        return self._from_chunks(chunks)
+
+    def __and__(self, other: "CustomerBitmap") -> "CustomerBitmap":
+        small, large = sorted((self._chunks, other._chunks), key=len)
+        return self._from_chunks({key: bits & large[key] for key, bits in small.items() if key in large})
+
+    def __sub__(self, other: "CustomerBitmap") -> "CustomerBitmap":
+        others = other._chunks
+        return self._from_chunks({key: bits & ~others.get(key, 0) for key, bits in self._chunks.items()})
+
+    def __repr__(self) -> str:
+        return f"CustomerBitmap(<{len(self)} ids>)"
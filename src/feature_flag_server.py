@@ -0,0 +1,233 @@
+import gzip
+import hashlib
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import traceback
+from typing import Dict, Optional, Set, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from feature_flag_service import ChangesCompactedError, FeatureFlagService, FeatureFlagSnapshot
+
+GZIP_MIN_SIZE = 1024
+
+
+class SnapshotPayload:
+    """Serialized /snapshot body, kept in both encodings with their ETags."""
+
+    __slots__ = ("body", "gzip_body", "etag", "gzip_etag")
+
+    def __init__(self, document: dict):
+        self.body = json.dumps(document, separators=(",", ":"), sort_keys=True).encode()
+        self.gzip_body = gzip.compress(self.body)
+        digest = hashlib.sha1(self.body).hexdigest()
+        self.etag = f'"{digest}"'
+        self.gzip_etag = f'"{digest}-gzip"'
+
+
+class FeatureFlagHTTPServer(ThreadingHTTPServer):
+    """Serves flag evaluations and snapshots from one FeatureFlagService.
+
+    Each request runs on its own thread, so the service's store must be
+    thread-safe (PooledSQLiteFeatureFlagStore). Every request compares the
+    store's change-log version with the last one seen; on a change the
+    evaluation snapshot is rolled forward and the cached /snapshot body
+    is dropped.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], service: FeatureFlagService, log_requests: bool = False):
+        super().__init__(address, FeatureFlagRequestHandler)
+        self.service = service
+        self.log_requests = log_requests
+        self._lock = threading.Lock()
+        self._payload: Optional[SnapshotPayload] = None
+        self._version: Optional[int] = None
+
+    def _refresh(self):
+        # Called with the lock held
+        version = self.service.current_version()
+        if version != self._version:
+            self._version = version
+            self._payload = None
+            self.service.sync_snapshot()
+
+    def check_for_changes(self):
+        with self._lock:
+            self._refresh()
+
+    def snapshot_payload(self) -> SnapshotPayload:
+        with self._lock:
+            self._refresh()
+            if self._payload is None:
+                # One consistent read of the store, rather than several that a
+                # concurrent write could land between
+                self._payload = SnapshotPayload(snapshot_document(FeatureFlagSnapshot.from_store(self.service.store)))
+            return self._payload
+
+
+def snapshot_document(snapshot: FeatureFlagSnapshot) -> dict:
+    overrides = [(name, customer_id, None, is_enabled)
+                 for (name, customer_id), is_enabled in snapshot.customer_overrides.items()]
+    overrides += [(name, customer_id, user_id, is_enabled)
+                  for (name, customer_id, user_id), is_enabled in snapshot.user_overrides.items()]
+    # Same shape as describe_all_features()
+    customers: Dict[Tuple[str, bool], Set[int]] = {}
+    for name, customer_id, _, is_enabled in overrides:
+        if customer_id is not None:
+            customers.setdefault((name, is_enabled), set()).add(customer_id)
+    return {
+        "features": [
+            {
+                "feature_name": name,
+                "global_enabled": global_enabled,
+                "explicitly_enabled_customers": sorted(customers.get((name, True), ())),
+                "explicitly_disabled_customers": sorted(customers.get((name, False), ())),
+            }
+            for name, global_enabled in snapshot.global_flags.items()
+        ],
+        "overrides": [
+            {"feature_name": name, "customer_id": customer_id, "user_id": user_id, "is_enabled": is_enabled}
+            for name, customer_id, user_id, is_enabled in overrides
+        ],
+        "rollouts": {name: rollout._asdict() for name, rollout in snapshot.rollouts.items()},
+    }
+
+
+class BadRequest(Exception):
+    pass
+
+
+class FeatureFlagRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive between requests; every response
+    # therefore carries a Content-Length.
+    protocol_version = "HTTP/1.1"
+    server: FeatureFlagHTTPServer
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        parts = [unquote(part) for part in url.path.strip("/").split("/")]
+        try:
+            if parts == ["snapshot"]:
+                self._send_snapshot()
+                return
+            self.server.check_for_changes()
+            service = self.server.service
+            if parts == ["health"]:
+                self._send_json({"status": "ok"})
+            elif parts == ["stats"]:
+                instrumentation = service.instrumentation
+                self._send_json({"methods": instrumentation.snapshot() if instrumentation is not None else {}})
+            elif parts == ["evaluate"]:
+                feature = params.get("feature")
+                if not feature:
+                    raise BadRequest("feature is required")
+                customer_id = self._int_param(params, "customer_id")
+                user_id = self._int_param(params, "user_id")
+                self._send_json({
+                    "feature": feature,
+                    "customer_id": customer_id,
+                    "user_id": user_id,
+                    "enabled": service.is_enabled(feature, customer_id, user_id),
+                })
+            elif parts == ["changes"]:
+                since = self._int_param(params, "since")
+                if since is None:
+                    raise BadRequest("since is required")
+                limit = self._int_param(params, "limit")
+                try:
+                    changes = service.changes_since(since, limit)
+                except ChangesCompactedError as exc:
+                    self._send_json({"error": str(exc)}, HTTPStatus.GONE)
+                    return
+                # The next ?since=; current_version() could already be past
+                # the last change returned
+                self._send_json({"version": changes[-1]["version"] if changes else since, "changes": changes})
+            elif len(parts) == 3 and parts[0] == "customers" and parts[2] == "features":
+                customer_id = self._parse_int("customer_id", parts[1])
+                self._send_json({"customer_id": customer_id, "features": service.list_features_for_customer(customer_id)})
+            elif len(parts) == 3 and parts[0] == "features" and parts[2] == "customers":
+                limit = self._int_param(params, "limit")
+                if limit is None:
+                    self._send_json({"feature": parts[1], "customers": service.list_customers_with_feature(parts[1])})
+                else:
+                    # Keyset pagination: pass the last customer id back as ?after=
+                    customers = service.page_customers_with_feature(parts[1], self._int_param(params, "after"), limit)
+                    self._send_json({"feature": parts[1], "customers": customers})
+            else:
+                self._send_json({"error": "not found"}, HTTPStatus.NOT_FOUND)
+        except BadRequest as exc:
+            self._send_json({"error": str(exc)}, HTTPStatus.BAD_REQUEST)
+        except Exception:
+            # Answer rather than drop the keep-alive connection
+            traceback.print_exc()
+            self._send_json({"error": "internal server error"}, HTTPStatus.INTERNAL_SERVER_ERROR)
+
+    @staticmethod
+    def _parse_int(name: str, value: str) -> int:
+        try:
+            return int(value)
+        except ValueError:
+            raise BadRequest(f"{name} must be an integer") from None
+
+    def _int_param(self, params: Dict[str, str], name: str) -> Optional[int]:
+        value = params.get(name)
+        return None if value in (None, "") else self._parse_int(name, value)
+
+    def _accepts_gzip(self) -> bool:
+        # "gzip;q=0" refuses gzip, so the q-value has to be parsed
+        for coding in self.headers.get("Accept-Encoding", "").split(","):
+            name, *params = [part.strip() for part in coding.split(";")]
+            if name.lower() not in ("gzip", "*"):
+                continue
+            quality = 1.0
+            for param in params:
+                key, _, value = param.partition("=")
+                if key.strip().lower() == "q":
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            if quality > 0:
+                return True
+        return False
+
+    def _send_snapshot(self):
+        payload = self.server.snapshot_payload()
+        use_gzip = self._accepts_gzip()
+        etag = payload.gzip_etag if use_gzip else payload.etag
+        if_none_match = self.headers.get("If-None-Match", "")
+        if etag in {tag.strip() for tag in if_none_match.split(",")} or if_none_match.strip() == "*":
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.send_header("Vary", "Accept-Encoding")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = payload.gzip_body if use_gzip else payload.body
+        self._send_body(body, HTTPStatus.OK, gzipped=use_gzip, extra_headers={"ETag": etag, "Vary": "Accept-Encoding"})
+
+    def _send_json(self, document: dict, status: HTTPStatus = HTTPStatus.OK):
+        body = json.dumps(document, separators=(",", ":")).encode()
+        gzipped = len(body) >= GZIP_MIN_SIZE and self._accepts_gzip()
+        if gzipped:
+            body = gzip.compress(body)
+        self._send_body(body, status, gzipped=gzipped, extra_headers={"Vary": "Accept-Encoding"})
+
+    def _send_body(self, body: bytes, status: HTTPStatus, gzipped: bool, extra_headers: Dict[str, str]):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if gzipped:
+            self.send_header("Content-Encoding", "gzip")
+        for name, value in extra_headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.log_requests:
+            super().log_message(format, *args)
@@ -1,6 +1,104 @@
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import hashlib
+from itertools import islice
+import json
 import sqlite3
-from typing import Optional, List, Dict, Union
+import sys
+import threading
+from typing import Any, Callable, Optional, List, Dict, NamedTuple, Union, Tuple, Iterable, Iterator, ContextManager
+
+from customer_bitmap import CustomerBitmap
+from instrumentation import Instrumentation
+
+FlagRow = Tuple[str, Optional[int], Optional[int], bool]
+
+CHANGE_FIELDS = (
+    "version", "operation", "feature_name", "customer_id", "user_id", "is_enabled", "new_name", "rollout", "changed_at",
+)
+
+
+class ChangesCompactedError(ValueError):
+    """Raised by changes_since when the requested history has been compacted away."""
+
+BULK_CHUNK_SIZE = 10000
+
+ROLLOUT_BUCKETS = 10000
+MIN_CUSTOMER_ID = -(1 << 63)
+MAX_CUSTOMER_ID = (1 << 63) - 1
+
+
+def rollout_bucket(salt: str, customer_id: int) -> int:
+    # Stable across processes and Python versions, unlike hash(). Registered
+    # as an SQLite function so queries bucket customers the same way.
+    digest = hashlib.blake2b(f"{salt}:{customer_id}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % ROLLOUT_BUCKETS
+
+
+def register_sql_functions(conn: sqlite3.Connection):
+    # Queries and the effective_flags triggers call rollout_bucket(), so any
+    # connection that writes to a database with that table needs it
+    if sys.version_info >= (3, 8):
+        conn.create_function("rollout_bucket", 2, rollout_bucket, deterministic=True)
+    else:
+        conn.create_function("rollout_bucket", 2, rollout_bucket)
+
+
+class Rollout(NamedTuple):
+    """Enables a feature for a stable share of customers without per-customer rows.
+
+    A customer is in the rollout when its id lies in the optional
+    [min_customer_id, max_customer_id] range and its bucket for ``salt`` falls
+    below ``percentage``. Raising the percentage only ever adds customers.
+    """
+
+    percentage: float
+    salt: str
+    min_customer_id: Optional[int] = None
+    max_customer_id: Optional[int] = None
+
+    @classmethod
+    def for_feature(cls, feature_name: str, percentage: float, salt: Optional[str] = None,
+                    min_customer_id: Optional[int] = None, max_customer_id: Optional[int] = None) -> "Rollout":
+        # The salt defaults to the feature name; it is stored, so renaming the
+        # feature keeps every customer in its bucket.
+        if not 0 <= percentage <= 100:
+            raise ValueError("Rollout percentage must be between 0 and 100.")
+        return cls(float(percentage), feature_name if salt is None else salt, min_customer_id, max_customer_id)
+
+    @property
+    def threshold(self) -> float:
+        return self.percentage * (ROLLOUT_BUCKETS / 100)
+
+    def includes(self, customer_id: int) -> bool:
+        if self.min_customer_id is not None and customer_id < self.min_customer_id:
+            return False
+        if self.max_customer_id is not None and customer_id > self.max_customer_id:
+            return False
+        return rollout_bucket(self.salt, customer_id) < self.threshold
+
+
+def chunked(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+PAGE_SIZE = 1000
+
+
+def iter_pages(fetch_page: Callable[[Optional[int]], List[int]], page_size: int) -> Iterator[int]:
+    # Keyset pagination: each page starts after the last id of the previous one
+    after = None
+    while True:
+        page = fetch_page(after)
+        yield from page
+        if len(page) < page_size:
+            return
+        after = page[-1]
 
 
 class FeatureFlagStore(ABC):
@@ -22,6 +120,25 @@ class FeatureFlagStore(ABC):
     @abstractmethod
     def set_flag(self, feature_name: str, customer_id: Optional[int], user_id: Optional[int], is_enabled: bool): pass
 
+    @abstractmethod
+    def set_flags_bulk(self, flags: Iterable[FlagRow], chunk_size: int = BULK_CHUNK_SIZE) -> int: pass
+
+    @abstractmethod
+    def add_customers_bulk(self, customer_ids: Iterable[int], chunk_size: int = BULK_CHUNK_SIZE) -> int: pass
+
+    @abstractmethod
+    def transaction(self) -> ContextManager[None]: pass
+
+    @abstractmethod
+    def set_rollout(self, feature_name: str, percentage: float, salt: Optional[str] = None,
+                    min_customer_id: Optional[int] = None, max_customer_id: Optional[int] = None): pass
+
+    @abstractmethod
+    def clear_rollout(self, feature_name: str): pass
+
+    @abstractmethod
+    def list_rollouts(self) -> Dict[str, Rollout]: pass
+
     @abstractmethod
     def remove_customer(self, customer_id: int): pass
 
@@ -31,12 +148,46 @@ class FeatureFlagStore(ABC):
     @abstractmethod
     def list_customers_with_feature(self, feature_name: str) -> List[int]: pass
 
+    @abstractmethod
+    def count_customers_with_feature(self, feature_name: str) -> int: pass
+
     @abstractmethod
     def list_customers_with_feature_explicitly_enabled(self, feature_name: str) -> List[int]: pass
 
     @abstractmethod
     def list_customers_with_feature_explicitly_disabled(self, feature_name: str) -> List[int]: pass
 
+    # Keyset pagination: ids in ascending order, strictly greater than
+    # ``after``; pass the last id of one page as ``after`` for the next.
+    @abstractmethod
+    def page_all_customers(self, after: Optional[int] = None, limit: int = PAGE_SIZE) -> List[int]: pass
+
+    @abstractmethod
+    def page_customers_with_feature(self, feature_name: str, after: Optional[int] = None,
+                                    limit: int = PAGE_SIZE) -> List[int]: pass
+
+    @abstractmethod
+    def page_customers_with_feature_explicitly_enabled(self, feature_name: str, after: Optional[int] = None,
+                                                       limit: int = PAGE_SIZE) -> List[int]: pass
+
+    @abstractmethod
+    def page_customers_with_feature_explicitly_disabled(self, feature_name: str, after: Optional[int] = None,
+                                                        limit: int = PAGE_SIZE) -> List[int]: pass
+
+    def iter_all_customers(self, page_size: int = PAGE_SIZE) -> Iterator[int]:
+        return iter_pages(lambda after: self.page_all_customers(after, page_size), page_size)
+
+    def iter_customers_with_feature(self, feature_name: str, page_size: int = PAGE_SIZE) -> Iterator[int]:
+        return iter_pages(lambda after: self.page_customers_with_feature(feature_name, after, page_size), page_size)
+
+    def iter_customers_with_feature_explicitly_enabled(self, feature_name: str, page_size: int = PAGE_SIZE) -> Iterator[int]:
+        return iter_pages(
+            lambda after: self.page_customers_with_feature_explicitly_enabled(feature_name, after, page_size), page_size)
+
+    def iter_customers_with_feature_explicitly_disabled(self, feature_name: str, page_size: int = PAGE_SIZE) -> Iterator[int]:
+        return iter_pages(
+            lambda after: self.page_customers_with_feature_explicitly_disabled(feature_name, after, page_size), page_size)
+
     @abstractmethod
     def list_features_for_customer(self, customer_id: int) -> List[str]: pass
 
@@ -49,183 +200,1352 @@ class FeatureFlagStore(ABC):
     @abstractmethod
     def list_all_customers(self) -> List[int]: pass
 
+    @abstractmethod
+    def evaluate_many(self, feature_name: str, customer_ids: Iterable[int]) -> Dict[int, bool]: pass
+
+    @abstractmethod
+    def evaluate_matrix(self, customer_ids: Iterable[int], feature_names: Iterable[str]) -> Dict[int, Dict[str, bool]]: pass
+
+    @abstractmethod
+    def export_flags(self) -> Tuple[Dict[str, bool], List[FlagRow]]: pass
+
+    @abstractmethod
+    def current_version(self) -> int: pass
+
+    @abstractmethod
+    def changes_since(self, version: int, limit: Optional[int] = None) -> List[Dict[str, Any]]: pass
+
+    @abstractmethod
+    def compact_changes(self, through_version: int) -> int: pass
+
     @abstractmethod
     def close(self): pass
 
 
+# Schema migrations, applied in order by SQLiteFeatureFlagStore._init_db.
+# MIGRATIONS[n] upgrades a database from version n to n + 1; databases
+# created before versioning existed start at 0. Never edit a released entry,
+# append a new one instead.
+MIGRATIONS: List[List[str]] = [
+    # 1: original tables
+    [
+        """
+        CREATE TABLE IF NOT EXISTS customers (
+            customer_id INTEGER PRIMARY KEY
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS global_feature_flags (
+            feature_name TEXT PRIMARY KEY,
+            is_enabled BOOLEAN NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS feature_flags (
+            feature_name TEXT NOT NULL,
+            customer_id INTEGER,
+            user_id INTEGER,
+            is_enabled BOOLEAN NOT NULL,
+            PRIMARY KEY (feature_name, customer_id, user_id)
+        )
+        """,
+    ],
+    # 2: the primary key treats NULLs as distinct, so customer-only and
+    # user-only overrides were duplicated on every write. Keep the newest
+    # row of each, enforce uniqueness with partial indexes and index the
+    # customer_id / user_id lookups.
+    [
+        """
+        DELETE FROM feature_flags WHERE rowid NOT IN (
+            SELECT MAX(rowid) FROM feature_flags GROUP BY feature_name, customer_id, user_id
+        )
+        """,
+        """
+        CREATE UNIQUE INDEX feature_flags_customer_override
+        ON feature_flags (feature_name, customer_id) WHERE user_id IS NULL
+        """,
+        """
+        CREATE UNIQUE INDEX feature_flags_user_override
+        ON feature_flags (feature_name, user_id) WHERE customer_id IS NULL
+        """,
+        "CREATE INDEX feature_flags_by_customer ON feature_flags (customer_id, feature_name, is_enabled)",
+        "CREATE INDEX feature_flags_by_user ON feature_flags (user_id, feature_name, customer_id)",
+    ],
+    # 3: append-only change log. AUTOINCREMENT keeps versions monotonic even
+    # after compaction deletes the newest entries.
+    [
+        """
+        CREATE TABLE flag_changes (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            operation TEXT NOT NULL,
+            feature_name TEXT,
+            customer_id INTEGER,
+            user_id INTEGER,
+            is_enabled BOOLEAN,
+            new_name TEXT,
+            changed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE TABLE flag_changes_compaction (compacted_through INTEGER NOT NULL)",
+        "INSERT INTO flag_changes_compaction (compacted_through) VALUES (0)",
+    ],
+    # 4: percentage rollouts, one rule per feature. set_rollout changes carry
+    # the rule as JSON so snapshots can replay them.
+    [
+        """
+        CREATE TABLE rollouts (
+            feature_name TEXT PRIMARY KEY,
+            percentage REAL NOT NULL CHECK (percentage BETWEEN 0 AND 100),
+            salt TEXT NOT NULL,
+            min_customer_id INTEGER,
+            max_customer_id INTEGER
+        )
+        """,
+        "ALTER TABLE flag_changes ADD COLUMN rollout TEXT",
+    ],
+    # 5: intern feature names. Flags and rollouts reference features by
+    # integer id, so rename is a one-row update and deleting a feature
+    # cascades through the foreign keys. Overrides may name customers that
+    # were never added, so deleting a customer cascades through a trigger.
+    [
+        "CREATE TABLE features (feature_id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)",
+        "INSERT INTO features (name) SELECT feature_name FROM global_feature_flags ORDER BY rowid",
+        "INSERT OR IGNORE INTO features (name) SELECT feature_name FROM feature_flags ORDER BY rowid",
+        "INSERT OR IGNORE INTO features (name) SELECT feature_name FROM rollouts ORDER BY rowid",
+        """
+        CREATE TABLE global_feature_flags_v5 (
+            feature_id INTEGER PRIMARY KEY REFERENCES features (feature_id) ON DELETE CASCADE,
+            is_enabled BOOLEAN NOT NULL
+        )
+        """,
+        """
+        INSERT INTO global_feature_flags_v5 (feature_id, is_enabled)
+        SELECT f.feature_id, g.is_enabled FROM global_feature_flags g JOIN features f ON f.name = g.feature_name
+        """,
+        "DROP TABLE global_feature_flags",
+        "ALTER TABLE global_feature_flags_v5 RENAME TO global_feature_flags",
+        """
+        CREATE TABLE feature_flags_v5 (
+            feature_id INTEGER NOT NULL REFERENCES features (feature_id) ON DELETE CASCADE,
+            customer_id INTEGER,
+            user_id INTEGER,
+            is_enabled BOOLEAN NOT NULL,
+            PRIMARY KEY (feature_id, customer_id, user_id)
+        )
+        """,
+        """
+        INSERT INTO feature_flags_v5 (feature_id, customer_id, user_id, is_enabled)
+        SELECT f.feature_id, o.customer_id, o.user_id, o.is_enabled FROM feature_flags o JOIN features f ON f.name = o.feature_name
+        ORDER BY o.rowid
+        """,
+        "DROP TABLE feature_flags",
+        "ALTER TABLE feature_flags_v5 RENAME TO feature_flags",
+        """
+        CREATE UNIQUE INDEX feature_flags_customer_override
+        ON feature_flags (feature_id, customer_id) WHERE user_id IS NULL
+        """,
+        """
+        CREATE UNIQUE INDEX feature_flags_user_override
+        ON feature_flags (feature_id, user_id) WHERE customer_id IS NULL
+        """,
+        "CREATE INDEX feature_flags_by_customer ON feature_flags (customer_id, feature_id, is_enabled)",
+        "CREATE INDEX feature_flags_by_user ON feature_flags (user_id, feature_id, customer_id)",
+        """
+        CREATE TABLE rollouts_v5 (
+            feature_id INTEGER PRIMARY KEY REFERENCES features (feature_id) ON DELETE CASCADE,
+            percentage REAL NOT NULL CHECK (percentage BETWEEN 0 AND 100),
+            salt TEXT NOT NULL,
+            min_customer_id INTEGER,
+            max_customer_id INTEGER
+        )
+        """,
+        """
+        INSERT INTO rollouts_v5 (feature_id, percentage, salt, min_customer_id, max_customer_id)
+        SELECT f.feature_id, r.percentage, r.salt, r.min_customer_id, r.max_customer_id
+        FROM rollouts r JOIN features f ON f.name = r.feature_name
+        """,
+        "DROP TABLE rollouts",
+        "ALTER TABLE rollouts_v5 RENAME TO rollouts",
+        """
+        CREATE TRIGGER customers_delete_overrides AFTER DELETE ON customers
+        BEGIN
+            DELETE FROM feature_flags WHERE customer_id = OLD.customer_id;
+        END
+        """,
+    ],
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def _has_feature_sql(feature: str, customer: str) -> str:
+    # Whether list_customers_with_feature names the customer: a registered
+    # customer without a customer-level disabling override when the feature is
+    # on globally or rolled out to them, or anyone whose overrides all enable it.
+    sql = """
+        CASE
+            WHEN EXISTS (SELECT 1 FROM global_feature_flags g WHERE g.feature_id = {feature} AND g.is_enabled = 1)
+            THEN EXISTS (SELECT 1 FROM customers c WHERE c.customer_id = {customer})
+                AND NOT EXISTS (
+                    SELECT 1 FROM feature_flags o WHERE o.feature_id = {feature} AND o.customer_id = {customer}
+                    AND o.user_id IS NULL AND o.is_enabled = 0
+                )
+            ELSE (EXISTS (SELECT 1 FROM customers c WHERE c.customer_id = {customer})
+                AND EXISTS (
+                    SELECT 1 FROM rollouts r WHERE r.feature_id = {feature}
+                    AND (r.min_customer_id IS NULL OR {customer} >= r.min_customer_id)
+                    AND (r.max_customer_id IS NULL OR {customer} <= r.max_customer_id)
+                    AND rollout_bucket(r.salt, {customer}) < r.percentage * {buckets_per_percent}
+                )
+                AND NOT EXISTS (
+                    SELECT 1 FROM feature_flags o WHERE o.feature_id = {feature} AND o.customer_id = {customer}
+                    AND o.user_id IS NULL AND o.is_enabled = 0
+                ))
+                OR (EXISTS (SELECT 1 FROM feature_flags o WHERE o.feature_id = {feature} AND o.customer_id = {customer})
+                AND NOT EXISTS (
+                    SELECT 1 FROM feature_flags o WHERE o.feature_id = {feature} AND o.customer_id = {customer}
+                    AND o.is_enabled = 0
+                ))
+        END
+    """
+    return sql.format(feature=feature, customer=customer, buckets_per_percent=ROLLOUT_BUCKETS / 100)
+
+
+def _refresh_pair_sql(row: str) -> str:
+    return f"""
+        DELETE FROM effective_flags WHERE feature_id = {row}.feature_id AND customer_id = {row}.customer_id;
+        INSERT INTO effective_flags (feature_id, customer_id)
+        SELECT feature_id, {row}.customer_id FROM features
+        WHERE feature_id = {row}.feature_id AND {_has_feature_sql(f"{row}.feature_id", f"{row}.customer_id")};
+    """
+
+
+def _refresh_feature_sql(row: str) -> str:
+    # Reading the feature id back from features skips features being deleted,
+    # whose rows the foreign key cascade removes.
+    return f"""
+        DELETE FROM effective_flags WHERE feature_id = {row}.feature_id;
+        INSERT INTO effective_flags (feature_id, customer_id)
+        SELECT f.feature_id, candidate.customer_id FROM features f, (
+            SELECT customer_id FROM customers
+            UNION
+            SELECT customer_id FROM feature_flags WHERE feature_id = {row}.feature_id AND customer_id IS NOT NULL
+        ) candidate
+        WHERE f.feature_id = {row}.feature_id AND {_has_feature_sql("f.feature_id", "candidate.customer_id")};
+    """
+
+
+# Optional materialized listings: one row per (feature, customer) pair that
+# list_customers_with_feature would return.
+# The triggers keep it current within each write's transaction; a global
+# flag or rollout change rewrites the feature's rows. Not part of MIGRATIONS,
+# SQLiteFeatureFlagStore.enable_effective_flags() creates it on demand.
+EFFECTIVE_FLAGS_SCHEMA: List[str] = [
+    """
+    CREATE TABLE IF NOT EXISTS effective_flags (
+        feature_id INTEGER NOT NULL REFERENCES features (feature_id) ON DELETE CASCADE,
+        customer_id INTEGER NOT NULL,
+        PRIMARY KEY (feature_id, customer_id)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS effective_flags_by_customer ON effective_flags (customer_id, feature_id)",
+    f"""
+    CREATE TRIGGER IF NOT EXISTS effective_flags_override_insert
+    AFTER INSERT ON feature_flags WHEN NEW.customer_id IS NOT NULL
+    BEGIN {_refresh_pair_sql("NEW")} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS effective_flags_override_update
+    AFTER UPDATE ON feature_flags
+    BEGIN {_refresh_pair_sql("OLD")} {_refresh_pair_sql("NEW")} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS effective_flags_override_delete
+    AFTER DELETE ON feature_flags WHEN OLD.customer_id IS NOT NULL
+    BEGIN {_refresh_pair_sql("OLD")} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS effective_flags_customer_insert
+    AFTER INSERT ON customers
+    BEGIN
+        INSERT OR IGNORE INTO effective_flags (feature_id, customer_id)
+        SELECT d.feature_id, NEW.customer_id FROM (
+            SELECT feature_id FROM global_feature_flags WHERE is_enabled = 1
+            UNION
+            SELECT feature_id FROM rollouts
+        ) d
+        WHERE {_has_feature_sql("d.feature_id", "NEW.customer_id")};
+    END
+    """,
+    # Pairs backed by overrides are refreshed as customers_delete_overrides
+    # removes them
+    """
+    CREATE TRIGGER IF NOT EXISTS effective_flags_customer_delete
+    AFTER DELETE ON customers
+    BEGIN
+        DELETE FROM effective_flags WHERE customer_id = OLD.customer_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS effective_flags_global_insert
+    AFTER INSERT ON global_feature_flags
+    BEGIN {_refresh_feature_sql("NEW")} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS effective_flags_global_update
+    AFTER UPDATE ON global_feature_flags WHEN OLD.is_enabled IS NOT NEW.is_enabled
+    BEGIN {_refresh_feature_sql("NEW")} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS effective_flags_global_delete
+    AFTER DELETE ON global_feature_flags WHEN OLD.is_enabled
+    BEGIN {_refresh_feature_sql("OLD")} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS effective_flags_rollout_insert
+    AFTER INSERT ON rollouts
+    BEGIN {_refresh_feature_sql("NEW")} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS effective_flags_rollout_update
+    AFTER UPDATE ON rollouts
+    BEGIN {_refresh_feature_sql("NEW")} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS effective_flags_rollout_delete
+    AFTER DELETE ON rollouts
+    BEGIN {_refresh_feature_sql("OLD")} END
+    """,
+]
+EFFECTIVE_FLAGS_TRIGGERS = [
+    f"effective_flags_{table}_{event}"
+    for table in ("override", "customer", "global", "rollout")
+    for event in ("insert", "update", "delete")
+    if (table, event) != ("customer", "update")
+]
+
+
+class FeatureBitmaps:
+    """Per-feature customer bitmaps mirroring the override rows.
+
+    ``enabled``/``disabled`` hold customer-level overrides; ``user_enabled``
+    and ``user_disabled`` hold customers with a user-level override.
+    """
+
+    __slots__ = ("enabled", "disabled", "user_enabled", "user_disabled")
+
+    def __init__(self):
+        self.enabled = CustomerBitmap()
+        self.disabled = CustomerBitmap()
+        self.user_enabled = CustomerBitmap()
+        self.user_disabled = CustomerBitmap()
+
+    def add(self, customer_id: int, customer_level: bool, is_enabled: bool):
+        if customer_level:
+            (self.enabled if is_enabled else self.disabled).add(customer_id)
+        else:
+            (self.user_enabled if is_enabled else self.user_disabled).add(customer_id)
+
+    def discard(self, customer_id: int):
+        self.enabled.discard(customer_id)
+        self.disabled.discard(customer_id)
+        self.user_enabled.discard(customer_id)
+        self.user_disabled.discard(customer_id)
+
+    def customers_with_feature(self, all_customers: CustomerBitmap, global_enabled: bool,
+                               rollout_customers: Optional[CustomerBitmap] = None) -> CustomerBitmap:
+        # Same rules as the SQL path of SQLiteFeatureFlagStore.list_customers_with_feature
+        if global_enabled:
+            return all_customers - self.disabled
+        overridden = (self.enabled | self.user_enabled) - (self.disabled | self.user_disabled)
+        if rollout_customers is None:
+            return overridden
+        return (rollout_customers - self.disabled) | overridden
+
+
 class SQLiteFeatureFlagStore(FeatureFlagStore):
-    def __init__(self, db_path: str = "feature_flags.db"):
-        self.conn = sqlite3.connect(db_path)
+    def __init__(self, db_path: str = "feature_flags.db", bitmap_index: bool = False,
+                 effective_flags: bool = False, change_log: bool = True):
+        self.db_path = db_path
+        # Without the change log, writes append nothing to flag_changes; for
+        # databases whose changes are logged elsewhere, like shard files
+        self.change_log = change_log
+        self._trace_callback: Optional[Callable[[str], None]] = None
+        self.conn = self._connect()
+        self._transaction_depth = 0
         self._init_db()
+        # Databases that already have the table use it whatever the argument
+        self._effective_flags = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'effective_flags'").fetchone() is not None
+        if effective_flags and not self._effective_flags:
+            self.enable_effective_flags()
+        # Optional in-memory bitmap index; only valid while this store is the
+        # sole writer to the database.
+        self._all_customers: Optional[CustomerBitmap] = None
+        self._feature_bitmaps: Dict[str, FeatureBitmaps] = {}
+        self._rollouts: Dict[str, Rollout] = {}
+        self._rollout_bitmaps: Dict[str, CustomerBitmap] = {}
+        if bitmap_index:
+            self._build_bitmap_index()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("PRAGMA foreign_keys=ON")
+        register_sql_functions(conn)
+        conn.set_trace_callback(self._trace_callback)
+        return conn
+
+    def set_trace_callback(self, callback: Optional[Callable[[str], None]]):
+        # Called with the text of every statement SQLite runs, or None to stop
+        self._trace_callback = callback
+        self.conn.set_trace_callback(callback)
+
+    def storage_stats(self) -> Dict[str, int]:
+        stats = {"schema_version": self.schema_version, "change_log_version": self.current_version()}
+        tables = ["customers", "features", "global_feature_flags", "feature_flags", "rollouts", "flag_changes"]
+        if self.has_effective_flags:
+            tables.append("effective_flags")
+        for table in tables:
+            stats[f"{table}_rows"] = self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        page_count = self.conn.execute("PRAGMA page_count").fetchone()[0]
+        page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+        stats["size_bytes"] = page_count * page_size
+        return stats
 
     def _init_db(self):
+        # Up-to-date databases need neither the write lock nor any DDL
+        try:
+            row = self.conn.execute("SELECT version FROM schema_version").fetchone()
+        except sqlite3.OperationalError:
+            row = None
+        if row is not None and row[0] == SCHEMA_VERSION:
+            return
         with self.conn:
-            self.conn.execute("""
-                CREATE TABLE IF NOT EXISTS customers (
-                    customer_id INTEGER PRIMARY KEY
-                )
-            """)
-            self.conn.execute("""
-                CREATE TABLE IF NOT EXISTS global_feature_flags (
-                    feature_name TEXT PRIMARY KEY,
-                    is_enabled BOOLEAN NOT NULL
-                )
-            """)
-            self.conn.execute("""
-                CREATE TABLE IF NOT EXISTS feature_flags (
-                    feature_name TEXT NOT NULL,
-                    customer_id INTEGER,
-                    user_id INTEGER,
-                    is_enabled BOOLEAN NOT NULL,
-                    PRIMARY KEY (feature_name, customer_id, user_id)
-                )
+            # Take the write lock up front so concurrent openers migrate once
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+            row = self.conn.execute("SELECT version FROM schema_version").fetchone()
+            version = row[0] if row else 0
+            if version > SCHEMA_VERSION:
+                raise RuntimeError(f"Database schema version {version} is newer than supported version {SCHEMA_VERSION}")
+            for statements in MIGRATIONS[version:]:
+                for statement in statements:
+                    self.conn.execute(statement)
+            if row is None:
+                self.conn.execute("INSERT INTO schema_version (version) VALUES (?)", (SCHEMA_VERSION,))
+            elif version != SCHEMA_VERSION:
+                self.conn.execute("UPDATE schema_version SET version = ?", (SCHEMA_VERSION,))
+
+    @property
+    def schema_version(self) -> int:
+        return self.conn.execute("SELECT version FROM schema_version").fetchone()[0]
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        # The outermost transaction owns the commit; mutators called inside it
+        # join it instead of committing on their own.
+        if self._transaction_depth:
+            self._transaction_depth += 1
+            try:
+                yield
+            finally:
+                self._transaction_depth -= 1
+            return
+        self._transaction_depth = 1
+        try:
+            with self.conn:
+                yield
+        except BaseException:
+            # Bitmaps were updated by writes that have now been rolled back
+            if self.has_bitmap_index:
+                self._build_bitmap_index()
+            raise
+        finally:
+            self._transaction_depth = 0
+
+    @property
+    def has_effective_flags(self) -> bool:
+        return self._effective_flags
+
+    def enable_effective_flags(self) -> int:
+        # Creates the table and its triggers, then fills it; returns its row count
+        with self.transaction():
+            for statement in EFFECTIVE_FLAGS_SCHEMA:
+                self.conn.execute(statement)
+            self._effective_flags = True
+            return self.rebuild_effective_flags()
+
+    def disable_effective_flags(self):
+        with self.transaction():
+            for trigger in EFFECTIVE_FLAGS_TRIGGERS:
+                self.conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            self.conn.execute("DROP TABLE IF EXISTS effective_flags")
+        self._effective_flags = False
+
+    def rebuild_effective_flags(self) -> int:
+        # Recomputes the whole table in two statements, e.g. after a bulk load
+        # or if the triggers were bypassed; returns the row count.
+        if not self.has_effective_flags:
+            raise RuntimeError("The database has no effective_flags table; call enable_effective_flags() first.")
+        with self.transaction():
+            self.conn.execute("DELETE FROM effective_flags")
+            cursor = self.conn.execute(f"""
+                INSERT INTO effective_flags (feature_id, customer_id)
+                SELECT candidate.feature_id, candidate.customer_id FROM (
+                    SELECT g.feature_id, c.customer_id FROM global_feature_flags g, customers c WHERE g.is_enabled = 1
+                    UNION
+                    SELECT r.feature_id, c.customer_id FROM rollouts r, customers c
+                    UNION
+                    SELECT feature_id, customer_id FROM feature_flags WHERE customer_id IS NOT NULL
+                ) candidate
+                WHERE {_has_feature_sql("candidate.feature_id", "candidate.customer_id")}
             """)
+        return cursor.rowcount
+
+    def _build_bitmap_index(self):
+        cursor = self.conn.execute("SELECT customer_id FROM customers")
+        self._all_customers = CustomerBitmap(row[0] for row in cursor)
+        self._feature_bitmaps = {}
+        cursor = self.conn.execute("""
+            SELECT f.name, o.customer_id, o.user_id IS NULL, o.is_enabled
+            FROM feature_flags o JOIN features f USING (feature_id)
+            WHERE o.customer_id IS NOT NULL
+        """)
+        for feature_name, customer_id, customer_level, is_enabled in cursor:
+            self._feature_bitmaps.setdefault(feature_name, FeatureBitmaps()).add(customer_id, customer_level, is_enabled)
+        self._rollouts = self.list_rollouts()
+        self._rollout_bitmaps = {name: self._rollout_customers(rollout) for name, rollout in self._rollouts.items()}
+
+    @property
+    def has_bitmap_index(self) -> bool:
+        return self._all_customers is not None
+
+    def _reindex_customer(self, feature_name: str, customer_id: int):
+        # A customer can hold a customer-level and several user-level rows for
+        # one feature, so re-read them rather than patching single bits.
+        bitmaps = self._feature_bitmaps.setdefault(feature_name, FeatureBitmaps())
+        bitmaps.discard(customer_id)
+        cursor = self.conn.execute("""
+            SELECT user_id IS NULL, is_enabled FROM feature_flags
+            WHERE feature_id = (SELECT feature_id FROM features WHERE name = ?) AND customer_id = ?
+        """, (feature_name, customer_id))
+        for customer_level, is_enabled in cursor:
+            bitmaps.add(customer_id, customer_level, is_enabled)
+
+    def _reindex_feature(self, feature_name: str):
+        bitmaps = self._feature_bitmaps[feature_name] = FeatureBitmaps()
+        cursor = self.conn.execute("""
+            SELECT customer_id, user_id IS NULL, is_enabled FROM feature_flags
+            WHERE feature_id = (SELECT feature_id FROM features WHERE name = ?) AND customer_id IS NOT NULL
+        """, (feature_name,))
+        for customer_id, customer_level, is_enabled in cursor:
+            bitmaps.add(customer_id, customer_level, is_enabled)
+
+    def _rollout_customers(self, rollout: Rollout) -> CustomerBitmap:
+        start = MIN_CUSTOMER_ID if rollout.min_customer_id is None else rollout.min_customer_id
+        end = MAX_CUSTOMER_ID if rollout.max_customer_id is None else rollout.max_customer_id
+        customers = CustomerBitmap()
+        for customer_id in self._all_customers.iter_from(start):
+            if customer_id > end:
+                break
+            if rollout.includes(customer_id):
+                customers.add(customer_id)
+        return customers
+
+    def _reindex_rollout(self, feature_name: str):
+        rollout = self._rollout(feature_name)
+        if rollout is None:
+            self._rollouts.pop(feature_name, None)
+            self._rollout_bitmaps.pop(feature_name, None)
+        else:
+            self._rollouts[feature_name] = rollout
+            self._rollout_bitmaps[feature_name] = self._rollout_customers(rollout)
+
+    def _index_new_customer(self, customer_id: int):
+        self._all_customers.add(customer_id)
+        for feature_name, rollout in self._rollouts.items():
+            if rollout.includes(customer_id):
+                self._rollout_bitmaps[feature_name].add(customer_id)
+
+    _LOG_CHANGE = """
+        INSERT INTO flag_changes (operation, feature_name, customer_id, user_id, is_enabled, new_name, rollout)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """
+
+    def _log_change(self, operation: str, feature_name: Optional[str] = None, customer_id: Optional[int] = None,
+                    user_id: Optional[int] = None, is_enabled: Optional[bool] = None, new_name: Optional[str] = None,
+                    rollout: Optional[Rollout] = None):
+        # Always called inside the mutator's transaction
+        if not self.change_log:
+            return
+        rollout_json = None if rollout is None else json.dumps(rollout._asdict())
+        self.conn.execute(self._LOG_CHANGE, (operation, feature_name, customer_id, user_id, is_enabled, new_name, rollout_json))
+
+    def record_changes(self, changes: Iterable[Dict[str, Any]]):
+        # Appends changes as returned by another database's changes_since() to
+        # the change log without applying them, for writes whose data lives
+        # there. They are numbered anew but keep their changed_at.
+        with self.transaction():
+            self.conn.executemany("""
+                INSERT INTO flag_changes (operation, feature_name, customer_id, user_id, is_enabled, new_name, rollout, changed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                (change["operation"], change["feature_name"], change["customer_id"], change["user_id"], change["is_enabled"],
+                 change["new_name"], None if change["rollout"] is None else json.dumps(change["rollout"]), change["changed_at"])
+                for change in changes
+            ))
+
+    def _intern(self, feature_name: str):
+        # Always called inside the mutator's transaction
+        self.conn.execute("INSERT OR IGNORE INTO features (name) VALUES (?)", (feature_name,))
 
     def add_customer(self, customer_id: int):
-        with self.conn:
+        with self.transaction():
             self.conn.execute("INSERT OR IGNORE INTO customers (customer_id) VALUES (?)", (customer_id,))
+            self._log_change("add_customer", customer_id=customer_id)
+        if self.has_bitmap_index:
+            self._index_new_customer(customer_id)
 
     def add_feature(self, feature_name: str, default_enabled: bool = True):
-        with self.conn:
-            self.conn.execute("INSERT OR REPLACE INTO global_feature_flags (feature_name, is_enabled) VALUES (?, ?)", (feature_name, default_enabled))
+        with self.transaction():
+            self._intern(feature_name)
+            self.conn.execute("""
+                INSERT OR REPLACE INTO global_feature_flags (feature_id, is_enabled)
+                SELECT feature_id, ? FROM features WHERE name = ?
+            """, (default_enabled, feature_name))
+            self._log_change("add_feature", feature_name, is_enabled=default_enabled)
 
     def set_global_flag(self, feature_name: str, is_enabled: bool):
-        with self.conn:
+        with self.transaction():
+            self._intern(feature_name)
             self.conn.execute("""
-                INSERT INTO global_feature_flags (feature_name, is_enabled)
-                VALUES (?, ?)
-                ON CONFLICT(feature_name) DO UPDATE SET is_enabled = excluded.is_enabled
-            """, (feature_name, is_enabled))
+                INSERT INTO global_feature_flags (feature_id, is_enabled)
+                SELECT feature_id, ? FROM features WHERE name = ?
+                ON CONFLICT(feature_id) DO UPDATE SET is_enabled = excluded.is_enabled
+            """, (is_enabled, feature_name))
+            self._log_change("set_global_flag", feature_name, is_enabled=is_enabled)
 
     def remove_feature(self, feature_name: str):
-        with self.conn:
-            self.conn.execute("DELETE FROM feature_flags WHERE feature_name = ?", (feature_name,))
-            self.conn.execute("DELETE FROM global_feature_flags WHERE feature_name = ?", (feature_name,))
+        with self.transaction():
+            # Cascades to the feature's global flag, overrides and rollout
+            self.conn.execute("DELETE FROM features WHERE name = ?", (feature_name,))
+            self._log_change("remove_feature", feature_name)
+        self._feature_bitmaps.pop(feature_name, None)
+        self._rollouts.pop(feature_name, None)
+        self._rollout_bitmaps.pop(feature_name, None)
 
     def rename_feature(self, old_name: str, new_name: str):
-        with self.conn:
-            self.conn.execute("UPDATE feature_flags SET feature_name = ? WHERE feature_name = ?", (new_name, old_name))
-            self.conn.execute("UPDATE global_feature_flags SET feature_name = ? WHERE feature_name = ?", (new_name, old_name))
+        with self.transaction():
+            # Names left behind by features whose rows are all gone would
+            # block the rename on the UNIQUE constraint
+            self.conn.execute("""
+                DELETE FROM features WHERE name IN (:old_name, :new_name)
+                AND NOT EXISTS (SELECT 1 FROM global_feature_flags g WHERE g.feature_id = features.feature_id)
+                AND NOT EXISTS (SELECT 1 FROM feature_flags o WHERE o.feature_id = features.feature_id)
+                AND NOT EXISTS (SELECT 1 FROM rollouts r WHERE r.feature_id = features.feature_id)
+            """, {"old_name": old_name, "new_name": new_name})
+            if old_name != new_name and self.conn.execute(
+                    "SELECT COUNT(*) FROM features WHERE name IN (?, ?)", (old_name, new_name)).fetchone()[0] == 2:
+                raise ValueError(f"Feature {new_name!r} already exists.")
+            self.conn.execute("UPDATE features SET name = ? WHERE name = ?", (new_name, old_name))
+            self._log_change("rename_feature", old_name, new_name=new_name)
+        if self.has_bitmap_index:
+            self._feature_bitmaps.pop(old_name, None)
+            self._reindex_feature(new_name)
+            self._reindex_rollout(old_name)
+            self._reindex_rollout(new_name)
+
+    # A NULL key column never conflicts on the primary key, so customer-only
+    # and user-only overrides upsert against their partial unique indexes.
+    # Parameters are a FlagRow; the feature must already be interned.
+    _UPSERT_FLAG = """
+        INSERT INTO feature_flags (feature_id, customer_id, user_id, is_enabled)
+        SELECT feature_id, ?2, ?3, ?4 FROM features WHERE name = ?1
+        ON CONFLICT {} DO UPDATE SET is_enabled = excluded.is_enabled
+    """
+    _UPSERT_CUSTOMER_FLAG = _UPSERT_FLAG.format("(feature_id, customer_id) WHERE user_id IS NULL")
+    _UPSERT_USER_FLAG = _UPSERT_FLAG.format("(feature_id, user_id) WHERE customer_id IS NULL")
+    _UPSERT_CUSTOMER_USER_FLAG = _UPSERT_FLAG.format("(feature_id, customer_id, user_id)")
+
+    @classmethod
+    def _upsert_flag_sql(cls, customer_id: Optional[int], user_id: Optional[int]) -> str:
+        if user_id is None:
+            return cls._UPSERT_CUSTOMER_FLAG
+        if customer_id is None:
+            return cls._UPSERT_USER_FLAG
+        return cls._UPSERT_CUSTOMER_USER_FLAG
 
     def set_flag(self, feature_name: str, customer_id: Optional[int], user_id: Optional[int], is_enabled: bool):
         if customer_id is None and user_id is None:
             raise ValueError("Use add_feature() or set_global_flag() to set global feature flags.")
-        with self.conn:
+        with self.transaction():
+            self._intern(feature_name)
+            self.conn.execute(self._upsert_flag_sql(customer_id, user_id), (feature_name, customer_id, user_id, is_enabled))
+            self._log_change("set_flag", feature_name, customer_id, user_id, is_enabled)
+        if self.has_bitmap_index and customer_id is not None:
+            self._reindex_customer(feature_name, customer_id)
+
+    def set_flags_bulk(self, flags: Iterable[FlagRow], chunk_size: int = BULK_CHUNK_SIZE) -> int:
+        count = 0
+        with self.transaction():
+            for chunk in chunked(flags, chunk_size):
+                rows_by_statement: Dict[str, List[FlagRow]] = {}
+                for row in chunk:
+                    _, customer_id, user_id, _ = row
+                    if customer_id is None and user_id is None:
+                        raise ValueError("Use add_feature() or set_global_flag() to set global feature flags.")
+                    rows_by_statement.setdefault(self._upsert_flag_sql(customer_id, user_id), []).append(row)
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO features (name) VALUES (?)", ((name,) for name in {row[0] for row in chunk}))
+                for statement, rows in rows_by_statement.items():
+                    self.conn.executemany(statement, rows)
+                if self.change_log:
+                    self.conn.executemany(self._LOG_CHANGE, (("set_flag",) + tuple(row) + (None, None) for row in chunk))
+                if self.has_bitmap_index:
+                    for feature_name, customer_id in {(row[0], row[1]) for row in chunk if row[1] is not None}:
+                        self._reindex_customer(feature_name, customer_id)
+                count += len(chunk)
+        return count
+
+    def add_customers_bulk(self, customer_ids: Iterable[int], chunk_size: int = BULK_CHUNK_SIZE) -> int:
+        count = 0
+        with self.transaction():
+            for chunk in chunked(customer_ids, chunk_size):
+                self.conn.executemany("INSERT OR IGNORE INTO customers (customer_id) VALUES (?)", ((customer_id,) for customer_id in chunk))
+                if self.change_log:
+                    self.conn.executemany(self._LOG_CHANGE, (("add_customer", None, customer_id, None, None, None, None) for customer_id in chunk))
+                if self.has_bitmap_index:
+                    for customer_id in chunk:
+                        self._index_new_customer(customer_id)
+                count += len(chunk)
+        return count
+
+    def set_rollout(self, feature_name: str, percentage: float, salt: Optional[str] = None,
+                    min_customer_id: Optional[int] = None, max_customer_id: Optional[int] = None):
+        rollout = Rollout.for_feature(feature_name, percentage, salt, min_customer_id, max_customer_id)
+        with self.transaction():
+            self._intern(feature_name)
             self.conn.execute("""
-                INSERT INTO feature_flags (feature_name, customer_id, user_id, is_enabled)
-                VALUES (?, ?, ?, ?)
-                ON CONFLICT(feature_name, customer_id, user_id) DO UPDATE SET is_enabled = excluded.is_enabled
-            """, (feature_name, customer_id, user_id, is_enabled))
+                INSERT INTO rollouts (feature_id, percentage, salt, min_customer_id, max_customer_id)
+                SELECT feature_id, ?2, ?3, ?4, ?5 FROM features WHERE name = ?1
+                ON CONFLICT(feature_id) DO UPDATE SET
+                    percentage = excluded.percentage, salt = excluded.salt,
+                    min_customer_id = excluded.min_customer_id, max_customer_id = excluded.max_customer_id
+            """, (feature_name,) + tuple(rollout))
+            self._log_change("set_rollout", feature_name, rollout=rollout)
+        if self.has_bitmap_index:
+            self._reindex_rollout(feature_name)
+
+    def clear_rollout(self, feature_name: str):
+        with self.transaction():
+            self.conn.execute("DELETE FROM rollouts WHERE feature_id = (SELECT feature_id FROM features WHERE name = ?)", (feature_name,))
+            self._log_change("clear_rollout", feature_name)
+        if self.has_bitmap_index:
+            self._reindex_rollout(feature_name)
+
+    def _rollout(self, feature_name: str) -> Optional[Rollout]:
+        row = self.conn.execute("""
+            SELECT r.percentage, r.salt, r.min_customer_id, r.max_customer_id
+            FROM rollouts r JOIN features f USING (feature_id)
+            WHERE f.name = ?
+        """, (feature_name,)).fetchone()
+        return None if row is None else Rollout(*row)
+
+    def list_rollouts(self) -> Dict[str, Rollout]:
+        cursor = self.conn.execute("""
+            SELECT f.name, r.percentage, r.salt, r.min_customer_id, r.max_customer_id
+            FROM rollouts r JOIN features f USING (feature_id)
+        """)
+        return {name: Rollout(*rule) for name, *rule in cursor}
 
     def remove_customer(self, customer_id: int):
-        with self.conn:
-            self.conn.execute("DELETE FROM feature_flags WHERE customer_id = ?", (customer_id,))
+        with self.transaction():
+            # The customers_delete_overrides trigger only fires for customers
+            # that were added; overrides can name customers that never were
             self.conn.execute("DELETE FROM customers WHERE customer_id = ?", (customer_id,))
+            self.conn.execute("DELETE FROM feature_flags WHERE customer_id = ?", (customer_id,))
+            self._log_change("remove_customer", customer_id=customer_id)
+        if self.has_bitmap_index:
+            self._all_customers.discard(customer_id)
+            for bitmaps in self._feature_bitmaps.values():
+                bitmaps.discard(customer_id)
+            for customers in self._rollout_bitmaps.values():
+                customers.discard(customer_id)
 
     def remove_user(self, user_id: int):
-        with self.conn:
+        affected = []
+        if self.has_bitmap_index:
+            cursor = self.conn.execute("""
+                SELECT DISTINCT f.name, o.customer_id FROM feature_flags o JOIN features f USING (feature_id)
+                WHERE o.user_id = ? AND o.customer_id IS NOT NULL
+            """, (user_id,))
+            affected = cursor.fetchall()
+        with self.transaction():
             self.conn.execute("DELETE FROM feature_flags WHERE user_id = ?", (user_id,))
+            self._log_change("remove_user", user_id=user_id)
+        for feature_name, customer_id in affected:
+            self._reindex_customer(feature_name, customer_id)
 
-    def list_customers_with_feature(self, feature_name: str) -> List[int]:
-        # DEBUG: Print all feature_flags for this feature
-        cursor = self.conn.execute("SELECT * FROM feature_flags WHERE feature_name = ?", (feature_name,))
-        print('DEBUG feature_flags:', cursor.fetchall())
-        cursor = self.conn.execute("SELECT is_enabled FROM global_feature_flags WHERE feature_name = ?", (feature_name,))
+    def _global_flag(self, feature_name: str) -> bool:
+        cursor = self.conn.execute("""
+            SELECT g.is_enabled FROM global_feature_flags g JOIN features f USING (feature_id) WHERE f.name = ?
+        """, (feature_name,))
         row = cursor.fetchone()
-        if row and row[0]:
-            # Globally enabled: all customers except those blacklisted at customer level
-            cursor = self.conn.execute("""
-                SELECT DISTINCT customer_id FROM customers
-                WHERE customer_id NOT IN (
-                    SELECT customer_id FROM feature_flags
-                    WHERE feature_name = ? AND is_enabled = 0 AND customer_id IS NOT NULL AND user_id IS NULL
-                )
-            """, (feature_name,))
-            customers = {row[0] for row in cursor.fetchall() if row[0] is not None}
-            print('DEBUG customers (global enabled):', customers)
-        else:
-            cursor = self.conn.execute("""
-                SELECT DISTINCT customer_id FROM feature_flags
-                WHERE feature_name = ? AND is_enabled = 1 AND customer_id IS NOT NULL
-            """, (feature_name,))
-            customers = {row[0] for row in cursor.fetchall() if row[0] is not None}
-            print('DEBUG customers (customer-level enable):', customers)
-            cursor = self.conn.execute("""
-                SELECT DISTINCT customer_id FROM feature_flags
-                WHERE feature_name = ? AND is_enabled = 1 AND user_id IS NOT NULL
-            """, (feature_name,))
-            user_enabled_customers = {row[0] for row in cursor.fetchall() if row[0] is not None}
-            print('DEBUG user_enabled_customers:', user_enabled_customers)
-            customers.update(user_enabled_customers)
-            cursor = self.conn.execute("""
-                SELECT DISTINCT customer_id FROM feature_flags
-                WHERE feature_name = ? AND is_enabled = 0 AND customer_id IS NOT NULL
-            """, (feature_name,))
-            blacklisted = {row[0] for row in cursor.fetchall() if row[0] is not None}
-            print('DEBUG blacklisted:', blacklisted)
-            customers.difference_update(blacklisted)
-        print('DEBUG final customers:', customers)
-        return list(customers)
+        return bool(row and row[0])
+
+    def _customers_with_feature_bitmap(self, feature_name: str) -> CustomerBitmap:
+        bitmaps = self._feature_bitmaps.get(feature_name) or FeatureBitmaps()
+        return bitmaps.customers_with_feature(
+            self._all_customers, self._global_flag(feature_name), self._rollout_bitmaps.get(feature_name))
+
+    # Globally enabled: every customer except those disabled at customer level.
+    # Otherwise: customers with an enabling override (customer or user level)
+    # and no disabling one, i.e. MIN(is_enabled) = 1 over their rows, plus,
+    # with a rollout, the customers it includes that are not disabled at
+    # customer level. {after} takes the keyset condition when paging.
+    _CUSTOMERS_WITH_GLOBAL_FEATURE = """
+        SELECT customer_id FROM customers
+        WHERE customer_id NOT IN (
+            SELECT customer_id FROM feature_flags
+            WHERE feature_id = :feature_id AND is_enabled = 0 AND customer_id IS NOT NULL AND user_id IS NULL
+        ) {after}
+    """
+    _CUSTOMERS_WITH_OVERRIDDEN_FEATURE = """
+        SELECT customer_id FROM feature_flags
+        WHERE feature_id = :feature_id AND customer_id IS NOT NULL {after}
+        GROUP BY customer_id
+        HAVING MIN(is_enabled) = 1
+    """
+    _CUSTOMERS_WITH_ROLLOUT_FEATURE = """
+        SELECT customer_id FROM customers
+        WHERE customer_id BETWEEN :min_customer_id AND :max_customer_id {after}
+        AND rollout_bucket(:salt, customer_id) < :threshold
+        AND customer_id NOT IN (
+            SELECT customer_id FROM feature_flags
+            WHERE feature_id = :feature_id AND is_enabled = 0 AND customer_id IS NOT NULL AND user_id IS NULL
+        )
+        UNION
+    """ + _CUSTOMERS_WITH_OVERRIDDEN_FEATURE
+
+    def _feature_state(self, feature_name: str) -> Tuple[Optional[int], bool, Optional[Rollout]]:
+        # (feature_id, global flag, rollout) in one lookup; the id is None
+        # for an unknown feature, which matches no rows.
+        row = self.conn.execute("""
+            SELECT f.feature_id, g.is_enabled, r.percentage, r.salt, r.min_customer_id, r.max_customer_id
+            FROM features f
+            LEFT JOIN global_feature_flags g USING (feature_id)
+            LEFT JOIN rollouts r USING (feature_id)
+            WHERE f.name = ?
+        """, (feature_name,)).fetchone()
+        if row is None:
+            return None, False, None
+        feature_id, global_enabled, *rollout = row
+        return feature_id, bool(global_enabled), None if rollout[0] is None else Rollout(*rollout)
+
+    _CUSTOMERS_WITH_EFFECTIVE_FEATURE = """
+        SELECT customer_id FROM effective_flags
+        WHERE feature_id = (SELECT feature_id FROM features WHERE name = :feature_name) {after}
+    """
+
+    def _customers_with_feature_query(self, feature_name: str) -> Tuple[str, Dict[str, Any]]:
+        if self.has_effective_flags:
+            return self._CUSTOMERS_WITH_EFFECTIVE_FEATURE, {"feature_name": feature_name}
+        feature_id, global_enabled, rollout = self._feature_state(feature_name)
+        params: Dict[str, Any] = {"feature_id": feature_id}
+        if global_enabled:
+            return self._CUSTOMERS_WITH_GLOBAL_FEATURE, params
+        if rollout is None:
+            return self._CUSTOMERS_WITH_OVERRIDDEN_FEATURE, params
+        params.update(
+            salt=rollout.salt,
+            threshold=rollout.threshold,
+            min_customer_id=MIN_CUSTOMER_ID if rollout.min_customer_id is None else rollout.min_customer_id,
+            max_customer_id=MAX_CUSTOMER_ID if rollout.max_customer_id is None else rollout.max_customer_id,
+        )
+        return self._CUSTOMERS_WITH_ROLLOUT_FEATURE, params
+
+    def list_customers_with_feature(self, feature_name: str) -> List[int]:
+        if self.has_bitmap_index:
+            return list(self._customers_with_feature_bitmap(feature_name))
+        query, params = self._customers_with_feature_query(feature_name)
+        cursor = self.conn.execute(query.format(after=""), params)
+        return [row[0] for row in cursor.fetchall()]
+
+    def count_customers_with_feature(self, feature_name: str) -> int:
+        if self.has_bitmap_index:
+            return len(self._customers_with_feature_bitmap(feature_name))
+        query, params = self._customers_with_feature_query(feature_name)
+        cursor = self.conn.execute(f"SELECT COUNT(*) FROM ({query.format(after='')})", params)
+        return cursor.fetchone()[0]
+
+    def _page(self, query: str, params: Dict[str, Any], after: Optional[int], limit: int) -> List[int]:
+        query = query.format(after="" if after is None else "AND customer_id > :after")
+        cursor = self.conn.execute(query, dict(params, after=after, limit=limit))
+        return [row[0] for row in cursor]
+
+    def page_all_customers(self, after: Optional[int] = None, limit: int = PAGE_SIZE) -> List[int]:
+        if self.has_bitmap_index:
+            customers = self._all_customers if after is None else self._all_customers.iter_from(after + 1)
+            return list(islice(customers, limit))
+        return self._page(
+            "SELECT customer_id FROM customers WHERE 1 {after} ORDER BY customer_id LIMIT :limit", {}, after, limit)
+
+    def page_customers_with_feature(self, feature_name: str, after: Optional[int] = None,
+                                    limit: int = PAGE_SIZE) -> List[int]:
+        if self.has_bitmap_index:
+            customers = self._customers_with_feature_bitmap(feature_name)
+            return list(islice(customers if after is None else customers.iter_from(after + 1), limit))
+        query, params = self._customers_with_feature_query(feature_name)
+        return self._page(query + " ORDER BY customer_id LIMIT :limit", params, after, limit)
+
+    def _page_explicit(self, feature_name: str, is_enabled: bool, after: Optional[int], limit: int) -> List[int]:
+        return self._page("""
+            SELECT DISTINCT customer_id FROM feature_flags
+            WHERE feature_id = (SELECT feature_id FROM features WHERE name = :feature_name)
+            AND is_enabled = :is_enabled AND customer_id IS NOT NULL {after}
+            ORDER BY customer_id LIMIT :limit
+        """, {"feature_name": feature_name, "is_enabled": is_enabled}, after, limit)
+
+    def page_customers_with_feature_explicitly_enabled(self, feature_name: str, after: Optional[int] = None,
+                                                       limit: int = PAGE_SIZE) -> List[int]:
+        return self._page_explicit(feature_name, True, after, limit)
+
+    def page_customers_with_feature_explicitly_disabled(self, feature_name: str, after: Optional[int] = None,
+                                                        limit: int = PAGE_SIZE) -> List[int]:
+        return self._page_explicit(feature_name, False, after, limit)
 
     def list_customers_with_feature_explicitly_enabled(self, feature_name: str) -> List[int]:
         cursor = self.conn.execute("""
             SELECT DISTINCT customer_id FROM feature_flags
-            WHERE feature_name = ? AND is_enabled = 1 AND customer_id IS NOT NULL
+            WHERE feature_id = (SELECT feature_id FROM features WHERE name = ?) AND is_enabled = 1 AND customer_id IS NOT NULL
         """, (feature_name,))
         return [row[0] for row in cursor.fetchall()]
 
     def list_customers_with_feature_explicitly_disabled(self, feature_name: str) -> List[int]:
         cursor = self.conn.execute("""
             SELECT DISTINCT customer_id FROM feature_flags
-            WHERE feature_name = ? AND is_enabled = 0 AND customer_id IS NOT NULL
+            WHERE feature_id = (SELECT feature_id FROM features WHERE name = ?) AND is_enabled = 0 AND customer_id IS NOT NULL
         """, (feature_name,))
         return [row[0] for row in cursor.fetchall()]
 
     def list_features_for_customer(self, customer_id: int) -> List[str]:
-        cursor = self.conn.execute("SELECT feature_name FROM global_feature_flags WHERE is_enabled = 1")
+        # effective_flags holds the features a registered customer has by
+        # default; where the customer has overrides, any disabling one wins
+        if self.has_effective_flags and self.conn.execute(
+                "SELECT 1 FROM customers WHERE customer_id = ?", (customer_id,)).fetchone():
+            cursor = self.conn.execute("""
+                SELECT f.name FROM effective_flags e JOIN features f USING (feature_id)
+                WHERE e.customer_id = :customer_id AND NOT EXISTS (
+                    SELECT 1 FROM feature_flags o WHERE o.feature_id = e.feature_id AND o.customer_id = :customer_id
+                )
+                UNION ALL
+                SELECT f.name FROM feature_flags o JOIN features f USING (feature_id)
+                WHERE o.customer_id = :customer_id
+                GROUP BY o.feature_id
+                HAVING MIN(o.is_enabled) = 1
+            """, {"customer_id": customer_id})
+            return [row[0] for row in cursor.fetchall()]
+        cursor = self.conn.execute("""
+            SELECT f.name FROM global_feature_flags g JOIN features f USING (feature_id) WHERE g.is_enabled = 1
+        """)
         global_features = {row[0] for row in cursor.fetchall()}
 
+        customer_features = set()
+        blacklisted_features = set()
         cursor = self.conn.execute("""
-            SELECT feature_name FROM feature_flags
-            WHERE customer_id = ? AND is_enabled = 1
+            SELECT f.name, o.is_enabled FROM feature_flags o JOIN features f USING (feature_id)
+            WHERE o.customer_id = ?
         """, (customer_id,))
-        customer_features = {row[0] for row in cursor.fetchall()}
+        for name, is_enabled in cursor.fetchall():
+            (customer_features if is_enabled else blacklisted_features).add(name)
 
-        cursor = self.conn.execute("""
-            SELECT feature_name FROM feature_flags
-            WHERE customer_id = ? AND is_enabled = 0
-        """, (customer_id,))
-        blacklisted_features = {row[0] for row in cursor.fetchall()}
+        rollout_features = {name for name, rollout in self.list_rollouts().items() if rollout.includes(customer_id)}
 
-        return list((global_features | customer_features) - blacklisted_features)
+        return list((global_features | customer_features | rollout_features) - blacklisted_features)
 
     def list_all_features(self) -> List[str]:
-        cursor = self.conn.execute("SELECT feature_name FROM global_feature_flags")
+        cursor = self.conn.execute("""
+            SELECT f.name FROM global_feature_flags g JOIN features f USING (feature_id) ORDER BY g.feature_id
+        """)
         return [row[0] for row in cursor.fetchall()]
 
     def describe_all_features(self) -> List[Dict[str, Union[str, bool, List[int]]]]:
-        cursor = self.conn.execute("SELECT feature_name, is_enabled FROM global_feature_flags")
+        # One pass over a join ordered by feature then customer: rows for a
+        # feature arrive together and duplicate customers are adjacent.
+        cursor = self.conn.execute("""
+            SELECT n.name, g.is_enabled, f.customer_id, f.is_enabled
+            FROM global_feature_flags g
+            JOIN features n USING (feature_id)
+            LEFT JOIN feature_flags f ON f.feature_id = g.feature_id AND f.customer_id IS NOT NULL
+            ORDER BY g.feature_id, f.customer_id
+        """)
         features = []
-        for name, is_enabled in cursor.fetchall():
-            features.append({
-                "feature_name": name,
-                "global_enabled": bool(is_enabled),
-                "explicitly_enabled_customers": self.list_customers_with_feature_explicitly_enabled(name),
-                "explicitly_disabled_customers": self.list_customers_with_feature_explicitly_disabled(name),
-            })
+        feature = None
+        for name, global_enabled, customer_id, is_enabled in cursor:
+            if feature is None or feature["feature_name"] != name:
+                feature = {
+                    "feature_name": name,
+                    "global_enabled": bool(global_enabled),
+                    "explicitly_enabled_customers": [],
+                    "explicitly_disabled_customers": [],
+                }
+                features.append(feature)
+            if customer_id is None:
+                continue
+            customers = feature["explicitly_enabled_customers" if is_enabled else "explicitly_disabled_customers"]
+            if not customers or customers[-1] != customer_id:
+                customers.append(customer_id)
         return features
 
     def list_all_customers(self) -> List[int]:
         cursor = self.conn.execute("SELECT customer_id FROM customers")
         return [row[0] for row in cursor.fetchall()]
 
+    # Batch evaluation follows list_features_for_customer: any disabling
+    # override for a customer wins, then any enabling one, then the global
+    # flag or rollout. MIN(is_enabled) over a customer's overrides folds the
+    # overrides into one value.
+    def evaluate_many(self, feature_name: str, customer_ids: Iterable[int]) -> Dict[int, bool]:
+        feature_id, global_enabled, rollout = self._feature_state(feature_name)
+        if global_enabled:
+            rollout = None
+        cursor = self.conn.execute("""
+            SELECT customer_id, MIN(is_enabled) FROM feature_flags
+            WHERE feature_id = ? AND customer_id IS NOT NULL
+            GROUP BY customer_id
+        """, (feature_id,))
+        overrides = {customer_id: bool(is_enabled) for customer_id, is_enabled in cursor.fetchall()}
+        if rollout is None:
+            return {customer_id: overrides.get(customer_id, global_enabled) for customer_id in customer_ids}
+        return {
+            customer_id: overrides[customer_id] if customer_id in overrides else rollout.includes(customer_id)
+            for customer_id in customer_ids
+        }
+
+    def evaluate_matrix(self, customer_ids: Iterable[int], feature_names: Iterable[str]) -> Dict[int, Dict[str, bool]]:
+        customer_ids = list(customer_ids)
+        feature_names = list(dict.fromkeys(feature_names))
+        if not feature_names:
+            return {customer_id: {} for customer_id in customer_ids}
+        placeholders = ", ".join("?" * len(feature_names))
+        cursor = self.conn.execute(f"""
+            SELECT f.name, g.is_enabled FROM global_feature_flags g JOIN features f USING (feature_id)
+            WHERE f.name IN ({placeholders})
+        """, feature_names)
+        global_flags = {name: bool(is_enabled) for name, is_enabled in cursor.fetchall()}
+        cursor = self.conn.execute(f"""
+            SELECT f.name, o.customer_id, MIN(o.is_enabled) FROM feature_flags o JOIN features f USING (feature_id)
+            WHERE f.name IN ({placeholders}) AND o.customer_id IS NOT NULL
+            GROUP BY o.feature_id, o.customer_id
+        """, feature_names)
+        overrides: Dict[str, Dict[int, bool]] = {name: {} for name in feature_names}
+        for name, customer_id, is_enabled in cursor.fetchall():
+            overrides[name][customer_id] = bool(is_enabled)
+        rollouts = self.list_rollouts()
+        columns = [(name, overrides[name], global_flags.get(name, False)) for name in feature_names]
+        matrix = {}
+        for customer_id in customer_ids:
+            row = matrix[customer_id] = {}
+            for name, column, default in columns:
+                state = column.get(customer_id)
+                if state is None:
+                    rollout = rollouts.get(name)
+                    state = default or (rollout is not None and rollout.includes(customer_id))
+                row[name] = state
+        return matrix
+
+    def export_flags(self) -> Tuple[Dict[str, bool], List[FlagRow]]:
+        cursor = self.conn.execute("SELECT f.name, g.is_enabled FROM global_feature_flags g JOIN features f USING (feature_id)")
+        global_flags = {name: bool(is_enabled) for name, is_enabled in cursor.fetchall()}
+        # rowid order so that the most recent write wins when rows repeat
+        cursor = self.conn.execute("""
+            SELECT f.name, o.customer_id, o.user_id, o.is_enabled FROM feature_flags o JOIN features f USING (feature_id)
+            ORDER BY o.rowid
+        """)
+        overrides = [(name, customer_id, user_id, bool(is_enabled)) for name, customer_id, user_id, is_enabled in cursor.fetchall()]
+        return global_flags, overrides
+
+    def current_version(self) -> int:
+        cursor = self.conn.execute("""
+            SELECT MAX(IFNULL((SELECT MAX(version) FROM flag_changes), 0), compacted_through)
+            FROM flag_changes_compaction
+        """)
+        return cursor.fetchone()[0]
+
+    def changes_since(self, version: int, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        compacted_through = self.conn.execute("SELECT compacted_through FROM flag_changes_compaction").fetchone()[0]
+        if version < compacted_through:
+            raise ChangesCompactedError(f"Changes up to version {compacted_through} have been compacted; reload from a full snapshot.")
+        cursor = self.conn.execute(f"""
+            SELECT {", ".join(CHANGE_FIELDS)} FROM flag_changes
+            WHERE version > ?
+            ORDER BY version
+            LIMIT ?
+        """, (version, -1 if limit is None else limit))
+        changes = [dict(zip(CHANGE_FIELDS, row)) for row in cursor.fetchall()]
+        for change in changes:
+            if change["is_enabled"] is not None:
+                change["is_enabled"] = bool(change["is_enabled"])
+            if change["rollout"] is not None:
+                change["rollout"] = json.loads(change["rollout"])
+        return changes
+
+    def compact_changes(self, through_version: int) -> int:
+        with self.transaction():
+            # Never move the horizon past the newest version, or new changes
+            # would be numbered below it.
+            through_version = min(through_version, self.current_version())
+            cursor = self.conn.execute("DELETE FROM flag_changes WHERE version <= ?", (through_version,))
+            self.conn.execute("""
+                UPDATE flag_changes_compaction SET compacted_through = MAX(compacted_through, ?)
+            """, (through_version,))
+        return cursor.rowcount
+
     def close(self):
         self.conn.close()
 
 
+class PooledSQLiteFeatureFlagStore(SQLiteFeatureFlagStore):
+    """SQLite store that can be shared between threads.
+
+    Every thread lazily opens its own connection in WAL mode, so readers run
+    concurrently and never wait on a writer. Transactions are per thread.
+    """
+
+    def __init__(self, db_path: str = "feature_flags.db", cache_size_kib: int = 65536,
+                 mmap_size: int = 256 * 1024 * 1024, busy_timeout_ms: int = 5000, effective_flags: bool = False):
+        if db_path == ":memory:" or db_path.startswith("file::memory:"):
+            raise ValueError("A pooled store needs a database file; every connection to :memory: is a separate database.")
+        self.cache_size_kib = cache_size_kib
+        self.mmap_size = mmap_size
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        # The bitmap index is process-local state and would need its own
+        # locking and visibility rules across threads, so it is not offered.
+        super().__init__(db_path, effective_flags=effective_flags)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kib)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute("PRAGMA foreign_keys=ON")
+        register_sql_functions(conn)
+        conn.set_trace_callback(self._trace_callback)
+        return conn
+
+    def set_trace_callback(self, callback: Optional[Callable[[str], None]]):
+        self._trace_callback = callback
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.set_trace_callback(callback)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self.conn = self._connect()
+        return conn
+
+    @conn.setter
+    def conn(self, conn: sqlite3.Connection):
+        self._local.conn = conn
+        with self._connections_lock:
+            self._connections.append(conn)
+
+    @property
+    def _transaction_depth(self) -> int:
+        return getattr(self._local, "transaction_depth", 0)
+
+    @_transaction_depth.setter
+    def _transaction_depth(self, depth: int):
+        self._local.transaction_depth = depth
+
+    @property
+    def pool_size(self) -> int:
+        with self._connections_lock:
+            return len(self._connections)
+
+    def close(self):
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+
+class FeatureFlagSnapshot:
+    """Point-in-time copy of every flag, compiled into hash lookups.
+
+    Precedence, most specific first: a user override scoped to the customer,
+    a user override with no customer, a customer override, then the global
+    flag or the feature's rollout. Unknown features are disabled. ``version``
+    is the store's change-log version the snapshot reflects; apply_changes()
+    rolls it forward.
+    """
+
+    def __init__(self, global_flags: Dict[str, bool], overrides: Iterable[FlagRow], version: int = 0,
+                 rollouts: Optional[Dict[str, Rollout]] = None):
+        self.version = version
+        self.global_flags = dict(global_flags)
+        self.rollouts: Dict[str, Rollout] = dict(rollouts or {})
+        self.customer_overrides: Dict[Tuple[str, int], bool] = {}
+        self.user_overrides: Dict[Tuple[str, Optional[int], int], bool] = {}
+        for feature_name, customer_id, user_id, is_enabled in overrides:
+            if user_id is None:
+                self.customer_overrides[(feature_name, customer_id)] = is_enabled
+            else:
+                self.user_overrides[(feature_name, customer_id, user_id)] = is_enabled
+
+    @classmethod
+    def from_store(cls, store: FeatureFlagStore) -> "FeatureFlagSnapshot":
+        # Retry until no write lands between reading the version and the flags,
+        # so the version is exact and later deltas apply cleanly.
+        while True:
+            version = store.current_version()
+            global_flags, overrides = store.export_flags()
+            rollouts = store.list_rollouts()
+            if store.current_version() == version:
+                return cls(global_flags, overrides, version, rollouts)
+
+    def is_enabled(self, feature_name: str, customer_id: Optional[int], user_id: Optional[int] = None) -> bool:
+        if user_id is not None:
+            state = self.user_overrides.get((feature_name, customer_id, user_id))
+            if state is None:
+                state = self.user_overrides.get((feature_name, None, user_id))
+            if state is not None:
+                return state
+        state = self.customer_overrides.get((feature_name, customer_id))
+        if state is not None:
+            return state
+        if self.global_flags.get(feature_name, False):
+            return True
+        rollout = self.rollouts.get(feature_name)
+        return rollout is not None and customer_id is not None and rollout.includes(customer_id)
+
+    def _drop_overrides(self, overrides: dict, position: int, value):
+        for key in [key for key in overrides if key[position] == value]:
+            del overrides[key]
+
+    def apply_changes(self, changes: Iterable[Dict[str, Any]]):
+        for change in changes:
+            if change["version"] <= self.version:
+                continue
+            operation, feature_name = change["operation"], change["feature_name"]
+            if operation in ("add_feature", "set_global_flag"):
+                self.global_flags[feature_name] = change["is_enabled"]
+            elif operation == "set_flag":
+                if change["user_id"] is None:
+                    self.customer_overrides[(feature_name, change["customer_id"])] = change["is_enabled"]
+                else:
+                    self.user_overrides[(feature_name, change["customer_id"], change["user_id"])] = change["is_enabled"]
+            elif operation == "set_rollout":
+                self.rollouts[feature_name] = Rollout(**change["rollout"])
+            elif operation == "clear_rollout":
+                self.rollouts.pop(feature_name, None)
+            elif operation == "remove_feature":
+                self.global_flags.pop(feature_name, None)
+                self.rollouts.pop(feature_name, None)
+                self._drop_overrides(self.customer_overrides, 0, feature_name)
+                self._drop_overrides(self.user_overrides, 0, feature_name)
+            elif operation == "rename_feature":
+                new_name = change["new_name"]
+                if feature_name in self.global_flags:
+                    self.global_flags[new_name] = self.global_flags.pop(feature_name)
+                if feature_name in self.rollouts:
+                    self.rollouts[new_name] = self.rollouts.pop(feature_name)
+                for overrides in (self.customer_overrides, self.user_overrides):
+                    for key in [key for key in overrides if key[0] == feature_name]:
+                        overrides[(new_name,) + key[1:]] = overrides.pop(key)
+            elif operation == "remove_customer":
+                self._drop_overrides(self.customer_overrides, 1, change["customer_id"])
+                self._drop_overrides(self.user_overrides, 1, change["customer_id"])
+            elif operation == "remove_user":
+                self._drop_overrides(self.user_overrides, 2, change["user_id"])
+            self.version = change["version"]
+
+
 class FeatureFlagService:
-    def __init__(self, store: FeatureFlagStore):
+    # Store methods that change flags; calling one through the service
+    # invalidates the compiled snapshot.
+    MUTATING_METHODS = frozenset({
+        "add_customer", "add_feature", "set_global_flag", "remove_feature", "rename_feature",
+        "set_flag", "remove_customer", "remove_user", "set_flags_bulk", "add_customers_bulk",
+        "set_rollout", "clear_rollout",
+    })
+
+    # Store methods that are not timed: context managers and hooks
+    UNINSTRUMENTED_METHODS = frozenset({"transaction", "set_trace_callback"})
+
+    def __init__(self, store: FeatureFlagStore, instrumentation: Optional[Instrumentation] = None):
         self.store = store
+        self.instrumentation = instrumentation
+        self._snapshot: Optional[FeatureFlagSnapshot] = None
+        self._snapshot_stale = False
+        self._snapshot_lock = threading.Lock()
+        if instrumentation is not None:
+            if hasattr(store, "set_trace_callback"):
+                store.set_trace_callback(instrumentation.trace_statement)
+            # Shadow the method on the instance so the uninstrumented path
+            # pays nothing for the feature.
+            self.is_enabled = instrumentation.wrap("is_enabled", self.is_enabled)
 
     def __getattr__(self, item):
-        return getattr(self.store, item)
+        attr = getattr(self.store, item)
+        instrumentation = self.instrumentation
+        if instrumentation is not None and callable(attr) and not item.startswith("_") \
+                and item not in self.UNINSTRUMENTED_METHODS:
+            attr = instrumentation.wrap(item, attr)
+        if item not in self.MUTATING_METHODS:
+            return attr
+
+        def mutator(*args, **kwargs):
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self._snapshot_stale = True
+        return mutator
+
+    @property
+    def snapshot(self) -> FeatureFlagSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None or self._snapshot_stale:
+            snapshot = self.sync_snapshot()
+        return snapshot
+
+    def sync_snapshot(self) -> FeatureFlagSnapshot:
+        # Roll the snapshot forward through the change log; rebuild it only
+        # when there is none yet or the needed history was compacted.
+        with self._snapshot_lock:
+            self._snapshot_stale = False
+            snapshot = self._snapshot
+            if snapshot is not None:
+                try:
+                    snapshot.apply_changes(self.store.changes_since(snapshot.version))
+                    return snapshot
+                except ChangesCompactedError:
+                    pass
+            snapshot = self._snapshot = FeatureFlagSnapshot.from_store(self.store)
+            return snapshot
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        try:
+            with self.store.transaction():
+                yield
+        except BaseException:
+            # The snapshot may have synced changes that were just rolled back
+            self._snapshot = None
+            raise
+        finally:
+            self._snapshot_stale = True
+
+    def invalidate_snapshot(self):
+        # Forces a full rebuild on the next lookup
+        self._snapshot = None
+
+    def is_enabled(self, feature_name: str, customer_id: Optional[int], user_id: Optional[int] = None) -> bool:
+        return self.snapshot.is_enabled(feature_name, customer_id, user_id)
@@ -1,10 +1,103 @@
 import argparse
-from feature_flag_service import FeatureFlagService, SQLiteFeatureFlagStore
+import sys
 
-def main():
+# Everything else (sqlite3 and the service included) is imported by the code
+# that needs it, so that --help and argument errors return immediately.
+
+TRUE_VALUES = {"1", "true", "yes", "y", "on"}
+FALSE_VALUES = {"0", "false", "no", "n", "off"}
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ValueError(f"Invalid boolean value: {value!r}")
+
+
+def parse_optional_int(value):
+    if value is None or value == "":
+        return None
+    return int(value)
+
+
+def read_import_records(stream, fmt):
+    # Yields one dict per CSV row / JSON line without reading the whole file
+    if fmt == "csv":
+        import csv
+        yield from csv.DictReader(stream)
+    else:
+        import json
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def bulk_import(service, stream, fmt, chunk_size):
+    # Records with a feature_name set a flag; records without one add a customer.
+    from feature_flag_service import chunked
+    flag_count = customer_count = 0
+    with service.transaction():
+        for chunk in chunked(read_import_records(stream, fmt), chunk_size):
+            flags, customers = [], []
+            for record in chunk:
+                customer_id = parse_optional_int(record.get("customer_id"))
+                if record.get("feature_name"):
+                    flags.append((
+                        record["feature_name"],
+                        customer_id,
+                        parse_optional_int(record.get("user_id")),
+                        parse_bool(record.get("is_enabled", True)),
+                    ))
+                elif customer_id is not None:
+                    customers.append(customer_id)
+                else:
+                    raise ValueError(f"Record has neither feature_name nor customer_id: {record!r}")
+            flag_count += service.set_flags_bulk(flags, chunk_size=chunk_size)
+            customer_count += service.add_customers_bulk(customers, chunk_size=chunk_size)
+    return flag_count, customer_count
+
+
+def build_parser():
     parser = argparse.ArgumentParser(description="Feature Flag Service CLI")
-    parser.add_argument("--db-path", default="feature_flags.db", help="Path to the SQLite database file")
+    parser.add_argument("--db-path", default="feature_flags.db",
+                        help="Path to the SQLite database file, or to the directory of a sharded store")
+    parser.add_argument("--stats", action="store_true", help="Print per-method call statistics to stderr on exit")
     subparsers = parser.add_subparsers(dest="command")
+    add_commands(subparsers)
+
+    # Run many commands against one open database
+    p = subparsers.add_parser("batch", help="Run one command per line from a file or stdin")
+    p.add_argument("path", nargs="?", default="-", help="Command file, or - for stdin (default)")
+    p.add_argument("--transaction-size", type=int, default=1000, help="Commands committed together")
+    subparsers.add_parser("shell", help="Interactive prompt")
+
+    # Copy the database (a file or a sharded directory) into a new sharded directory
+    p = subparsers.add_parser("reshard", help="Offline: copy --db-path into TARGET split over --shards files")
+    p.add_argument("target")
+    p.add_argument("--shards", type=int, required=True)
+    p.add_argument("--chunk-size", type=int, default=10000)
+
+    # Serve evaluations and snapshots over HTTP
+    p = subparsers.add_parser("serve")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8080)
+    p.add_argument("--access-log", action="store_true")
+    return parser
+
+
+def build_command_parser(prog):
+    # Parses the lines of a batch file or shell session
+    parser = argparse.ArgumentParser(prog=prog, add_help=False)
+    add_commands(parser.add_subparsers(dest="command"))
+    return parser
+
+
+def add_commands(subparsers):
 
     # Add feature
     p = subparsers.add_parser("add-feature")
@@ -42,6 +135,17 @@ def main():
     p.add_argument("--enabled", action="store_true")
     p.add_argument("--disabled", action="store_true")
 
+    # Percentage rollouts
+    p = subparsers.add_parser("set-rollout")
+    p.add_argument("feature")
+    p.add_argument("percentage", type=float)
+    p.add_argument("--salt", help="Defaults to the feature name")
+    p.add_argument("--min-customer-id", type=int)
+    p.add_argument("--max-customer-id", type=int)
+    p = subparsers.add_parser("clear-rollout")
+    p.add_argument("feature")
+    subparsers.add_parser("list-rollouts")
+
     # List customers with feature
     p = subparsers.add_parser("list-customers")
     p.add_argument("feature")
@@ -67,10 +171,39 @@ def main():
     # List all customers
     subparsers.add_parser("list-all-customers")
 
-    args = parser.parse_args()
-    store = SQLiteFeatureFlagStore(db_path=args.db_path)
-    service = FeatureFlagService(store)
+    # Bulk import flags and customers from CSV or JSONL
+    p = subparsers.add_parser("bulk-import")
+    p.add_argument("path", help="CSV or JSONL file, or - for stdin")
+    p.add_argument("--format", choices=["csv", "jsonl"], help="Defaults to the file extension, csv for stdin")
+    p.add_argument("--chunk-size", type=int, default=10000)
+
+    # Change log
+    subparsers.add_parser("current-version")
+    p = subparsers.add_parser("changes-since")
+    p.add_argument("version", type=int)
+    p.add_argument("--limit", type=int)
+    p = subparsers.add_parser("compact-changes")
+    p.add_argument("through_version", type=int)
+
+    # Export a memory-mappable binary snapshot
+    p = subparsers.add_parser("export-snapshot")
+    p.add_argument("path")
+
+    # Materialized effective flags
+    p = subparsers.add_parser(
+        "rebuild-effective", help="Create or recompute the effective_flags table",
+        description="Create or recompute the trigger-maintained effective_flags table. Its triggers call the "
+                    "rollout_bucket SQL function, so once it exists, connections that do not register it "
+                    "(the sqlite3 shell, backup tools, ad-hoc scripts) can no longer write to the database.")
+    p.add_argument("--drop", action="store_true", help="Drop the table and its triggers instead")
 
+    # Storage statistics
+    p = subparsers.add_parser("stats")
+    p.add_argument("--json", action="store_true")
+    p.add_argument("--server", metavar="URL", help="Print a running server's method counters from its /stats instead")
+
+
+def run_command(service, args):
     if args.command == "add-feature":
         service.add_feature(args.name, default_enabled=args.default_enabled)
     elif args.command == "remove-feature":
@@ -89,6 +222,15 @@ def main():
         if not (args.enabled ^ args.disabled):
             raise ValueError("Specify --enabled or --disabled, not both or neither")
         service.set_global_flag(args.feature, is_enabled=args.enabled)
+    elif args.command == "set-rollout":
+        service.set_rollout(args.feature, args.percentage, salt=args.salt,
+                            min_customer_id=args.min_customer_id, max_customer_id=args.max_customer_id)
+    elif args.command == "clear-rollout":
+        service.clear_rollout(args.feature)
+    elif args.command == "list-rollouts":
+        import json
+        for name, rollout in sorted(service.list_rollouts().items()):
+            print(json.dumps(dict(feature_name=name, **rollout._asdict())))
     elif args.command == "list-customers":
         print(service.list_customers_with_feature(args.feature))
     elif args.command == "list-customers-enabled":
@@ -104,10 +246,232 @@ def main():
         pprint(service.describe_all_features())
     elif args.command == "list-all-customers":
         print(service.list_all_customers())
+    elif args.command == "bulk-import":
+        fmt = args.format or ("jsonl" if args.path.endswith((".jsonl", ".ndjson")) else "csv")
+        if args.path == "-":
+            flag_count, customer_count = bulk_import(service, sys.stdin, fmt, args.chunk_size)
+        else:
+            with open(args.path, newline="") as stream:
+                flag_count, customer_count = bulk_import(service, stream, fmt, args.chunk_size)
+        print(f"Imported {flag_count} flags and {customer_count} customers")
+    elif args.command == "current-version":
+        print(service.current_version())
+    elif args.command == "changes-since":
+        import json
+        for change in service.changes_since(args.version, args.limit):
+            print(json.dumps(change))
+    elif args.command == "compact-changes":
+        print(f"Compacted {service.compact_changes(args.through_version)} changes")
+    elif args.command == "export-snapshot":
+        from binary_snapshot import write_binary_snapshot
+        snapshot = write_binary_snapshot(service.store, args.path)
+        print(f"Wrote snapshot version {snapshot.version} to {args.path}")
+    elif args.command == "rebuild-effective":
+        from sharded_feature_flag_store import ShardedFeatureFlagStore
+        store = service.store
+        if isinstance(store, ShardedFeatureFlagStore):
+            sys.exit("rebuild-effective is not supported on a sharded store; run it against a single database file")
+        if args.drop:
+            store.disable_effective_flags()
+            print("Dropped effective_flags")
+        else:
+            count = store.rebuild_effective_flags() if store.has_effective_flags else store.enable_effective_flags()
+            print(f"Rebuilt effective_flags with {count} rows")
+    elif args.command == "stats":
+        import json
+        # Method counters are only meaningful in a long-running process
+        if args.server:
+            print_server_stats(args.server, args.json)
+            return
+        storage = service.storage_stats()
+        if args.json:
+            print(json.dumps({"storage": storage}))
+        else:
+            for name, value in storage.items():
+                print(f"{name:20s} {value}")
     else:
+        raise ValueError(f"Unknown command: {args.command}")
+
+
+class BatchError(Exception):
+    def __init__(self, line_number, line, error):
+        super().__init__(f"line {line_number}: {line}: {error}")
+
+
+def parse_command_line(parser, line):
+    import shlex
+    args = parser.parse_args(shlex.split(line))
+    if args.command is None:
+        raise ValueError("No command given")
+    return args
+
+
+def run_batch(service, lines, transaction_size=1000):
+    """Run one command per line; each group of transaction_size lines commits together.
+
+    Blank lines and lines starting with # are skipped. The first failing line
+    rolls back its group and raises BatchError; earlier groups stay committed.
+    """
+    from feature_flag_service import chunked
+    parser = build_command_parser("batch")
+    commands = ((number, line.strip()) for number, line in enumerate(lines, 1))
+    count = 0
+    for group in chunked(((n, line) for n, line in commands if line and not line.startswith("#")), transaction_size):
+        with service.transaction():
+            for number, line in group:
+                try:
+                    run_command(service, parse_command_line(parser, line))
+                except SystemExit as exc:  # argparse rejected the line
+                    raise BatchError(number, line, f"invalid arguments (exit status {exc.code})") from None
+                except Exception as exc:
+                    raise BatchError(number, line, exc) from exc
+        count += len(group)
+    return count
+
+
+def run_shell(service):
+    import cmd
+
+    class FeatureFlagShell(cmd.Cmd):
+        intro = "Feature flag shell. Type help for commands, begin/commit/rollback for transactions, quit to exit."
+        prompt = "flags> "
+        parser = build_command_parser("shell")
+
+        def __init__(self):
+            super().__init__()
+            self.transaction = None
+
+        def default(self, line):
+            try:
+                run_command(service, parse_command_line(self.parser, line))
+            except SystemExit:
+                pass  # argparse already printed the problem
+            except Exception as exc:
+                print(f"Error: {exc}", file=sys.stderr)
+
+        def emptyline(self):
+            pass
+
+        def do_help(self, arg):
+            try:
+                self.parser.parse_args([arg, "--help"] if arg else ["--help"])
+            except SystemExit:
+                pass
+            if not arg:
+                print("Shell commands: begin, commit, rollback, quit")
+
+        def do_begin(self, arg):
+            if self.transaction is not None:
+                print("Error: a transaction is already open", file=sys.stderr)
+                return
+            self.transaction = service.transaction()
+            self.transaction.__enter__()
+
+        def do_commit(self, arg):
+            if self.transaction is None:
+                print("Error: no open transaction", file=sys.stderr)
+                return
+            transaction, self.transaction = self.transaction, None
+            transaction.__exit__(None, None, None)
+
+        def do_rollback(self, arg):
+            if self.transaction is None:
+                print("Error: no open transaction", file=sys.stderr)
+                return
+            transaction, self.transaction = self.transaction, None
+            transaction.__exit__(RuntimeError, RuntimeError("rolled back"), None)
+
+        def do_quit(self, arg):
+            if self.transaction is not None:
+                print("Rolling back the open transaction", file=sys.stderr)
+                self.do_rollback(arg)
+            return True
+
+        do_exit = do_EOF = do_quit
+
+    shell = FeatureFlagShell()
+    if not sys.stdin.isatty():
+        # Reading from a pipe: no prompt or banner
+        shell.use_rawinput = False
+        shell.prompt = shell.intro = ""
+    shell.cmdloop()
+
+
+def print_server_stats(url, as_json=False):
+    import json
+    from urllib.request import urlopen
+    from instrumentation import format_table
+    with urlopen(url.rstrip("/") + "/stats") as response:
+        methods = json.load(response)["methods"]
+    print(json.dumps({"methods": methods}) if as_json else format_table(methods))
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
         parser.print_help()
+        return
+
+    if args.command == "reshard":
+        from sharded_feature_flag_store import reshard
+        customer_count, flag_count = reshard(args.db_path, args.target, args.shards, args.chunk_size)
+        print(f"Copied {customer_count} customers and {flag_count} overrides into {args.shards} shards")
+        return
+    if args.command == "stats" and args.server:
+        # No database to open
+        print_server_stats(args.server, args.json)
+        return
+
+    import os
+    from feature_flag_service import FeatureFlagService, SQLiteFeatureFlagStore, PooledSQLiteFeatureFlagStore
+    if os.path.isdir(args.db_path):
+        # Shards are served from threads of their own, so this suits serve too
+        from sharded_feature_flag_store import ShardedFeatureFlagStore
+        store = ShardedFeatureFlagStore(args.db_path)
+    elif args.command == "serve":
+        # Requests are handled on many threads
+        store = PooledSQLiteFeatureFlagStore(db_path=args.db_path)
+    else:
+        store = SQLiteFeatureFlagStore(db_path=args.db_path)
+    instrumentation = None
+    # The server exposes its counters on /stats
+    if args.stats or args.command == "serve":
+        from instrumentation import Instrumentation
+        instrumentation = Instrumentation()
+    service = FeatureFlagService(store, instrumentation=instrumentation)
+
+    try:
+        if args.command == "serve":
+            from feature_flag_server import FeatureFlagHTTPServer
+            server = FeatureFlagHTTPServer((args.host, args.port), service, log_requests=args.access_log)
+            host, port = server.server_address[:2]
+            print(f"Serving feature flags on http://{host}:{port}", flush=True)
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                server.server_close()
+        elif args.command == "batch":
+            try:
+                if args.path == "-":
+                    count = run_batch(service, sys.stdin, args.transaction_size)
+                else:
+                    with open(args.path) as stream:
+                        count = run_batch(service, stream, args.transaction_size)
+            except BatchError as exc:
+                sys.exit(f"Batch failed at {exc}")
+            print(f"Ran {count} commands", file=sys.stderr)
+        elif args.command == "shell":
+            run_shell(service)
+        else:
+            run_command(service, args)
+    finally:
+        service.close()
+    if args.stats:
+        print(instrumentation.format_table(), file=sys.stderr)
 
-    service.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
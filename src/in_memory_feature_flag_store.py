@@ -0,0 +1,440 @@
+from bisect import bisect_right
+from contextlib import contextmanager
+from itertools import islice
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from feature_flag_service import (
+    BULK_CHUNK_SIZE, CHANGE_FIELDS, PAGE_SIZE, ChangesCompactedError, FeatureFlagStore, FlagRow, Rollout,
+)
+
+OverrideKey = Tuple[Optional[int], Optional[int]]
+
+
+class _Feature:
+    __slots__ = ("global_enabled", "overrides", "rollout")
+
+    def __init__(self):
+        # None when the feature has no row in the global flag table
+        self.global_enabled: Optional[bool] = None
+        self.overrides: Dict[OverrideKey, bool] = {}
+        self.rollout: Optional[Rollout] = None
+
+    def is_empty(self) -> bool:
+        return self.global_enabled is None and not self.overrides and self.rollout is None
+
+    def customer_states(self) -> Dict[int, bool]:
+        # A customer's overrides folded into one value; any disabling one wins
+        states: Dict[int, bool] = {}
+        for (customer_id, _), is_enabled in self.overrides.items():
+            if customer_id is not None:
+                states[customer_id] = states.get(customer_id, True) and is_enabled
+        return states
+
+    def explicit_customers(self, is_enabled: bool) -> List[int]:
+        return sorted({customer_id for (customer_id, _), state in self.overrides.items()
+                       if customer_id is not None and state == is_enabled})
+
+
+class _Change:
+    __slots__ = CHANGE_FIELDS
+
+    def __init__(self, *values):
+        for field, value in zip(CHANGE_FIELDS, values):
+            setattr(self, field, value)
+
+    def as_dict(self) -> Dict[str, Any]:
+        change = {field: getattr(self, field) for field in CHANGE_FIELDS}
+        if self.rollout is not None:
+            change["rollout"] = self.rollout._asdict()
+        return change
+
+
+class InMemoryFeatureFlagStore(FeatureFlagStore):
+    """Store that keeps every flag in dicts and sets; nothing touches disk.
+
+    Meant for embedded services and tests. Results match SQLiteFeatureFlagStore,
+    including the change log. Writes inside a transaction are journalled and
+    undone if it fails. Like SQLiteFeatureFlagStore, an instance belongs to
+    one thread.
+    """
+
+    def __init__(self):
+        self._customers: Set[int] = set()
+        self._sorted_customers: Optional[List[int]] = None
+        self._features: Dict[str, _Feature] = {}
+        # (feature_name, user_id) of the overrides naming each customer, and
+        # (feature_name, customer_id) of those naming each user
+        self._customer_overrides: Dict[int, Set[Tuple[str, Optional[int]]]] = {}
+        self._user_overrides: Dict[int, Set[Tuple[str, Optional[int]]]] = {}
+        self._changes: List[_Change] = []
+        self._change_sequence = 0
+        self._compacted_through = 0
+        self._transaction_depth = 0
+        self._undo: Optional[List[Tuple[Callable, tuple]]] = None
+
+    @property
+    def in_transaction(self) -> bool:
+        return self._transaction_depth > 0
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        if self._transaction_depth:
+            self._transaction_depth += 1
+            try:
+                yield
+            finally:
+                self._transaction_depth -= 1
+            return
+        self._transaction_depth = 1
+        self._undo = []
+        try:
+            yield
+        except BaseException:
+            undo, self._undo = self._undo, None
+            for function, args in reversed(undo):
+                function(*args)
+            raise
+        finally:
+            self._transaction_depth = 0
+            self._undo = None
+
+    # Every change to the state goes through one of the primitives below,
+    # which journal their own inverse while a transaction is open.
+
+    def _journal(self, function: Callable, *args):
+        if self._undo is not None:
+            self._undo.append((function, args))
+
+    def _feature(self, feature_name: str) -> _Feature:
+        feature = self._features.get(feature_name)
+        if feature is None:
+            feature = self._features[feature_name] = _Feature()
+        return feature
+
+    def _prune(self, feature_name: str):
+        if self._features[feature_name].is_empty():
+            del self._features[feature_name]
+
+    def _put_customer(self, customer_id: int, present: bool):
+        if (customer_id in self._customers) == present:
+            return
+        self._journal(self._put_customer, customer_id, not present)
+        self._sorted_customers = None
+        if present:
+            self._customers.add(customer_id)
+        else:
+            self._customers.discard(customer_id)
+
+    def _put_global(self, feature_name: str, is_enabled: Optional[bool]):
+        feature = self._feature(feature_name)
+        self._journal(self._put_global, feature_name, feature.global_enabled)
+        feature.global_enabled = is_enabled
+        self._prune(feature_name)
+
+    def _put_rollout(self, feature_name: str, rollout: Optional[Rollout]):
+        feature = self._feature(feature_name)
+        self._journal(self._put_rollout, feature_name, feature.rollout)
+        feature.rollout = rollout
+        self._prune(feature_name)
+
+    def _put_override(self, feature_name: str, customer_id: Optional[int], user_id: Optional[int],
+                      is_enabled: Optional[bool]):
+        feature = self._feature(feature_name)
+        key = (customer_id, user_id)
+        self._journal(self._put_override, feature_name, customer_id, user_id, feature.overrides.get(key))
+        if is_enabled is None:
+            feature.overrides.pop(key, None)
+            if customer_id is not None:
+                self._unindex(self._customer_overrides, customer_id, (feature_name, user_id))
+            if user_id is not None:
+                self._unindex(self._user_overrides, user_id, (feature_name, customer_id))
+            self._prune(feature_name)
+            return
+        feature.overrides[key] = is_enabled
+        if customer_id is not None:
+            self._customer_overrides.setdefault(customer_id, set()).add((feature_name, user_id))
+        if user_id is not None:
+            self._user_overrides.setdefault(user_id, set()).add((feature_name, customer_id))
+
+    @staticmethod
+    def _unindex(index: Dict[int, Set[Tuple[str, Optional[int]]]], key: int, entry: Tuple[str, Optional[int]]):
+        entries = index.get(key)
+        if entries is not None:
+            entries.discard(entry)
+            if not entries:
+                del index[key]
+
+    def _move_feature(self, old_name: str, new_name: str):
+        # Keeps the feature's position so list_all_features order is unchanged
+        self._journal(self._move_feature, new_name, old_name)
+        feature = self._features[old_name]
+        self._features = {new_name if name == old_name else name: record for name, record in self._features.items()}
+        for customer_id, user_id in feature.overrides:
+            if customer_id is not None:
+                entries = self._customer_overrides[customer_id]
+                entries.discard((old_name, user_id))
+                entries.add((new_name, user_id))
+            if user_id is not None:
+                entries = self._user_overrides[user_id]
+                entries.discard((old_name, customer_id))
+                entries.add((new_name, customer_id))
+
+    def _log_change(self, operation: str, feature_name: Optional[str] = None, customer_id: Optional[int] = None,
+                    user_id: Optional[int] = None, is_enabled: Optional[bool] = None, new_name: Optional[str] = None,
+                    rollout: Optional[Rollout] = None):
+        self._journal(self._drop_last_change, self._change_sequence)
+        self._change_sequence += 1
+        changed_at = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+        self._changes.append(_Change(
+            self._change_sequence, operation, feature_name, customer_id, user_id, is_enabled, new_name, rollout, changed_at))
+
+    def _drop_last_change(self, change_sequence: int):
+        self._changes.pop()
+        self._change_sequence = change_sequence
+
+    def _restore_changes(self, changes: List[_Change], compacted_through: int):
+        self._changes[:0] = changes
+        self._compacted_through = compacted_through
+
+    def add_customer(self, customer_id: int):
+        with self.transaction():
+            self._put_customer(customer_id, True)
+            self._log_change("add_customer", customer_id=customer_id)
+
+    def add_feature(self, feature_name: str, default_enabled: bool = True):
+        with self.transaction():
+            self._put_global(feature_name, bool(default_enabled))
+            self._log_change("add_feature", feature_name, is_enabled=default_enabled)
+
+    def set_global_flag(self, feature_name: str, is_enabled: bool):
+        with self.transaction():
+            self._put_global(feature_name, bool(is_enabled))
+            self._log_change("set_global_flag", feature_name, is_enabled=is_enabled)
+
+    def remove_feature(self, feature_name: str):
+        with self.transaction():
+            feature = self._features.get(feature_name)
+            if feature is not None:
+                for customer_id, user_id in list(feature.overrides):
+                    self._put_override(feature_name, customer_id, user_id, None)
+                if feature_name in self._features:
+                    self._put_global(feature_name, None)
+                if feature_name in self._features:
+                    self._put_rollout(feature_name, None)
+            self._log_change("remove_feature", feature_name)
+
+    def rename_feature(self, old_name: str, new_name: str):
+        if old_name != new_name and old_name in self._features and new_name in self._features:
+            raise ValueError(f"Feature {new_name!r} already exists.")
+        with self.transaction():
+            if old_name != new_name and old_name in self._features:
+                self._move_feature(old_name, new_name)
+            self._log_change("rename_feature", old_name, new_name=new_name)
+
+    def set_flag(self, feature_name: str, customer_id: Optional[int], user_id: Optional[int], is_enabled: bool):
+        if customer_id is None and user_id is None:
+            raise ValueError("Use add_feature() or set_global_flag() to set global feature flags.")
+        with self.transaction():
+            self._put_override(feature_name, customer_id, user_id, bool(is_enabled))
+            self._log_change("set_flag", feature_name, customer_id, user_id, is_enabled)
+
+    def set_flags_bulk(self, flags: Iterable[FlagRow], chunk_size: int = BULK_CHUNK_SIZE) -> int:
+        count = 0
+        with self.transaction():
+            for row in flags:
+                self.set_flag(*row)
+                count += 1
+        return count
+
+    def add_customers_bulk(self, customer_ids: Iterable[int], chunk_size: int = BULK_CHUNK_SIZE) -> int:
+        count = 0
+        with self.transaction():
+            for customer_id in customer_ids:
+                self.add_customer(customer_id)
+                count += 1
+        return count
+
+    def set_rollout(self, feature_name: str, percentage: float, salt: Optional[str] = None,
+                    min_customer_id: Optional[int] = None, max_customer_id: Optional[int] = None):
+        rollout = Rollout.for_feature(feature_name, percentage, salt, min_customer_id, max_customer_id)
+        with self.transaction():
+            self._put_rollout(feature_name, rollout)
+            self._log_change("set_rollout", feature_name, rollout=rollout)
+
+    def clear_rollout(self, feature_name: str):
+        with self.transaction():
+            if feature_name in self._features:
+                self._put_rollout(feature_name, None)
+            self._log_change("clear_rollout", feature_name)
+
+    def list_rollouts(self) -> Dict[str, Rollout]:
+        return {name: feature.rollout for name, feature in self._features.items() if feature.rollout is not None}
+
+    def remove_customer(self, customer_id: int):
+        with self.transaction():
+            for feature_name, user_id in list(self._customer_overrides.get(customer_id, ())):
+                self._put_override(feature_name, customer_id, user_id, None)
+            self._put_customer(customer_id, False)
+            self._log_change("remove_customer", customer_id=customer_id)
+
+    def remove_user(self, user_id: int):
+        with self.transaction():
+            for feature_name, customer_id in list(self._user_overrides.get(user_id, ())):
+                self._put_override(feature_name, customer_id, user_id, None)
+            self._log_change("remove_user", user_id=user_id)
+
+    def _customers_with_feature(self, feature_name: str) -> List[int]:
+        # Same rules as the SQLite store's customer queries
+        feature = self._features.get(feature_name)
+        if feature is None:
+            return []
+        if feature.global_enabled or feature.rollout is not None:
+            rollout = None if feature.global_enabled else feature.rollout
+            customers = {
+                customer_id for customer_id in self._customers
+                if feature.overrides.get((customer_id, None)) is not False
+                and (rollout is None or rollout.includes(customer_id))
+            }
+        else:
+            customers = set()
+        if not feature.global_enabled:
+            customers.update(customer_id for customer_id, is_enabled in feature.customer_states().items() if is_enabled)
+        return sorted(customers)
+
+    @staticmethod
+    def _page(customer_ids: List[int], after: Optional[int], limit: int) -> List[int]:
+        start = 0 if after is None else bisect_right(customer_ids, after)
+        return customer_ids[start:start + limit]
+
+    def list_customers_with_feature(self, feature_name: str) -> List[int]:
+        return self._customers_with_feature(feature_name)
+
+    def count_customers_with_feature(self, feature_name: str) -> int:
+        return len(self._customers_with_feature(feature_name))
+
+    def _customer_list(self) -> List[int]:
+        if self._sorted_customers is None:
+            self._sorted_customers = sorted(self._customers)
+        return self._sorted_customers
+
+    def page_all_customers(self, after: Optional[int] = None, limit: int = PAGE_SIZE) -> List[int]:
+        return self._page(self._customer_list(), after, limit)
+
+    def page_customers_with_feature(self, feature_name: str, after: Optional[int] = None,
+                                    limit: int = PAGE_SIZE) -> List[int]:
+        return self._page(self._customers_with_feature(feature_name), after, limit)
+
+    def page_customers_with_feature_explicitly_enabled(self, feature_name: str, after: Optional[int] = None,
+                                                       limit: int = PAGE_SIZE) -> List[int]:
+        return self._page(self.list_customers_with_feature_explicitly_enabled(feature_name), after, limit)
+
+    def page_customers_with_feature_explicitly_disabled(self, feature_name: str, after: Optional[int] = None,
+                                                        limit: int = PAGE_SIZE) -> List[int]:
+        return self._page(self.list_customers_with_feature_explicitly_disabled(feature_name), after, limit)
+
+    def list_customers_with_feature_explicitly_enabled(self, feature_name: str) -> List[int]:
+        feature = self._features.get(feature_name)
+        return [] if feature is None else feature.explicit_customers(True)
+
+    def list_customers_with_feature_explicitly_disabled(self, feature_name: str) -> List[int]:
+        feature = self._features.get(feature_name)
+        return [] if feature is None else feature.explicit_customers(False)
+
+    def list_features_for_customer(self, customer_id: int) -> List[str]:
+        enabled = {
+            name for name, feature in self._features.items()
+            if feature.global_enabled or (feature.rollout is not None and feature.rollout.includes(customer_id))
+        }
+        disabled = set()
+        for feature_name, user_id in self._customer_overrides.get(customer_id, ()):
+            if self._features[feature_name].overrides[(customer_id, user_id)]:
+                enabled.add(feature_name)
+            else:
+                disabled.add(feature_name)
+        return list(enabled - disabled)
+
+    def list_all_features(self) -> List[str]:
+        return [name for name, feature in self._features.items() if feature.global_enabled is not None]
+
+    def describe_all_features(self) -> List[Dict[str, Union[str, bool, List[int]]]]:
+        return [
+            {
+                "feature_name": name,
+                "global_enabled": feature.global_enabled,
+                "explicitly_enabled_customers": feature.explicit_customers(True),
+                "explicitly_disabled_customers": feature.explicit_customers(False),
+            }
+            for name, feature in self._features.items() if feature.global_enabled is not None
+        ]
+
+    def list_all_customers(self) -> List[int]:
+        return list(self._customer_list())
+
+    def _evaluator(self, feature_name: str) -> Callable[[int], bool]:
+        feature = self._features.get(feature_name)
+        if feature is None:
+            return lambda customer_id: False
+        states = feature.customer_states()
+        rollout = None if feature.global_enabled else feature.rollout
+        default = bool(feature.global_enabled)
+
+        def evaluate(customer_id: int) -> bool:
+            state = states.get(customer_id)
+            if state is None:
+                return default or (rollout is not None and rollout.includes(customer_id))
+            return state
+        return evaluate
+
+    def evaluate_many(self, feature_name: str, customer_ids: Iterable[int]) -> Dict[int, bool]:
+        evaluate = self._evaluator(feature_name)
+        return {customer_id: evaluate(customer_id) for customer_id in customer_ids}
+
+    def evaluate_matrix(self, customer_ids: Iterable[int], feature_names: Iterable[str]) -> Dict[int, Dict[str, bool]]:
+        evaluators = [(name, self._evaluator(name)) for name in dict.fromkeys(feature_names)]
+        return {
+            customer_id: {name: evaluate(customer_id) for name, evaluate in evaluators}
+            for customer_id in customer_ids
+        }
+
+    def export_flags(self) -> Tuple[Dict[str, bool], List[FlagRow]]:
+        global_flags = {name: feature.global_enabled for name, feature in self._features.items()
+                        if feature.global_enabled is not None}
+        overrides = [
+            (name, customer_id, user_id, is_enabled)
+            for name, feature in self._features.items()
+            for (customer_id, user_id), is_enabled in feature.overrides.items()
+        ]
+        return global_flags, overrides
+
+    def current_version(self) -> int:
+        return max(self._changes[-1].version if self._changes else 0, self._compacted_through)
+
+    def _change_index(self, version: int) -> int:
+        # Index of the first change newer than version. Versions in the log
+        # are consecutive: rollbacks rewind the sequence and compaction only
+        # drops a prefix.
+        if not self._changes:
+            return 0
+        return min(max(version - self._changes[0].version + 1, 0), len(self._changes))
+
+    def changes_since(self, version: int, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        if version < self._compacted_through:
+            raise ChangesCompactedError(
+                f"Changes up to version {self._compacted_through} have been compacted; reload from a full snapshot.")
+        start = self._change_index(version)
+        stop = None if limit is None else start + limit
+        return [change.as_dict() for change in islice(self._changes, start, stop)]
+
+    def compact_changes(self, through_version: int) -> int:
+        with self.transaction():
+            through_version = min(through_version, self.current_version())
+            stop = self._change_index(through_version)
+            removed = self._changes[:stop]
+            self._journal(self._restore_changes, removed, self._compacted_through)
+            del self._changes[:stop]
+            self._compacted_through = max(self._compacted_through, through_version)
+        return len(removed)
+
+    def close(self):
+        pass
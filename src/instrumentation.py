@@ -0,0 +1,190 @@
+from bisect import bisect_left
+import logging
+import threading
+import time
+from types import GeneratorType
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency buckets, in seconds; the last bucket is open
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+# exporter(method, seconds, rows, statements, error)
+Exporter = Callable[[str, float, int, int, Optional[BaseException]], None]
+
+
+class LatencyHistogram:
+    __slots__ = ("counts", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction: float) -> float:
+        # Upper bound of the bucket holding the percentile, capped at the max seen
+        target = fraction * sum(self.counts)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return min(LATENCY_BUCKETS[index], self.max) if index < len(LATENCY_BUCKETS) else self.max
+        return 0.0
+
+
+class MethodStats:
+    __slots__ = ("calls", "errors", "rows", "statements", "latency")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.statements = 0
+        self.latency = LatencyHistogram()
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "rows": self.rows,
+            "statements": self.statements,
+            "mean_ms": self.latency.total / self.calls * 1000 if self.calls else 0.0,
+            "p50_ms": self.latency.percentile(0.50) * 1000,
+            "p99_ms": self.latency.percentile(0.99) * 1000,
+            "max_ms": self.latency.max * 1000,
+            "histogram": dict(zip([f"le_{bound}" for bound in LATENCY_BUCKETS] + ["le_inf"], self.latency.counts)),
+        }
+
+
+def count_rows(result: Any) -> int:
+    if isinstance(result, (list, dict, set, frozenset)):
+        return len(result)
+    if isinstance(result, tuple):
+        return sum(len(part) for part in result if isinstance(part, (list, dict, set, frozenset)))
+    return 0
+
+
+class Instrumentation:
+    """Per-method call counts, latency histograms, rows returned and SQL statements.
+
+    Attach it with ``FeatureFlagService(store, instrumentation=Instrumentation())``.
+    Statements are counted through SQLite's trace callback on the calling
+    thread, so they are attributed to the service call that issued them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats: Dict[str, MethodStats] = {}
+        self._exporters: List[Exporter] = []
+
+    def add_exporter(self, exporter: Exporter):
+        self._exporters.append(exporter)
+
+    def remove_exporter(self, exporter: Exporter):
+        self._exporters.remove(exporter)
+
+    def trace_statement(self, statement: str):
+        # SQLite trace callback
+        self._local.statements = getattr(self._local, "statements", 0) + 1
+
+    def wrap(self, method: str, function: Callable) -> Callable:
+        def instrumented(*args, **kwargs):
+            local = self._local
+            outer_statements = getattr(local, "statements", 0)
+            local.statements = 0
+            error = None
+            result = None
+            started = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            except BaseException as exc:
+                error = exc
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                statements = local.statements
+                local.statements = outer_statements + statements
+                if not isinstance(result, GeneratorType):
+                    self.record(method, elapsed, count_rows(result), statements, error)
+            if isinstance(result, GeneratorType):
+                # Recorded once iteration ends, with the time spent producing items
+                return self._iterate(method, result, elapsed, statements)
+            return result
+        return instrumented
+
+    def _iterate(self, method: str, generator: GeneratorType, seconds: float, statements: int):
+        local = self._local
+        rows = 0
+        error = None
+        try:
+            while True:
+                outer_statements = getattr(local, "statements", 0)
+                local.statements = 0
+                started = time.perf_counter()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                except BaseException as exc:
+                    error = exc
+                    raise
+                finally:
+                    seconds += time.perf_counter() - started
+                    statements += local.statements
+                    local.statements = outer_statements + local.statements
+                rows += 1
+                yield item
+        finally:
+            generator.close()
+            self.record(method, seconds, rows, statements, error)
+
+    def record(self, method: str, seconds: float, rows: int = 0, statements: int = 0, error: Optional[BaseException] = None):
+        with self._lock:
+            stats = self._stats.get(method)
+            if stats is None:
+                stats = self._stats[method] = MethodStats()
+            stats.calls += 1
+            stats.rows += rows
+            stats.statements += statements
+            if error is not None:
+                stats.errors += 1
+            stats.latency.record(seconds)
+        for exporter in self._exporters:
+            try:
+                exporter(method, seconds, rows, statements, error)
+            except Exception:
+                logger.exception("Instrumentation exporter %r failed", exporter)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {method: stats.as_dict() for method, stats in sorted(self._stats.items())}
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def format_table(self) -> str:
+        return format_table(self.snapshot())
+
+
+def format_table(snapshot: Dict[str, Dict[str, Any]]) -> str:
+    # snapshot as returned by Instrumentation.snapshot() or served on /stats
+    lines = [f"{'method':48s} {'calls':>8s} {'errors':>6s} {'p50_ms':>9s} {'p99_ms':>9s} {'max_ms':>9s} {'rows':>10s} {'sql':>8s}"]
+    for method, stats in snapshot.items():
+        lines.append(
+            f"{method:48s} {stats['calls']:8d} {stats['errors']:6d} {stats['p50_ms']:9.3f} {stats['p99_ms']:9.3f} "
+            f"{stats['max_ms']:9.3f} {stats['rows']:10d} {stats['statements']:8d}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,568 @@
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import ExitStack, closing, contextmanager
+import functools
+import hashlib
+import heapq
+import json
+from itertools import islice
+import os
+import sqlite3
+import threading
+from urllib.parse import quote
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from feature_flag_service import (
+    BULK_CHUNK_SIZE, CHANGE_FIELDS, PAGE_SIZE, FeatureFlagStore, FlagRow, Rollout, SQLiteFeatureFlagStore, chunked,
+)
+
+DEFAULT_SHARD_COUNT = 4
+META_FILE = "meta.db"
+
+
+def shard_for_customer(customer_id: int, shard_count: int) -> int:
+    # Stable across processes, like rollout_bucket, so every opener and the
+    # resharding tool agree on where a customer lives
+    digest = hashlib.blake2b(str(customer_id).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shard_count
+
+
+def shard_path(directory: str, index: int) -> str:
+    return os.path.join(directory, f"shard-{index:04d}.db")
+
+
+def _group_by_shard(items: Iterable, customer_id: Callable[[Any], int], shard_count: int) -> Dict[int, list]:
+    groups: Dict[int, list] = {}
+    for item in items:
+        groups.setdefault(shard_for_customer(customer_id(item), shard_count), []).append(item)
+    return groups
+
+
+# Tables of meta.db that only a sharded store uses. shard_log_positions holds,
+# per shard, the last version of the shard's own change log that has been
+# collected into the metadata log.
+META_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS shard_layout (shard_count INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS shard_log_positions (shard INTEGER PRIMARY KEY, version INTEGER NOT NULL)",
+)
+
+
+def _has_table(conn: sqlite3.Connection, name: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+
+def _read_shard_count(conn: sqlite3.Connection) -> Optional[int]:
+    if not _has_table(conn, "shard_layout"):
+        return None
+    row = conn.execute("SELECT shard_count FROM shard_layout").fetchone()
+    return None if row is None else row[0]
+
+
+def _read_log_positions(conn: sqlite3.Connection) -> Dict[int, int]:
+    if not _has_table(conn, "shard_log_positions"):
+        return {}
+    return dict(conn.execute("SELECT shard, version FROM shard_log_positions").fetchall())
+
+
+def _create_meta_tables(meta: SQLiteFeatureFlagStore):
+    with meta.transaction():
+        for statement in META_SCHEMA:
+            meta.conn.execute(statement)
+
+
+def _write_shard_count(meta: SQLiteFeatureFlagStore, shard_count: int):
+    with meta.transaction():
+        _create_meta_tables(meta)
+        meta.conn.execute("DELETE FROM shard_layout")
+        meta.conn.execute("INSERT INTO shard_layout (shard_count) VALUES (?)", (shard_count,))
+        meta.conn.execute("DELETE FROM shard_log_positions")
+
+
+def _append_shard_changes(meta: SQLiteFeatureFlagStore, changes_by_shard: Dict[int, List[Dict[str, Any]]]):
+    # Appends the shards' changes to the metadata log, interleaved by time,
+    # and moves each shard's position past the ones appended
+    with meta.transaction():
+        meta.record_changes(heapq.merge(*changes_by_shard.values(), key=lambda change: change["changed_at"]))
+        meta.conn.executemany(
+            "INSERT OR REPLACE INTO shard_log_positions (shard, version) VALUES (?, ?)",
+            [(index, changes[-1]["version"]) for index, changes in changes_by_shard.items() if changes])
+
+
+def _connect_read_only(path: str) -> sqlite3.Connection:
+    return sqlite3.connect(f"file:{quote(os.path.abspath(path))}?mode=ro", uri=True)
+
+
+def _read_changes(conn: sqlite3.Connection, after: int) -> List[Dict[str, Any]]:
+    # changes_since() for a connection that has no store around it
+    cursor = conn.execute(f"SELECT {', '.join(CHANGE_FIELDS)} FROM flag_changes WHERE version > ? ORDER BY version", (after,))
+    changes = [dict(zip(CHANGE_FIELDS, row)) for row in cursor]
+    for change in changes:
+        if change["rollout"] is not None:
+            change["rollout"] = json.loads(change["rollout"])
+    return changes
+
+
+def _unlogged(store: SQLiteFeatureFlagStore, method: str, *args) -> Any:
+    # Applies a write that the metadata store logs for every file
+    store.change_log = False
+    try:
+        return getattr(store, method)(*args)
+    finally:
+        store.change_log = True
+
+
+def _live_features(store: SQLiteFeatureFlagStore, names: Sequence[str]) -> List[str]:
+    # The names that still have a global flag, override or rollout
+    placeholders = ", ".join("?" * len(names))
+    cursor = store.conn.execute(f"""
+        SELECT name FROM features f WHERE name IN ({placeholders}) AND (
+            EXISTS (SELECT 1 FROM global_feature_flags g WHERE g.feature_id = f.feature_id)
+            OR EXISTS (SELECT 1 FROM feature_flags o WHERE o.feature_id = f.feature_id)
+            OR EXISTS (SELECT 1 FROM rollouts r WHERE r.feature_id = f.feature_id)
+        )
+    """, list(names))
+    return [row[0] for row in cursor]
+
+
+class _Worker:
+    # A SQLite store confined to a thread of its own; its connection may only
+    # be used there, so every call on the store is submitted to that thread.
+
+    def __init__(self, open_store: Callable[[], SQLiteFeatureFlagStore], name: str):
+        # Held by the calling thread for a whole call or transaction, so no
+        # other thread's statements run on the connection meanwhile
+        self.lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        try:
+            self.store = self._executor.submit(open_store).result()
+        except BaseException:
+            self._executor.shutdown()
+            raise
+
+    def submit(self, function: Callable, *args) -> Future:
+        return self._executor.submit(function, *args)
+
+    def call(self, function: Callable, *args) -> Any:
+        return self.submit(function, *args).result()
+
+    def close(self):
+        if self.store is None:
+            return
+        try:
+            self.call(self.store.close)
+        finally:
+            self.store = None
+            self._executor.shutdown()
+
+
+class ShardedFeatureFlagStore(FeatureFlagStore):
+    """Spreads customers over several SQLite files in one directory.
+
+    Each customer, with its customer-scoped overrides, lives in the shard
+    file picked by hashing its id. ``meta.db`` holds global flags, rollouts,
+    user-only overrides and the change log; global flags and rollouts are
+    also copied to every shard so that each can answer customer queries on
+    its own. A customer write only touches its shard, which logs it in a
+    change log of its own; the change log methods first collect those
+    entries into the metadata log, which numbers all changes in one
+    sequence. Global writes collect them too, before they are logged.
+
+    Every file has a thread of its own and a lock, taken in a fixed order
+    for the files a call touches, so the store can be shared between
+    threads and writes to different shards run in parallel. Writes touching
+    several files and cross-shard reads run on all of them at once, and
+    reads merge the results. A transaction spans every file, but the files
+    commit one by one, so a crash during commit can leave only some of them
+    updated. Change the shard count offline with reshard().
+    """
+
+    def __init__(self, directory: str, shard_count: Optional[int] = None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._local = threading.local()
+        self._shards: List[_Worker] = []
+        self._meta = _Worker(lambda: SQLiteFeatureFlagStore(os.path.join(directory, META_FILE)), "feature-flags-meta")
+        try:
+            self._meta.call(_create_meta_tables, self._meta.store)
+            existing = self._meta.call(lambda: _read_shard_count(self._meta.store.conn))
+            if existing is None:
+                self.shard_count = DEFAULT_SHARD_COUNT if shard_count is None else shard_count
+                if self.shard_count < 1:
+                    raise ValueError("shard_count must be at least 1.")
+                self._meta.call(_write_shard_count, self._meta.store, self.shard_count)
+            elif shard_count is not None and shard_count != existing:
+                raise ValueError(f"{directory} holds {existing} shards, not {shard_count}; use reshard() to change it.")
+            else:
+                self.shard_count = existing
+            for index in range(self.shard_count):
+                path = shard_path(directory, index)
+                self._shards.append(_Worker(lambda path=path: SQLiteFeatureFlagStore(path), f"feature-flags-shard-{index}"))
+        except BaseException:
+            self.close()
+            raise
+        self._workers = [self._meta] + self._shards
+
+    def _shard(self, customer_id: int) -> _Worker:
+        return self._shards[shard_for_customer(customer_id, self.shard_count)]
+
+    @contextmanager
+    def _locked(self, workers: Iterable[_Worker]) -> Iterator[None]:
+        # Always in the order of self._workers, so threads cannot deadlock
+        with ExitStack() as stack:
+            for worker in sorted(set(workers), key=self._workers.index):
+                stack.enter_context(worker.lock)
+            yield
+
+    def _gather(self, calls: Iterable[Tuple[_Worker, Union[str, Callable], tuple]]) -> List[Any]:
+        # Runs store methods, or functions taking the store, on their workers
+        # at once; waits for all of them before raising the first error, so
+        # none is still running after.
+        calls = list(calls)
+        with self._locked(worker for worker, _, _ in calls):
+            futures = [
+                worker.submit(getattr(worker.store, method) if isinstance(method, str)
+                              else functools.partial(method, worker.store), *args)
+                for worker, method, args in calls
+            ]
+            wait(futures)
+        return [future.result() for future in futures]
+
+    def _call(self, worker: _Worker, method: Union[str, Callable], *args) -> Any:
+        return self._gather([(worker, method, args)])[0]
+
+    def _fan_out(self, method: str, *args) -> List[Any]:
+        return self._gather((shard, method, args) for shard in self._shards)
+
+    def _merge(self, method: str, *args) -> List[int]:
+        return list(heapq.merge(*(sorted(customers) for customers in self._fan_out(method, *args))))
+
+    def _merge_pages(self, method: str, *args, after: Optional[int], limit: int) -> List[int]:
+        # Each shard's page holds the first ids after the key in that shard,
+        # so the first ``limit`` of their merge is the page across shards
+        return list(islice(heapq.merge(*self._fan_out(method, *args, after, limit)), limit))
+
+    @property
+    def in_transaction(self) -> bool:
+        return getattr(self._local, "transaction_depth", 0) > 0
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        with self._transaction(self._workers):
+            yield
+
+    @contextmanager
+    def _transaction(self, workers: Sequence[_Worker]) -> Iterator[None]:
+        # Locks the workers and opens a transaction on each of their stores.
+        # Writes only nest inside transaction(), which spans every worker, so
+        # they just join it.
+        local = self._local
+        if getattr(local, "transaction_depth", 0):
+            local.transaction_depth += 1
+            try:
+                yield
+            finally:
+                local.transaction_depth -= 1
+            return
+        with self._locked(workers):
+            local.transaction_depth = 1
+            contexts = []
+            try:
+                for worker in workers:
+                    context = worker.store.transaction()
+                    worker.call(context.__enter__)
+                    contexts.append((worker, context))
+                yield
+            except BaseException as exc:
+                for worker, context in contexts:
+                    worker.call(context.__exit__, type(exc), exc, exc.__traceback__)
+                raise
+            else:
+                futures = [worker.submit(context.__exit__, None, None, None) for worker, context in contexts]
+                wait(futures)
+                for future in futures:
+                    future.result()
+            finally:
+                local.transaction_depth = 0
+
+    def _collect_changes(self):
+        # Moves the changes the shards logged since the last collection into
+        # the metadata log. Runs with every file locked, so the log keeps
+        # global writes in order with the customer writes around them.
+        with self._transaction(self._workers):
+            positions = self._call(self._meta, lambda store: _read_log_positions(store.conn))
+            changes = self._gather((shard, "changes_since", (positions.get(index, 0),))
+                                   for index, shard in enumerate(self._shards))
+            if any(changes):
+                self._call(self._meta, _append_shard_changes, dict(enumerate(changes)))
+
+    def _replicate(self, method: str, *args):
+        # The metadata store applies and logs the write, the shards copy it
+        with self._transaction(self._workers):
+            self._collect_changes()
+            self._gather([(self._meta, method, args)] + [(shard, _unlogged, (method,) + args) for shard in self._shards])
+
+    def _write_customer(self, customer_id: int, method: str, *args):
+        shard = self._shard(customer_id)
+        with self._transaction((shard,)):
+            self._call(shard, method, *args)
+
+    def add_customer(self, customer_id: int):
+        self._write_customer(customer_id, "add_customer", customer_id)
+
+    def add_customers_bulk(self, customer_ids: Iterable[int], chunk_size: int = BULK_CHUNK_SIZE) -> int:
+        count = 0
+        with self.transaction():
+            for chunk in chunked(customer_ids, chunk_size):
+                self._gather((self._shards[index], "add_customers_bulk", (customers, chunk_size))
+                             for index, customers in _group_by_shard(chunk, int, self.shard_count).items())
+                count += len(chunk)
+        return count
+
+    def add_feature(self, feature_name: str, default_enabled: bool = True):
+        self._replicate("add_feature", feature_name, default_enabled)
+
+    def set_global_flag(self, feature_name: str, is_enabled: bool):
+        self._replicate("set_global_flag", feature_name, is_enabled)
+
+    def remove_feature(self, feature_name: str):
+        self._replicate("remove_feature", feature_name)
+
+    def rename_feature(self, old_name: str, new_name: str):
+        # Each file only sees its own customers' overrides, so check every file
+        # for the two names being in use before any of them renames
+        with self._transaction(self._workers):
+            if old_name != new_name:
+                live = self._gather((worker, _live_features, ((old_name, new_name),)) for worker in self._workers)
+                if len({name for names in live for name in names}) == 2:
+                    raise ValueError(f"Feature {new_name!r} already exists.")
+            self._replicate("rename_feature", old_name, new_name)
+
+    def set_flag(self, feature_name: str, customer_id: Optional[int], user_id: Optional[int], is_enabled: bool):
+        if customer_id is None and user_id is None:
+            raise ValueError("Use add_feature() or set_global_flag() to set global feature flags.")
+        if customer_id is None:
+            # User-only overrides apply across customers and live with the metadata
+            self._call(self._meta, "set_flag", feature_name, None, user_id, is_enabled)
+            return
+        self._write_customer(customer_id, "set_flag", feature_name, customer_id, user_id, is_enabled)
+
+    def set_flags_bulk(self, flags: Iterable[FlagRow], chunk_size: int = BULK_CHUNK_SIZE) -> int:
+        count = 0
+        with self.transaction():
+            for chunk in chunked(flags, chunk_size):
+                rows_by_worker: Dict[_Worker, List[FlagRow]] = {}
+                for row in chunk:
+                    _, customer_id, user_id, _ = row
+                    if customer_id is None and user_id is None:
+                        raise ValueError("Use add_feature() or set_global_flag() to set global feature flags.")
+                    worker = self._meta if customer_id is None else self._shard(customer_id)
+                    rows_by_worker.setdefault(worker, []).append(row)
+                self._gather((worker, "set_flags_bulk", (rows, chunk_size)) for worker, rows in rows_by_worker.items())
+                count += len(chunk)
+        return count
+
+    def set_rollout(self, feature_name: str, percentage: float, salt: Optional[str] = None,
+                    min_customer_id: Optional[int] = None, max_customer_id: Optional[int] = None):
+        self._replicate("set_rollout", feature_name, percentage, salt, min_customer_id, max_customer_id)
+
+    def clear_rollout(self, feature_name: str):
+        self._replicate("clear_rollout", feature_name)
+
+    def list_rollouts(self) -> Dict[str, Rollout]:
+        return self._call(self._meta, "list_rollouts")
+
+    def remove_customer(self, customer_id: int):
+        self._write_customer(customer_id, "remove_customer", customer_id)
+
+    def remove_user(self, user_id: int):
+        self._replicate("remove_user", user_id)
+
+    def list_customers_with_feature(self, feature_name: str) -> List[int]:
+        return self._merge("list_customers_with_feature", feature_name)
+
+    def count_customers_with_feature(self, feature_name: str) -> int:
+        return sum(self._fan_out("count_customers_with_feature", feature_name))
+
+    def list_customers_with_feature_explicitly_enabled(self, feature_name: str) -> List[int]:
+        return self._merge("list_customers_with_feature_explicitly_enabled", feature_name)
+
+    def list_customers_with_feature_explicitly_disabled(self, feature_name: str) -> List[int]:
+        return self._merge("list_customers_with_feature_explicitly_disabled", feature_name)
+
+    def page_all_customers(self, after: Optional[int] = None, limit: int = PAGE_SIZE) -> List[int]:
+        return self._merge_pages("page_all_customers", after=after, limit=limit)
+
+    def page_customers_with_feature(self, feature_name: str, after: Optional[int] = None,
+                                    limit: int = PAGE_SIZE) -> List[int]:
+        return self._merge_pages("page_customers_with_feature", feature_name, after=after, limit=limit)
+
+    def page_customers_with_feature_explicitly_enabled(self, feature_name: str, after: Optional[int] = None,
+                                                       limit: int = PAGE_SIZE) -> List[int]:
+        return self._merge_pages("page_customers_with_feature_explicitly_enabled", feature_name, after=after, limit=limit)
+
+    def page_customers_with_feature_explicitly_disabled(self, feature_name: str, after: Optional[int] = None,
+                                                        limit: int = PAGE_SIZE) -> List[int]:
+        return self._merge_pages("page_customers_with_feature_explicitly_disabled", feature_name, after=after, limit=limit)
+
+    def list_features_for_customer(self, customer_id: int) -> List[str]:
+        return self._call(self._shard(customer_id), "list_features_for_customer", customer_id)
+
+    def list_all_features(self) -> List[str]:
+        return self._call(self._meta, "list_all_features")
+
+    def describe_all_features(self) -> List[Dict[str, Union[str, bool, List[int]]]]:
+        # Features and their order come from the metadata store, the
+        # explicit customers from the shards
+        features, *shard_features = self._gather((worker, "describe_all_features", ()) for worker in self._workers)
+        by_name = {feature["feature_name"]: feature for feature in features}
+        for described in shard_features:
+            for shard_feature in described:
+                feature = by_name.get(shard_feature["feature_name"])
+                if feature is None:
+                    continue
+                for key in ("explicitly_enabled_customers", "explicitly_disabled_customers"):
+                    feature[key].extend(shard_feature[key])
+        for feature in features:
+            feature["explicitly_enabled_customers"].sort()
+            feature["explicitly_disabled_customers"].sort()
+        return features
+
+    def list_all_customers(self) -> List[int]:
+        return self._merge("list_all_customers")
+
+    def evaluate_many(self, feature_name: str, customer_ids: Iterable[int]) -> Dict[int, bool]:
+        customer_ids = list(customer_ids)
+        groups = _group_by_shard(dict.fromkeys(customer_ids), int, self.shard_count)
+        results: Dict[int, bool] = {}
+        for result in self._gather((self._shards[index], "evaluate_many", (feature_name, customers))
+                                   for index, customers in groups.items()):
+            results.update(result)
+        return {customer_id: results[customer_id] for customer_id in customer_ids}
+
+    def evaluate_matrix(self, customer_ids: Iterable[int], feature_names: Iterable[str]) -> Dict[int, Dict[str, bool]]:
+        customer_ids = list(customer_ids)
+        feature_names = list(dict.fromkeys(feature_names))
+        groups = _group_by_shard(dict.fromkeys(customer_ids), int, self.shard_count)
+        rows: Dict[int, Dict[str, bool]] = {}
+        for result in self._gather((self._shards[index], "evaluate_matrix", (customers, feature_names))
+                                   for index, customers in groups.items()):
+            rows.update(result)
+        return {customer_id: dict(rows[customer_id]) for customer_id in customer_ids}
+
+    def export_flags(self) -> Tuple[Dict[str, bool], List[FlagRow]]:
+        (global_flags, overrides), *shard_exports = self._gather((worker, "export_flags", ()) for worker in self._workers)
+        for _, shard_overrides in shard_exports:
+            overrides.extend(shard_overrides)
+        return global_flags, overrides
+
+    def current_version(self) -> int:
+        with self._transaction(self._workers):
+            self._collect_changes()
+            return self._call(self._meta, "current_version")
+
+    def changes_since(self, version: int, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        with self._transaction(self._workers):
+            self._collect_changes()
+            return self._call(self._meta, "changes_since", version, limit)
+
+    def compact_changes(self, through_version: int) -> int:
+        with self._transaction(self._workers):
+            self._collect_changes()
+            # The shards' own logs are only needed up to what was collected
+            positions = self._call(self._meta, lambda store: _read_log_positions(store.conn))
+            self._gather((shard, "compact_changes", (positions.get(index, 0),))
+                         for index, shard in enumerate(self._shards))
+            return self._call(self._meta, "compact_changes", through_version)
+
+    def storage_stats(self) -> Dict[str, int]:
+        # Feature tables are counted once, from the metadata store
+        self._collect_changes()
+        stats, *shard_stats = self._gather((worker, "storage_stats", ()) for worker in self._workers)
+        stats["shard_count"] = self.shard_count
+        for key in ("customers_rows", "feature_flags_rows", "size_bytes"):
+            stats[key] += sum(shard[key] for shard in shard_stats)
+        return stats
+
+    def close(self):
+        for worker in [self._meta] + self._shards:
+            worker.close()
+        self._shards = []
+
+
+def reshard(source: str, target: str, shard_count: int, chunk_size: int = BULK_CHUNK_SIZE) -> Tuple[int, int]:
+    """Copies a sharded directory, or a single SQLite database, into ``shard_count`` shards in ``target``.
+
+    Run it offline: nothing may write to ``source`` meanwhile. ``source`` is
+    only opened for reading. The change log moves over whole, so versions carry on
+    from where they were and snapshots stay valid. Returns the number of
+    customers and customer-scoped overrides copied.
+    """
+    if shard_count < 1:
+        raise ValueError("shard_count must be at least 1.")
+    if not os.path.exists(source):
+        raise ValueError(f"{source} does not exist.")
+    source_meta = os.path.join(source, META_FILE) if os.path.isdir(source) else source
+    if not os.path.exists(source_meta):
+        raise ValueError(f"{source} does not hold a sharded store.")
+    meta_path = os.path.join(target, META_FILE)
+    if os.path.exists(meta_path):
+        raise ValueError(f"{target} already holds a sharded store.")
+    os.makedirs(target, exist_ok=True)
+    with closing(_connect_read_only(source_meta)) as source_conn, closing(sqlite3.connect(meta_path)) as target_conn:
+        source_conn.backup(target_conn)
+
+    with ExitStack() as stack:
+        # Opening the copy migrates it if the source is older
+        meta = stack.enter_context(closing(SQLiteFeatureFlagStore(meta_path)))
+        if os.path.isdir(source):
+            sources = [
+                stack.enter_context(closing(_connect_read_only(shard_path(source, index))))
+                for index in range(_read_shard_count(meta.conn) or 0)
+            ]
+            # Changes the source shards logged but never had collected
+            positions = _read_log_positions(meta.conn)
+            _append_shard_changes(meta, {index: _read_changes(conn, positions.get(index, 0))
+                                         for index, conn in enumerate(sources)})
+        else:
+            # The migrated copy, which still holds the customers at this point
+            sources = [meta.conn]
+        shards = [
+            stack.enter_context(closing(SQLiteFeatureFlagStore(shard_path(target, index), change_log=False)))
+            for index in range(shard_count)
+        ]
+        global_flags, _ = meta.export_flags()
+        rollouts = meta.list_rollouts()
+
+        customer_count = flag_count = 0
+        with ExitStack() as transactions:
+            for shard in shards:
+                transactions.enter_context(shard.transaction())
+                for feature_name, is_enabled in global_flags.items():
+                    shard.set_global_flag(feature_name, is_enabled)
+                for feature_name, rollout in rollouts.items():
+                    shard.set_rollout(feature_name, *rollout)
+            for conn in sources:
+                customer_ids = (row[0] for row in conn.execute("SELECT customer_id FROM customers ORDER BY customer_id"))
+                for chunk in chunked(customer_ids, chunk_size):
+                    for index, customers in _group_by_shard(chunk, int, shard_count).items():
+                        shards[index].add_customers_bulk(customers, chunk_size)
+                    customer_count += len(chunk)
+                cursor = conn.execute("""
+                    SELECT f.name, o.customer_id, o.user_id, o.is_enabled FROM feature_flags o JOIN features f USING (feature_id)
+                    WHERE o.customer_id IS NOT NULL
+                    ORDER BY o.rowid
+                """)
+                rows = ((name, customer_id, user_id, bool(is_enabled)) for name, customer_id, user_id, is_enabled in cursor)
+                for chunk in chunked(rows, chunk_size):
+                    for index, flags in _group_by_shard(chunk, lambda row: row[1], shard_count).items():
+                        shards[index].set_flags_bulk(flags, chunk_size)
+                    flag_count += len(chunk)
+
+        # The metadata keeps everything but customers and their overrides
+        if meta.has_effective_flags:
+            meta.disable_effective_flags()
+        with meta.transaction():
+            meta.conn.execute("DELETE FROM feature_flags WHERE customer_id IS NOT NULL")
+            meta.conn.execute("DELETE FROM customers")
+        _write_shard_count(meta, shard_count)
+        meta.conn.execute("VACUUM")
+    return customer_count, flag_count
@@ -0,0 +1,109 @@
+import sys
+sys.path.append("src")
+from async_feature_flag_service import AsyncFeatureFlagService, ExecutorFeatureFlagStore
+from feature_flag_service import PooledSQLiteFeatureFlagStore
+import asyncio
+import os
+import threading
+import time
+import unittest
+
+
+class CountingStore(PooledSQLiteFeatureFlagStore):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = 0
+        self.threads = set()
+
+    def list_features_for_customer(self, customer_id):
+        self.calls += 1
+        self.threads.add(threading.get_ident())
+        time.sleep(0.05)
+        return super().list_features_for_customer(customer_id)
+
+
+class TestAsyncFeatureFlagService(unittest.TestCase):
+
+    DB_PATH = "test_async_feature_flags.db"
+
+    def setUp(self):
+        self._remove_db()
+
+    def tearDown(self):
+        self._remove_db()
+
+    def _remove_db(self):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.DB_PATH + suffix):
+                os.remove(self.DB_PATH + suffix)
+
+    def run_async(self, make_coroutine):
+        async def runner():
+            self.store = CountingStore(self.DB_PATH)
+            self.service = AsyncFeatureFlagService(ExecutorFeatureFlagStore(self.store, max_workers=2))
+            try:
+                await make_coroutine()
+            finally:
+                await self.service.close()
+        asyncio.run(runner())
+
+    def test_round_trip(self):
+        async def scenario():
+            await self.service.add_customer(1)
+            await self.service.add_feature("dashboard", default_enabled=False)
+            await self.service.set_flag("dashboard", 1, None, True)
+            self.assertEqual(await self.service.list_customers_with_feature("dashboard"), [1])
+            self.assertEqual(await self.service.count_customers_with_feature("dashboard"), 1)
+            self.assertEqual(await self.service.evaluate_many("dashboard", [1, 2]), {1: True, 2: False})
+            self.assertTrue(await self.service.is_enabled("dashboard", 1))
+            await self.service.set_flag("dashboard", 1, None, False)
+            self.assertFalse(await self.service.is_enabled("dashboard", 1))
+            self.assertEqual(await self.service.add_customers_bulk(range(2, 5)), 3)
+            self.assertEqual(sorted(await self.service.list_all_customers()), [1, 2, 3, 4])
+            self.assertEqual(await self.service.page_all_customers(after=1, limit=2), [2, 3])
+            self.assertEqual([c async for c in self.service.iter_all_customers(page_size=2)], [1, 2, 3, 4])
+        self.run_async(scenario)
+
+    def test_identical_reads_are_coalesced(self):
+        async def scenario():
+            await self.service.add_feature("inbox")
+            results = await asyncio.gather(*(self.service.list_features_for_customer(7) for _ in range(20)))
+            self.assertEqual(self.store.calls, 1)
+            self.assertTrue(all(result == ["inbox"] for result in results))
+            self.assertNotIn(threading.get_ident(), self.store.threads)
+
+            await asyncio.gather(self.service.list_features_for_customer(7), self.service.list_features_for_customer(8))
+            self.assertEqual(self.store.calls, 3)
+        self.run_async(scenario)
+
+    def test_reads_after_a_write_are_not_coalesced_with_earlier_reads(self):
+        async def scenario():
+            await self.service.add_feature("inbox", default_enabled=False)
+            before = asyncio.ensure_future(self.service.list_features_for_customer(7))
+            await asyncio.sleep(0)
+            await self.service.set_flag("inbox", 7, None, True)
+            self.assertEqual(await self.service.list_features_for_customer(7), ["inbox"])
+            await before
+            self.assertEqual(self.store.calls, 2)
+        self.run_async(scenario)
+
+    def test_loop_stays_responsive(self):
+        async def scenario():
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0.005)
+
+            task = asyncio.ensure_future(ticker())
+            await self.service.list_features_for_customer(1)
+            task.cancel()
+            self.assertGreater(ticks, 3)
+        self.run_async(scenario)
+
+
+if __name__ == '__main__':
+    unittest.main()
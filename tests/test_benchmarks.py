@@ -0,0 +1,18 @@
+import sys
+sys.path.append("benchmarks")
+import run_benchmarks
+
+
+def test_benchmark_smoke(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_benchmarks, "DATA_DIR", str(tmp_path))
+    params = {"customers": 50, "features": 3, "customer_override_density": 0.2, "user_override_density": 0.1, "seed": 1}
+    report = run_benchmarks.run_benchmarks(params, iterations=2, time_budget=1.0)
+    assert set(report["results"]) == {name for name, _ in run_benchmarks.build_cases(50, 3)}
+    for result in report["results"].values():
+        assert result["iterations"] == 2
+        assert result["p50_ms"] <= result["p99_ms"]
+    assert report["meta"]["params"] == params
+
+    baseline = {"results": {name: dict(result, p50_ms=result["p50_ms"] / 100) for name, result in report["results"].items()}}
+    assert run_benchmarks.compare(report, baseline, threshold=0.5)
+    assert not run_benchmarks.compare(report, report, threshold=0.5)
@@ -0,0 +1,77 @@
+import sys
+sys.path.append("src")
+from binary_snapshot import BinarySnapshot, write_binary_snapshot
+from feature_flag_service import FeatureFlagService, SQLiteFeatureFlagStore
+import itertools
+import os
+import random
+import tempfile
+import unittest
+
+
+class TestBinarySnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.snapshot_path = os.path.join(self.tmpdir.name, "flags.snap")
+        self.service = FeatureFlagService(SQLiteFeatureFlagStore(os.path.join(self.tmpdir.name, "flags.db")))
+
+    def tearDown(self):
+        self.service.close()
+        self.tmpdir.cleanup()
+
+    def test_matches_in_memory_snapshot(self):
+        rng = random.Random(7)
+        features = ["alpha", "beta", "gamma", "ünïcode"]
+        for name in features[:3]:
+            self.service.add_feature(name, default_enabled=rng.random() < 0.5)
+        flags = []
+        for name in features:
+            for _ in range(200):
+                customer_id = rng.choice([None, rng.randrange(-5, 60)])
+                user_id = rng.choice([None, rng.randrange(0, 40)])
+                if customer_id is None and user_id is None:
+                    continue
+                flags.append((name, customer_id, user_id, rng.random() < 0.5))
+        self.service.set_flags_bulk(flags)
+        self.service.set_rollout("beta", 40, min_customer_id=0)
+        self.service.set_rollout("ünïcode", 60, salt="sälty")
+
+        written = write_binary_snapshot(self.service.store, self.snapshot_path)
+        expected = self.service.snapshot
+        with BinarySnapshot(self.snapshot_path) as snapshot:
+            self.assertEqual(snapshot.version, written.version)
+            self.assertEqual(sorted(snapshot.feature_names), sorted(features))
+            for name, customer_id, user_id in itertools.product(features + ["missing"], [None] + list(range(-6, 62)), [None] + list(range(0, 41))):
+                self.assertEqual(
+                    snapshot.is_enabled(name, customer_id, user_id), expected.is_enabled(name, customer_id, user_id),
+                    (name, customer_id, user_id),
+                )
+            self.assertEqual(
+                sorted(snapshot.enabled_features(3)),
+                sorted(name for name in features if expected.is_enabled(name, 3)),
+            )
+
+    def test_replace_is_atomic_and_detected(self):
+        self.service.add_feature("flag", default_enabled=False)
+        write_binary_snapshot(self.service.store, self.snapshot_path)
+        snapshot = BinarySnapshot(self.snapshot_path)
+        self.assertFalse(snapshot.changed_on_disk())
+
+        self.service.set_global_flag("flag", True)
+        write_binary_snapshot(self.service.store, self.snapshot_path)
+        self.assertTrue(snapshot.changed_on_disk())
+        self.assertFalse(snapshot.is_enabled("flag", 1))
+        snapshot.close()
+        with BinarySnapshot(self.snapshot_path) as snapshot:
+            self.assertTrue(snapshot.is_enabled("flag", 1))
+
+    def test_rejects_other_files(self):
+        with open(self.snapshot_path, "wb") as f:
+            f.write(b"not a snapshot" * 4)
+        with self.assertRaises(ValueError):
+            BinarySnapshot(self.snapshot_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
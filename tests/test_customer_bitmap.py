@@ -0,0 +1,42 @@
+import sys
+sys.path.append("src")
+from customer_bitmap import CustomerBitmap
+import random
+import unittest
+
+
+class TestCustomerBitmap(unittest.TestCase):
+
+    def test_add_discard_contains(self):
+        bitmap = CustomerBitmap([1, 70000, -3])
+        self.assertIn(1, bitmap)
+        self.assertIn(70000, bitmap)
+        self.assertIn(-3, bitmap)
+        self.assertNotIn(2, bitmap)
+        bitmap.discard(70000)
+        bitmap.discard(12345)
+        self.assertNotIn(70000, bitmap)
+        self.assertEqual(len(bitmap), 2)
+        self.assertEqual(list(bitmap), [-3, 1])
+
+    def test_iter_from(self):
+        ids = [-70000, -3, 1, 5, 70000, 70001, 200000]
+        bitmap = CustomerBitmap(ids)
+        for start in (-100000, -3, -2, 2, 70001, 70002, 10 ** 6):
+            self.assertEqual(list(bitmap.iter_from(start)), [i for i in ids if i >= start])
+
+    def test_set_algebra_matches_python_sets(self):
+        rng = random.Random(42)
+        left = {rng.randrange(0, 1 << 22) for _ in range(5000)}
+        right = {rng.randrange(0, 1 << 22) for _ in range(5000)} | set(list(left)[:1000])
+        a, b = CustomerBitmap(left), CustomerBitmap(right)
+        self.assertEqual(list(a | b), sorted(left | right))
+        self.assertEqual(list(a & b), sorted(left & right))
+        self.assertEqual(list(a - b), sorted(left - right))
+        self.assertEqual(len(a - b), len(left - right))
+        self.assertEqual(a.copy(), a)
+        self.assertFalse(CustomerBitmap([7]) - CustomerBitmap([7]))
+
+
+if __name__ == '__main__':
+    unittest.main()
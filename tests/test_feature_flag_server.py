@@ -0,0 +1,152 @@
+import sys
+sys.path.append("src")
+from feature_flag_server import FeatureFlagHTTPServer
+from feature_flag_service import FeatureFlagService, PooledSQLiteFeatureFlagStore, SQLiteFeatureFlagStore
+import gzip
+import http.client
+import json
+import os
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+
+class TestFeatureFlagServer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, "flags.db")
+        self.service = FeatureFlagService(PooledSQLiteFeatureFlagStore(self.db_path))
+        self.service.add_customer(1)
+        self.service.add_customer(2)
+        self.service.add_feature("dashboard", default_enabled=True)
+        self.service.set_flag("dashboard", customer_id=2, user_id=None, is_enabled=False)
+        self.server = FeatureFlagHTTPServer(("127.0.0.1", 0), self.service)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.conn = http.client.HTTPConnection(*self.server.server_address[:2])
+
+    def tearDown(self):
+        self.conn.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.service.close()
+        self.tmpdir.cleanup()
+
+    def request(self, path, headers=None):
+        self.conn.request("GET", path, headers=headers or {})
+        response = self.conn.getresponse()
+        return response, response.read()
+
+    def test_evaluation_endpoints(self):
+        response, body = self.request("/evaluate?feature=dashboard&customer_id=1")
+        self.assertEqual(response.status, 200)
+        self.assertTrue(json.loads(body)["enabled"])
+        # Same keep-alive connection
+        response, body = self.request("/evaluate?feature=dashboard&customer_id=2")
+        self.assertFalse(json.loads(body)["enabled"])
+        response, body = self.request("/customers/1/features")
+        self.assertEqual(json.loads(body)["features"], ["dashboard"])
+        response, body = self.request("/features/dashboard/customers")
+        self.assertEqual(json.loads(body)["customers"], [1])
+        response, body = self.request("/features/dashboard/customers?limit=1&after=1")
+        self.assertEqual(json.loads(body)["customers"], [])
+
+        response, body = self.request("/evaluate?customer_id=1")
+        self.assertEqual(response.status, 400)
+        response, body = self.request("/customers/abc/features")
+        self.assertEqual(response.status, 400)
+        response, body = self.request("/nope")
+        self.assertEqual(response.status, 404)
+        response, body = self.request("/stats")
+        self.assertEqual(json.loads(body), {"methods": {}})
+
+    def test_snapshot_etag_and_gzip(self):
+        response, body = self.request("/snapshot")
+        self.assertEqual(response.status, 200)
+        etag = response.getheader("ETag")
+        snapshot = json.loads(body)
+        self.assertEqual(snapshot["features"][0]["feature_name"], "dashboard")
+        self.assertIn({"feature_name": "dashboard", "customer_id": 2, "user_id": None, "is_enabled": False}, snapshot["overrides"])
+
+        response, body = self.request("/snapshot", {"If-None-Match": etag})
+        self.assertEqual(response.status, 304)
+        self.assertEqual(body, b"")
+
+        response, body = self.request("/snapshot", {"Accept-Encoding": "gzip"})
+        self.assertEqual(response.getheader("Content-Encoding"), "gzip")
+        self.assertEqual(json.loads(gzip.decompress(body)), snapshot)
+        gzip_etag = response.getheader("ETag")
+        self.assertNotEqual(gzip_etag, etag)
+        response, _ = self.request("/snapshot", {"Accept-Encoding": "gzip", "If-None-Match": gzip_etag})
+        self.assertEqual(response.status, 304)
+
+    def test_accept_encoding_q_values(self):
+        for accept_encoding, gzipped in [("gzip;q=0", False), ("deflate, x-gzip-ish", False),
+                                         ("br, *;q=0.5", True), ("identity;q=1, GZIP ; q=0.8", True)]:
+            response, _ = self.request("/snapshot", {"Accept-Encoding": accept_encoding})
+            self.assertEqual(response.getheader("Content-Encoding") == "gzip", gzipped, accept_encoding)
+
+    def test_snapshot_matches_store(self):
+        self.service.set_flag("dashboard", customer_id=3, user_id=30, is_enabled=True)
+        self.service.set_rollout("dashboard", 25)
+        _, body = self.request("/snapshot")
+        snapshot = json.loads(body)
+        self.assertEqual(snapshot["features"], self.service.describe_all_features())
+        _, overrides = self.service.export_flags()
+        self.assertCountEqual([(o["feature_name"], o["customer_id"], o["user_id"], o["is_enabled"])
+                               for o in snapshot["overrides"]], overrides)
+        self.assertEqual(snapshot["rollouts"]["dashboard"]["percentage"], 25)
+
+    def test_writes_from_another_process_invalidate(self):
+        response, _ = self.request("/snapshot")
+        etag = response.getheader("ETag")
+        other = SQLiteFeatureFlagStore(self.db_path)
+        other.set_flag("dashboard", customer_id=1, user_id=None, is_enabled=False)
+        other.close()
+
+        response, _ = self.request("/snapshot", {"If-None-Match": etag})
+        self.assertEqual(response.status, 200)
+        self.assertNotEqual(response.getheader("ETag"), etag)
+        response, body = self.request("/evaluate?feature=dashboard&customer_id=1")
+        self.assertFalse(json.loads(body)["enabled"])
+
+    def test_changes_feed(self):
+        version = self.service.current_version()
+        self.service.set_global_flag("dashboard", False)
+        response, body = self.request(f"/changes?since={version}")
+        document = json.loads(body)
+        self.assertEqual(document["version"], version + 1)
+        self.assertEqual([change["operation"] for change in document["changes"]], ["set_global_flag"])
+        response, body = self.request("/evaluate?feature=dashboard&customer_id=1")
+        self.assertFalse(json.loads(body)["enabled"])
+
+        # With a limit, the version is that of the last change returned
+        document = json.loads(self.request("/changes?since=0&limit=2")[1])
+        self.assertEqual(document["version"], 2)
+        self.assertEqual([change["version"] for change in document["changes"]], [1, 2])
+        document = json.loads(self.request(f"/changes?since={version + 1}")[1])
+        self.assertEqual(document, {"version": version + 1, "changes": []})
+
+        self.service.compact_changes(version + 1)
+        response, _ = self.request(f"/changes?since={version}")
+        self.assertEqual(response.status, 410)
+        response, _ = self.request("/changes")
+        self.assertEqual(response.status, 400)
+
+    def test_unexpected_error_returns_500(self):
+        def fail(customer_id):
+            raise RuntimeError("database is locked")
+        self.service.list_features_for_customer = fail
+        with unittest.mock.patch("traceback.print_exc"):
+            response, body = self.request("/customers/1/features")
+        self.assertEqual(response.status, 500)
+        self.assertEqual(json.loads(body), {"error": "internal server error"})
+        # The connection stays usable
+        response, _ = self.request("/health")
+        self.assertEqual(response.status, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,15 @@
 import sys
 sys.path.append("src")
-from feature_flag_service import FeatureFlagService, SQLiteFeatureFlagStore
+from feature_flag_service import (
+    ChangesCompactedError, FeatureFlagService, FeatureFlagSnapshot, SQLiteFeatureFlagStore, PooledSQLiteFeatureFlagStore,
+    MIGRATIONS, Rollout, SCHEMA_VERSION, rollout_bucket,
+)
+from caching_feature_flag_store import CachingFeatureFlagStore
+from in_memory_feature_flag_store import InMemoryFeatureFlagStore
+from sharded_feature_flag_store import META_FILE, ShardedFeatureFlagStore, reshard, shard_for_customer, shard_path
+import shutil
+import sqlite3
+import threading
 import unittest
 import os
 
@@ -11,11 +20,16 @@ class TestFeatureFlagService(unittest.TestCase):
     def setUp(self):
         if os.path.exists(self.DB_PATH):
             os.remove(self.DB_PATH)
-        store = SQLiteFeatureFlagStore(db_path=self.DB_PATH)
-        self.service = FeatureFlagService(store)
+        self.service = FeatureFlagService(self.make_store())
         self.service.add_customer(1)
         self.service.add_customer(2)
 
+    def make_store(self):
+        return SQLiteFeatureFlagStore(db_path=self.DB_PATH)
+
+    def in_transaction(self) -> bool:
+        return self.service.store.conn.in_transaction
+
     def tearDown(self):
         self.service.close()
         if os.path.exists(self.DB_PATH):
@@ -52,6 +66,33 @@ class TestFeatureFlagService(unittest.TestCase):
         self.assertIn("new_feature", self.service.list_features_for_customer(1))
         self.assertNotIn("old_feature", self.service.list_features_for_customer(1))
 
+    def test_rename_onto_live_or_leftover_feature(self):
+        self.service.set_flag("a", customer_id=5, user_id=None, is_enabled=True)
+        self.service.set_flag("b", customer_id=6, user_id=None, is_enabled=True)
+        with self.assertRaises(ValueError):
+            self.service.rename_feature("b", "a")
+        self.assertEqual(self.service.list_customers_with_feature("a"), [5])
+        self.assertEqual(self.service.list_customers_with_feature("b"), [6])
+
+        # remove_user empties "c" but may leave its name behind
+        self.service.set_flag("c", customer_id=None, user_id=7, is_enabled=True)
+        self.service.remove_user(7)
+        self.service.rename_feature("c", "a")
+        self.assertEqual(self.service.list_customers_with_feature("a"), [5])
+        self.service.rename_feature("a", "c")
+        self.service.rename_feature("b", "a")
+        self.assertEqual(self.service.list_customers_with_feature("a"), [6])
+        self.assertEqual(self.service.list_customers_with_feature("c"), [5])
+
+    def test_remove_unregistered_customer(self):
+        self.service.set_flag("g", customer_id=9, user_id=None, is_enabled=True)
+        self.service.set_flag("g", customer_id=9, user_id=90, is_enabled=True)
+        self.assertTrue(self.service.is_enabled("g", 9))
+        self.service.remove_customer(9)
+        self.assertFalse(self.service.is_enabled("g", 9))
+        self.assertEqual(self.service.list_customers_with_feature("g"), [])
+        self.assertEqual(self.service.export_flags()[1], [])
+
     def test_user_level_feature_flags(self):
         self.service.add_feature("user_feature")
         self.service.set_flag("user_feature", customer_id=1, user_id=100, is_enabled=True)
@@ -89,6 +130,43 @@ class TestFeatureFlagService(unittest.TestCase):
         self.assertFalse(feature2_desc["global_enabled"])
         self.assertIn(1, feature2_desc["explicitly_enabled_customers"])
 
+    def test_describe_all_features_groups_overrides(self):
+        self.service.add_feature("feature1", default_enabled=True)
+        self.service.add_feature("feature2", default_enabled=False)
+        self.service.set_flag("feature1", customer_id=2, user_id=None, is_enabled=False)
+        self.service.set_flag("feature1", customer_id=2, user_id=20, is_enabled=False)
+        self.service.set_flag("feature1", customer_id=1, user_id=10, is_enabled=True)
+        self.service.set_flag("feature1", customer_id=1, user_id=11, is_enabled=True)
+        self.service.set_flag("feature1", customer_id=None, user_id=30, is_enabled=True)
+        self.assertEqual(self.service.describe_all_features(), [
+            {"feature_name": "feature1", "global_enabled": True,
+             "explicitly_enabled_customers": [1], "explicitly_disabled_customers": [2]},
+            {"feature_name": "feature2", "global_enabled": False,
+             "explicitly_enabled_customers": [], "explicitly_disabled_customers": []},
+        ])
+
+    def test_paginated_lists_match_full_lists(self):
+        self.service.add_customers_bulk(range(3, 26))
+        self.service.add_feature("on", default_enabled=True)
+        self.service.add_feature("off", default_enabled=False)
+        for customer_id in range(1, 26, 3):
+            self.service.set_flag("on", customer_id=customer_id, user_id=None, is_enabled=False)
+            self.service.set_flag("off", customer_id=customer_id, user_id=None, is_enabled=True)
+        self.service.set_flag("off", customer_id=4, user_id=40, is_enabled=False)
+
+        self.assertEqual(self.service.page_all_customers(limit=3), [1, 2, 3])
+        self.assertEqual(self.service.page_all_customers(after=3, limit=3), [4, 5, 6])
+        self.assertEqual(self.service.page_all_customers(after=25), [])
+        self.assertEqual(list(self.service.iter_all_customers(page_size=4)), sorted(self.service.list_all_customers()))
+        for feature in ("on", "off"):
+            self.assertEqual(list(self.service.iter_customers_with_feature(feature, page_size=4)),
+                             sorted(self.service.list_customers_with_feature(feature)))
+            self.assertEqual(list(self.service.iter_customers_with_feature_explicitly_enabled(feature, page_size=2)),
+                             sorted(self.service.list_customers_with_feature_explicitly_enabled(feature)))
+            self.assertEqual(list(self.service.iter_customers_with_feature_explicitly_disabled(feature, page_size=2)),
+                             sorted(self.service.list_customers_with_feature_explicitly_disabled(feature)))
+        self.assertEqual(self.service.page_customers_with_feature("off", after=4, limit=2), [7, 10])
+
     def test_invalid_flag_setting(self):
         with self.assertRaises(ValueError):
             self.service.set_flag("feature", customer_id=None, user_id=None, is_enabled=True)
@@ -100,5 +178,798 @@ class TestFeatureFlagService(unittest.TestCase):
         self.assertIn(1, self.service.list_customers_with_feature("enabled_feature"))
         self.assertNotIn(1, self.service.list_customers_with_feature("disabled_feature"))
 
+    def test_is_enabled_precedence(self):
+        self.service.add_feature("search", default_enabled=False)
+        self.service.set_flag("search", customer_id=1, user_id=None, is_enabled=True)
+        self.service.set_flag("search", customer_id=1, user_id=100, is_enabled=False)
+        self.service.set_flag("search", customer_id=None, user_id=200, is_enabled=True)
+
+        self.assertTrue(self.service.is_enabled("search", 1))
+        self.assertFalse(self.service.is_enabled("search", 1, user_id=100))
+        self.assertTrue(self.service.is_enabled("search", 1, user_id=101))
+        self.assertFalse(self.service.is_enabled("search", 2))
+        self.assertTrue(self.service.is_enabled("search", 2, user_id=200))
+        self.assertFalse(self.service.is_enabled("unknown", 1))
+
+    def test_is_enabled_rebuilds_after_write(self):
+        self.service.add_feature("reports", default_enabled=False)
+        self.assertFalse(self.service.is_enabled("reports", 1))
+        snapshot = self.service.snapshot
+        self.assertIs(snapshot, self.service.snapshot)
+
+        self.service.set_global_flag("reports", True)
+        self.assertTrue(self.service.is_enabled("reports", 1))
+        self.service.set_flag("reports", customer_id=1, user_id=None, is_enabled=False)
+        self.assertFalse(self.service.is_enabled("reports", 1))
+        self.service.rename_feature("reports", "analytics")
+        self.assertFalse(self.service.is_enabled("reports", 2))
+        self.assertTrue(self.service.is_enabled("analytics", 2))
+
+    def test_evaluate_many_matches_list_features_for_customer(self):
+        self.service.add_customer(3)
+        self.service.add_feature("billing", default_enabled=True)
+        self.service.add_feature("beta", default_enabled=False)
+        self.service.set_flag("billing", customer_id=2, user_id=None, is_enabled=False)
+        self.service.set_flag("beta", customer_id=1, user_id=None, is_enabled=True)
+        self.service.set_flag("beta", customer_id=3, user_id=300, is_enabled=True)
+        self.service.set_flag("beta", customer_id=3, user_id=301, is_enabled=False)
+
+        customer_ids = [1, 2, 3, 4]
+        self.assertEqual(self.service.evaluate_many("billing", customer_ids), {1: True, 2: False, 3: True, 4: True})
+        self.assertEqual(self.service.evaluate_many("beta", customer_ids), {1: True, 2: False, 3: False, 4: False})
+
+        matrix = self.service.evaluate_matrix(customer_ids, ["billing", "beta", "missing"])
+        for customer_id in customer_ids:
+            enabled = set(self.service.list_features_for_customer(customer_id))
+            self.assertEqual({name for name, on in matrix[customer_id].items() if on}, enabled)
+        self.assertEqual(self.service.evaluate_matrix([1], []), {1: {}})
+
+    def test_listings_with_user_level_and_unregistered_overrides(self):
+        self.service.add_customer(3)
+        self.service.add_feature("inbox", default_enabled=True)
+        self.service.add_feature("beta", default_enabled=False)
+        self.service.add_feature("gradual", default_enabled=False)
+        self.service.set_rollout("gradual", 100)
+        self.service.set_flag("inbox", customer_id=1, user_id=100, is_enabled=False)
+        self.service.set_flag("inbox", customer_id=2, user_id=None, is_enabled=False)
+        self.service.set_flag("inbox", customer_id=8, user_id=800, is_enabled=True)
+        self.service.set_flag("beta", customer_id=7, user_id=700, is_enabled=True)
+        self.service.set_flag("gradual", customer_id=1, user_id=101, is_enabled=False)
+        self.service.set_flag("gradual", customer_id=3, user_id=None, is_enabled=False)
+
+        self.assertEqual(sorted(self.service.list_customers_with_feature("inbox")), [1, 3])
+        self.assertEqual(sorted(self.service.list_customers_with_feature("beta")), [7])
+        self.assertEqual(sorted(self.service.list_customers_with_feature("gradual")), [1, 2])
+        self.assertEqual(sorted(self.service.list_features_for_customer(1)), [])
+        self.assertEqual(sorted(self.service.list_features_for_customer(2)), ["gradual"])
+        self.assertEqual(sorted(self.service.list_features_for_customer(3)), ["inbox"])
+        self.assertEqual(sorted(self.service.list_features_for_customer(7)), ["beta", "gradual", "inbox"])
+        self.assertEqual(sorted(self.service.list_features_for_customer(8)), ["gradual", "inbox"])
+        self.assertEqual(self.service.evaluate_many("inbox", [1, 3, 8]), {1: False, 3: True, 8: True})
+
+    def test_count_customers_with_feature(self):
+        self.service.add_customer(3)
+        self.service.add_feature("inbox", default_enabled=True)
+        self.service.add_feature("beta", default_enabled=False)
+        self.service.set_flag("inbox", customer_id=2, user_id=None, is_enabled=False)
+        self.service.set_flag("beta", customer_id=1, user_id=None, is_enabled=True)
+        self.service.set_flag("beta", customer_id=3, user_id=300, is_enabled=True)
+        self.service.set_flag("beta", customer_id=2, user_id=None, is_enabled=True)
+        self.service.set_flag("beta", customer_id=2, user_id=200, is_enabled=False)
+
+        self.assertEqual(sorted(self.service.list_customers_with_feature("inbox")), [1, 3])
+        self.assertEqual(self.service.count_customers_with_feature("inbox"), 2)
+        self.assertEqual(sorted(self.service.list_customers_with_feature("beta")), [1, 3])
+        self.assertEqual(self.service.count_customers_with_feature("beta"), 2)
+
+        self.service.remove_user(200)
+        self.assertEqual(sorted(self.service.list_customers_with_feature("beta")), [1, 2, 3])
+        self.service.remove_customer(3)
+        self.assertEqual(self.service.count_customers_with_feature("inbox"), 1)
+        self.assertEqual(sorted(self.service.list_customers_with_feature("beta")), [1, 2])
+        self.assertEqual(self.service.count_customers_with_feature("missing"), 0)
+
+    def test_rollouts(self):
+        self.service.add_customers_bulk(range(3, 2001))
+        self.service.add_feature("gradual", default_enabled=False)
+        self.service.set_rollout("gradual", 25)
+        in_rollout = [c for c in range(1, 2001) if rollout_bucket("gradual", c) < 2500]
+        self.assertTrue(400 < len(in_rollout) < 600)
+        self.assertEqual(sorted(self.service.list_customers_with_feature("gradual")), in_rollout)
+        self.assertEqual(self.service.count_customers_with_feature("gradual"), len(in_rollout))
+        self.assertEqual(list(self.service.iter_customers_with_feature("gradual", page_size=100)), in_rollout)
+        self.assertTrue(self.service.is_enabled("gradual", in_rollout[0]))
+        self.assertIn("gradual", self.service.list_features_for_customer(in_rollout[0]))
+        outside = next(c for c in range(1, 2001) if c not in in_rollout)
+        self.assertFalse(self.service.is_enabled("gradual", outside))
+        self.assertEqual(self.service.evaluate_many("gradual", [in_rollout[0], outside]), {in_rollout[0]: True, outside: False})
+
+        # Explicit overrides beat the rollout
+        self.service.set_flag("gradual", customer_id=in_rollout[0], user_id=None, is_enabled=False)
+        self.service.set_flag("gradual", customer_id=outside, user_id=None, is_enabled=True)
+        expected = sorted(set(in_rollout[1:]) | {outside})
+        self.assertEqual(sorted(self.service.list_customers_with_feature("gradual")), expected)
+        self.assertFalse(self.service.is_enabled("gradual", in_rollout[0]))
+        self.assertTrue(self.service.is_enabled("gradual", outside))
+        self.assertEqual(self.service.evaluate_matrix([in_rollout[1], outside], ["gradual"]),
+                         {in_rollout[1]: {"gradual": True}, outside: {"gradual": True}})
+
+        # New customers fall into buckets without writes; ranges and salts narrow it
+        self.service.add_customer(5000)
+        self.assertEqual(5000 in self.service.list_customers_with_feature("gradual"), rollout_bucket("gradual", 5000) < 2500)
+        self.service.set_rollout("gradual", 100, salt="v2", min_customer_id=10, max_customer_id=19)
+        self.assertEqual(self.service.list_rollouts(), {"gradual": Rollout(100.0, "v2", 10, 19)})
+        self.assertEqual(sorted(self.service.list_customers_with_feature("gradual")), sorted(set(range(10, 20)) | {outside}))
+        self.service.rename_feature("gradual", "steady")
+        self.assertTrue(self.service.is_enabled("steady", 15))
+        self.assertEqual(self.service.count_customers_with_feature("steady"), len(set(range(10, 20)) | {outside}))
+        self.service.clear_rollout("steady")
+        self.assertEqual(self.service.list_customers_with_feature("steady"), [outside])
+        self.assertFalse(self.service.is_enabled("steady", 15))
+        with self.assertRaises(ValueError):
+            self.service.set_rollout("steady", 101)
+
+    def test_set_flag_upserts_null_keyed_overrides(self):
+        for is_enabled in (True, False, True):
+            self.service.set_flag("upsert", customer_id=1, user_id=None, is_enabled=is_enabled)
+            self.service.set_flag("upsert", customer_id=None, user_id=7, is_enabled=not is_enabled)
+            self.service.set_flag("upsert", customer_id=1, user_id=7, is_enabled=is_enabled)
+        _, overrides = self.service.export_flags()
+        self.assertEqual(sorted(overrides, key=repr), sorted([
+            ("upsert", 1, None, True), ("upsert", None, 7, False), ("upsert", 1, 7, True),
+        ], key=repr))
+
+    def test_bulk_writes(self):
+        self.service.add_feature("bulk", default_enabled=False)
+        self.assertEqual(self.service.add_customers_bulk(range(10, 20)), 10)
+        flags = [("bulk", customer_id, None, customer_id % 2 == 0) for customer_id in range(10, 20)]
+        flags.append(("bulk", None, 500, True))
+        self.assertEqual(self.service.set_flags_bulk(iter(flags), chunk_size=3), 11)
+        self.assertEqual(sorted(self.service.list_customers_with_feature("bulk")), [10, 12, 14, 16, 18])
+        self.assertTrue(self.service.is_enabled("bulk", 99, user_id=500))
+
+        with self.assertRaises(ValueError):
+            self.service.set_flags_bulk([("bulk", 11, None, True), ("bulk", None, None, True)])
+        self.assertNotIn(11, self.service.list_customers_with_feature("bulk"))
+
+    def test_transaction_commits_once_and_rolls_back(self):
+        with self.service.transaction():
+            self.service.add_feature("tx", default_enabled=False)
+            self.service.set_flag("tx", customer_id=1, user_id=None, is_enabled=True)
+            self.assertTrue(self.in_transaction())
+        self.assertFalse(self.in_transaction())
+        self.assertEqual(self.service.list_customers_with_feature("tx"), [1])
+
+        with self.assertRaises(RuntimeError):
+            with self.service.transaction():
+                self.service.set_flag("tx", customer_id=2, user_id=None, is_enabled=True)
+                self.service.remove_customer(1)
+                raise RuntimeError("abort")
+        self.assertEqual(self.service.list_customers_with_feature("tx"), [1])
+        self.assertIn(1, self.service.list_all_customers())
+
+    def test_change_log(self):
+        start = self.service.current_version()
+        self.service.add_feature("log", default_enabled=False)
+        self.service.set_global_flag("log", True)
+        self.service.set_flag("log", customer_id=1, user_id=None, is_enabled=False)
+        self.service.set_flags_bulk([("log", 2, 20, False)])
+        self.service.rename_feature("log", "journal")
+        self.service.remove_user(20)
+        self.service.remove_customer(1)
+        self.service.remove_feature("journal")
+        with self.assertRaises(ValueError):
+            with self.service.transaction():
+                self.service.add_customer(3)
+                raise ValueError("rolled back")
+
+        changes = self.service.changes_since(start)
+        self.assertEqual([change["operation"] for change in changes], [
+            "add_feature", "set_global_flag", "set_flag", "set_flag", "rename_feature",
+            "remove_user", "remove_customer", "remove_feature",
+        ])
+        self.assertEqual([change["version"] for change in changes], list(range(start + 1, start + 9)))
+        self.assertEqual(changes[4]["new_name"], "journal")
+        self.assertIs(changes[2]["is_enabled"], False)
+        self.assertEqual(self.service.current_version(), start + 8)
+        self.assertEqual(len(self.service.changes_since(start, limit=3)), 3)
+
+        self.assertEqual(self.service.compact_changes(start + 4), start + 4)
+        self.assertEqual(len(self.service.changes_since(start + 4)), 4)
+        with self.assertRaises(ChangesCompactedError):
+            self.service.changes_since(start + 3)
+        self.service.compact_changes(start + 100)
+        self.assertEqual(self.service.current_version(), start + 8)
+        self.assertEqual(self.service.changes_since(start + 8), [])
+        self.service.add_customer(4)
+        self.assertEqual(self.service.current_version(), start + 9)
+
+    def test_snapshot_applies_deltas(self):
+        self.service.add_feature("delta", default_enabled=True)
+        self.service.set_flag("delta", customer_id=2, user_id=None, is_enabled=False)
+        snapshot = self.service.snapshot
+        self.service.set_flag("delta", customer_id=1, user_id=10, is_enabled=False)
+        self.service.rename_feature("delta", "gamma")
+        self.service.add_feature("beta", default_enabled=False)
+        self.service.set_flag("beta", customer_id=None, user_id=30, is_enabled=True)
+        self.service.remove_user(30)
+        self.service.remove_customer(2)
+        self.service.set_rollout("beta", 50, min_customer_id=100)
+        self.service.set_rollout("gamma", 10)
+        self.service.clear_rollout("gamma")
+
+        self.assertIs(self.service.snapshot, snapshot)
+        rebuilt = FeatureFlagSnapshot.from_store(self.service.store)
+        self.assertEqual(snapshot.version, rebuilt.version)
+        self.assertEqual(snapshot.global_flags, rebuilt.global_flags)
+        self.assertEqual(snapshot.customer_overrides, rebuilt.customer_overrides)
+        self.assertEqual(snapshot.user_overrides, rebuilt.user_overrides)
+        self.assertEqual(snapshot.rollouts, {"beta": Rollout(50.0, "beta", 100, None)})
+        self.assertEqual(snapshot.rollouts, rebuilt.rollouts)
+        self.assertFalse(self.service.is_enabled("gamma", 1, user_id=10))
+        self.assertTrue(self.service.is_enabled("gamma", 2))
+
+        self.service.compact_changes(self.service.current_version())
+        self.service.set_global_flag("beta", True)
+        self.service.compact_changes(self.service.current_version())
+        self.service.set_global_flag("beta", False)
+        self.assertFalse(self.service.is_enabled("beta", 1))
+        self.assertIsNot(self.service.snapshot, snapshot)
+
+
+class TestSchemaMigrations(unittest.TestCase):
+
+    DB_PATH = "test_feature_flags_migrations.db"
+
+    def setUp(self):
+        if os.path.exists(self.DB_PATH):
+            os.remove(self.DB_PATH)
+
+    def tearDown(self):
+        if os.path.exists(self.DB_PATH):
+            os.remove(self.DB_PATH)
+
+    def test_upgrade_unversioned_database(self):
+        conn = sqlite3.connect(self.DB_PATH)
+        conn.execute("CREATE TABLE customers (customer_id INTEGER PRIMARY KEY)")
+        conn.execute("CREATE TABLE global_feature_flags (feature_name TEXT PRIMARY KEY, is_enabled BOOLEAN NOT NULL)")
+        conn.execute("""
+            CREATE TABLE feature_flags (
+                feature_name TEXT NOT NULL, customer_id INTEGER, user_id INTEGER, is_enabled BOOLEAN NOT NULL,
+                PRIMARY KEY (feature_name, customer_id, user_id)
+            )
+        """)
+        conn.executemany("INSERT INTO feature_flags VALUES (?, ?, ?, ?)", [
+            ("inbox", 1, None, 1), ("inbox", 1, None, 0), ("inbox", None, 5, 0), ("inbox", None, 5, 1),
+        ])
+        conn.commit()
+        conn.close()
+
+        store = SQLiteFeatureFlagStore(db_path=self.DB_PATH)
+        try:
+            self.assertEqual(store.schema_version, SCHEMA_VERSION)
+            _, overrides = store.export_flags()
+            self.assertEqual(sorted(overrides, key=repr), sorted([("inbox", 1, None, False), ("inbox", None, 5, True)], key=repr))
+            plan = store.conn.execute("EXPLAIN QUERY PLAN SELECT feature_id FROM feature_flags WHERE customer_id = 1").fetchall()
+            self.assertIn("feature_flags_by_customer", str(plan))
+            plan = store.conn.execute("EXPLAIN QUERY PLAN DELETE FROM feature_flags WHERE user_id = 5").fetchall()
+            self.assertIn("feature_flags_by_user", str(plan))
+        finally:
+            store.close()
+
+        # Reopening an up-to-date database is a no-op
+        store = SQLiteFeatureFlagStore(db_path=self.DB_PATH)
+        self.assertEqual(store.schema_version, SCHEMA_VERSION)
+        store.close()
+
+    def test_upgrade_interns_feature_names(self):
+        conn = sqlite3.connect(self.DB_PATH)
+        conn.execute("CREATE TABLE schema_version (version INTEGER NOT NULL)")
+        conn.execute("INSERT INTO schema_version (version) VALUES (4)")
+        for statements in MIGRATIONS[:4]:
+            for statement in statements:
+                conn.execute(statement)
+        conn.executemany("INSERT INTO customers VALUES (?)", [(1,), (2,)])
+        conn.executemany("INSERT INTO global_feature_flags VALUES (?, ?)", [("inbox", 1), ("search", 0)])
+        conn.executemany("INSERT INTO feature_flags VALUES (?, ?, ?, ?)", [
+            ("inbox", 1, None, 0), ("search", 2, None, 1), ("beta", None, 5, 1),
+        ])
+        conn.execute("INSERT INTO rollouts VALUES ('search', 50, 'salt', NULL, 10)")
+        conn.commit()
+        conn.close()
+
+        store = SQLiteFeatureFlagStore(db_path=self.DB_PATH)
+        try:
+            self.assertEqual(store.schema_version, SCHEMA_VERSION)
+            self.assertEqual(store.conn.execute("SELECT name FROM features ORDER BY feature_id").fetchall(),
+                             [("inbox",), ("search",), ("beta",)])
+            self.assertEqual(store.list_all_features(), ["inbox", "search"])
+            self.assertEqual(store.list_customers_with_feature("inbox"), [2])
+            self.assertEqual(store.list_customers_with_feature_explicitly_enabled("search"), [2])
+            self.assertEqual(store.list_rollouts(), {"search": Rollout(50.0, "salt", None, 10)})
+            self.assertEqual(store.conn.execute("PRAGMA foreign_key_check").fetchall(), [])
+        finally:
+            store.close()
+
+    def test_feature_and_customer_deletes_cascade(self):
+        store = SQLiteFeatureFlagStore(db_path=self.DB_PATH)
+        try:
+            store.add_customers_bulk([1, 2])
+            store.add_feature("inbox", default_enabled=False)
+            store.set_flags_bulk([("inbox", 1, None, True), ("inbox", 2, 7, True), ("inbox", None, 7, False)])
+            store.set_rollout("inbox", 10)
+
+            store.rename_feature("inbox", "mail")
+            self.assertEqual(store.conn.execute("SELECT name FROM features").fetchall(), [("mail",)])
+            self.assertEqual(store.list_customers_with_feature_explicitly_enabled("mail"), [1, 2])
+
+            store.remove_customer(2)
+            self.assertEqual(store.conn.execute("SELECT COUNT(*) FROM feature_flags WHERE customer_id = 2").fetchone(), (0,))
+
+            # The trace repeats the statement for each cascade it runs
+            statements = []
+            store.set_trace_callback(statements.append)
+            store.remove_feature("mail")
+            store.set_trace_callback(None)
+            self.assertEqual({s for s in statements if "DELETE" in s}, {"DELETE FROM features WHERE name = 'mail'"})
+            for table in ("global_feature_flags", "feature_flags", "rollouts"):
+                self.assertEqual(store.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone(), (0,))
+        finally:
+            store.close()
+
+
+class TestFeatureFlagServiceBitmapIndex(TestFeatureFlagService):
+
+    def make_store(self):
+        return SQLiteFeatureFlagStore(db_path=self.DB_PATH, bitmap_index=True)
+
+    def test_bitmap_index_matches_sql(self):
+        self.service.add_feature("inbox", default_enabled=True)
+        self.service.set_flag("inbox", customer_id=2, user_id=None, is_enabled=False)
+        self.service.set_flag("inbox", customer_id=5, user_id=50, is_enabled=True)
+        self.service.rename_feature("inbox", "mail")
+        self.service.set_global_flag("mail", False)
+        self.service.close()
+
+        self.service = FeatureFlagService(SQLiteFeatureFlagStore(db_path=self.DB_PATH))
+        expected = sorted(self.service.list_customers_with_feature("mail"))
+        self.service.close()
+        self.service = FeatureFlagService(self.make_store())
+        self.assertEqual(sorted(self.service.list_customers_with_feature("mail")), expected)
+        self.assertEqual(expected, [5])
+
+
+class TestFeatureFlagServiceEffectiveFlags(TestFeatureFlagService):
+
+    def make_store(self):
+        return SQLiteFeatureFlagStore(db_path=self.DB_PATH, effective_flags=True)
+
+    def effective_rows(self):
+        return self.service.store.conn.execute("SELECT feature_id, customer_id FROM effective_flags").fetchall()
+
+    def test_triggers_match_rebuild(self):
+        store = self.service.store
+        self.assertTrue(store.has_effective_flags)
+        self.service.add_customers_bulk(range(3, 200))
+        self.service.add_feature("inbox", default_enabled=True)
+        self.service.add_feature("beta", default_enabled=False)
+        self.service.set_rollout("beta", 30, min_customer_id=50)
+        self.service.set_flags_bulk([
+            ("inbox", customer_id, None if customer_id % 2 else customer_id * 10, customer_id % 3 == 0)
+            for customer_id in range(0, 300, 7)
+        ])
+        self.service.set_flag("beta", customer_id=None, user_id=5, is_enabled=True)
+        self.service.set_flag("beta", customer_id=60, user_id=None, is_enabled=False)
+        self.service.set_flag("beta", customer_id=250, user_id=None, is_enabled=True)
+        steps = [
+            lambda: self.service.set_global_flag("inbox", False),
+            lambda: self.service.set_rollout("beta", 80, salt="v2"),
+            lambda: self.service.remove_customer(14),
+            lambda: self.service.remove_user(70),
+            lambda: self.service.add_customer(250),
+            lambda: self.service.rename_feature("beta", "gamma"),
+            lambda: self.service.set_global_flag("gamma", True),
+            lambda: self.service.clear_rollout("gamma"),
+            lambda: self.service.add_feature("inbox", default_enabled=True),
+            lambda: self.service.remove_feature("gamma"),
+        ]
+        for step in steps:
+            step()
+            maintained = sorted(self.effective_rows())
+            self.assertEqual(store.rebuild_effective_flags(), len(maintained))
+            self.assertEqual(sorted(self.effective_rows()), maintained)
+
+    def test_listings_match_queries(self):
+        self.service.add_customers_bulk(range(3, 100))
+        self.service.add_feature("inbox", default_enabled=True)
+        self.service.add_feature("beta", default_enabled=False)
+        self.service.set_rollout("beta", 40, max_customer_id=80)
+        self.service.set_flags_bulk([
+            (name, customer_id, None if customer_id % 2 else customer_id * 10, customer_id % 3 == 0)
+            for name in ("inbox", "beta") for customer_id in range(0, 150, 7)
+        ])
+        customers = range(0, 150)
+
+        def listings():
+            return ({name: sorted(self.service.list_customers_with_feature(name)) for name in ("inbox", "beta")},
+                    {customer_id: sorted(self.service.list_features_for_customer(customer_id))
+                     for customer_id in customers})
+
+        materialized = listings()
+        self.service.store.disable_effective_flags()
+        self.assertEqual(listings(), materialized)
+
+    def test_enable_and_disable(self):
+        self.service.add_feature("inbox", default_enabled=True)
+        self.service.set_flag("inbox", customer_id=2, user_id=None, is_enabled=False)
+        self.service.store.disable_effective_flags()
+        self.assertFalse(self.service.store.has_effective_flags)
+        self.assertEqual(self.service.list_customers_with_feature("inbox"), [1])
+        with self.assertRaises(RuntimeError):
+            self.service.store.rebuild_effective_flags()
+        self.service.add_customer(3)
+        self.service.close()
+
+        # Reopening without the option keeps using an existing table
+        self.service = FeatureFlagService(self.make_store())
+        self.assertEqual(self.effective_rows(), [(1, 1), (1, 3)])
+        self.service.close()
+        self.service = FeatureFlagService(SQLiteFeatureFlagStore(db_path=self.DB_PATH))
+        self.assertTrue(self.service.store.has_effective_flags)
+        self.assertEqual(self.service.list_features_for_customer(3), ["inbox"])
+        self.assertEqual(self.service.storage_stats()["effective_flags_rows"], 2)
+
+
+class TestPooledFeatureFlagService(TestFeatureFlagService):
+
+    def make_store(self):
+        return PooledSQLiteFeatureFlagStore(db_path=self.DB_PATH)
+
+    def tearDown(self):
+        super().tearDown()
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(self.DB_PATH + suffix):
+                os.remove(self.DB_PATH + suffix)
+
+    def test_wal_mode_and_per_thread_connections(self):
+        store = self.service.store
+        self.assertEqual(store.conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        self.assertEqual(store.conn.execute("PRAGMA synchronous").fetchone()[0], 1)
+        connections = []
+        thread = threading.Thread(target=lambda: connections.append(store.conn))
+        thread.start()
+        thread.join()
+        self.assertIsNot(connections[0], store.conn)
+        self.assertEqual(store.pool_size, 2)
+
+    def test_concurrent_readers_and_writers(self):
+        self.service.add_customers_bulk(range(3, 200))
+        self.service.add_feature("stress", default_enabled=False)
+        errors = []
+        writes_done = threading.Event()
+        reads = []
+
+        def writer(offset):
+            try:
+                for i in range(60):
+                    customer_id = offset + i
+                    self.service.store.set_flag("stress", customer_id=customer_id, user_id=None, is_enabled=True)
+                    if i % 20 == 0:
+                        self.service.store.set_global_flag("toggled", i % 40 == 0)
+            except Exception as exc:
+                errors.append(exc)
+
+        def reader():
+            count = 0
+            try:
+                while not writes_done.is_set() or count < 5:
+                    customers = self.service.store.list_customers_with_feature("stress")
+                    self.assertEqual(len(customers), len(set(customers)))
+                    self.service.store.list_features_for_customer(1)
+                    count += 1
+            except Exception as exc:
+                errors.append(exc)
+            reads.append(count)
+
+        writers = [threading.Thread(target=writer, args=(offset,)) for offset in (0, 100)]
+        readers = [threading.Thread(target=reader) for _ in range(4)]
+        for thread in readers + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        writes_done.set()
+        for thread in readers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(reads), 4)
+        self.assertEqual(self.service.count_customers_with_feature("stress"), 120)
+
+
+class TestInMemoryFeatureFlagService(TestFeatureFlagService):
+
+    def make_store(self):
+        return InMemoryFeatureFlagStore()
+
+    def in_transaction(self) -> bool:
+        return self.service.store.in_transaction
+
+    def test_rollback_restores_every_structure(self):
+        self.service.add_feature("tx", default_enabled=False)
+        self.service.set_flag("tx", customer_id=1, user_id=10, is_enabled=True)
+        before = (self.service.export_flags(), self.service.list_all_customers(), self.service.current_version())
+        with self.assertRaises(RuntimeError):
+            with self.service.transaction():
+                self.service.rename_feature("tx", "renamed")
+                self.service.remove_user(10)
+                self.service.remove_customer(2)
+                self.service.set_rollout("renamed", 50)
+                self.service.compact_changes(self.service.current_version())
+                raise RuntimeError("abort")
+        self.assertEqual((self.service.export_flags(), self.service.list_all_customers(), self.service.current_version()), before)
+        self.assertEqual(self.service.list_features_for_customer(1), ["tx"])
+        self.service.remove_user(10)
+        self.assertEqual(self.service.list_features_for_customer(1), [])
+        self.assertEqual(self.service.changes_since(0)[-1]["version"], before[2] + 1)
+
+
+class TestCachingFeatureFlagService(TestFeatureFlagService):
+
+    def make_store(self):
+        return CachingFeatureFlagStore(SQLiteFeatureFlagStore(db_path=self.DB_PATH))
+
+    def test_reads_are_cached_until_an_affecting_write(self):
+        store = self.service.store
+        self.service.add_feature("a", default_enabled=False)
+        self.service.add_feature("b", default_enabled=False)
+        self.service.set_flag("a", customer_id=1, user_id=None, is_enabled=True)
+        self.assertEqual(self.service.list_customers_with_feature("a"), [1])
+        self.assertEqual(self.service.list_customers_with_feature("b"), [])
+        misses = store.misses
+        self.assertEqual(self.service.list_customers_with_feature("a"), [1])
+        self.assertEqual((store.misses, store.hits), (misses, 1))
+
+        # A write to "b" leaves the cached result for "a" alone
+        self.service.set_flag("b", customer_id=2, user_id=None, is_enabled=True)
+        self.service.list_customers_with_feature("a")
+        self.assertEqual(store.misses, misses)
+        self.assertEqual(self.service.list_customers_with_feature("b"), [2])
+        self.assertEqual(store.misses, misses + 1)
+
+        self.service.remove_customer(1)
+        self.assertEqual(self.service.list_customers_with_feature("a"), [])
+
+    def test_ttl_and_lru_bound(self):
+        now = [0.0]
+        self.service.close()
+        self.service = FeatureFlagService(CachingFeatureFlagStore(
+            SQLiteFeatureFlagStore(db_path=self.DB_PATH), max_entries=2, ttl=10, clock=lambda: now[0]))
+        store = self.service.store
+        for customer_id in (1, 2, 3):
+            self.service.list_features_for_customer(customer_id)
+        self.assertEqual(len(store), 2)
+        self.service.list_features_for_customer(2)
+        self.assertEqual(store.hits, 1)
+        self.service.list_features_for_customer(1)
+        self.assertEqual(store.hits, 1)
+
+        # Writes made behind the cache's back show up once the entry expires
+        store.inner.add_feature("direct")
+        self.assertNotIn("direct", self.service.list_features_for_customer(1))
+        now[0] = 11
+        self.assertIn("direct", self.service.list_features_for_customer(1))
+
+    def test_rollback_clears_cache(self):
+        self.service.add_feature("tx", default_enabled=False)
+        with self.assertRaises(RuntimeError):
+            with self.service.transaction():
+                self.service.set_flag("tx", customer_id=1, user_id=None, is_enabled=True)
+                self.assertEqual(self.service.list_customers_with_feature("tx"), [1])
+                raise RuntimeError("abort")
+        self.assertEqual(self.service.list_customers_with_feature("tx"), [])
+
+    def test_commit_evicts_reads_cached_during_transaction(self):
+        store = self.service.store
+        self.service.add_feature("tx", default_enabled=False)
+        committed = SQLiteFeatureFlagStore(db_path=self.DB_PATH)
+        try:
+            with self.service.transaction():
+                self.service.set_flag("tx", customer_id=1, user_id=None, is_enabled=True)
+                # Another reader caches the last committed state mid-transaction
+                store.inner.list_customers_with_feature = committed.list_customers_with_feature
+                self.assertEqual(store.list_customers_with_feature("tx"), [])
+                del store.inner.list_customers_with_feature
+        finally:
+            committed.close()
+        self.assertEqual(self.service.list_customers_with_feature("tx"), [1])
+
+    def test_read_racing_a_write_is_not_cached(self):
+        store = self.service.store
+        self.service.add_feature("race", default_enabled=False)
+        load = store.inner.list_customers_with_feature
+
+        def load_then_write(feature_name):
+            # The write commits after the read saw the old state
+            result = load(feature_name)
+            store.set_flag("race", customer_id=1, user_id=None, is_enabled=True)
+            return result
+
+        store.inner.list_customers_with_feature = load_then_write
+        self.assertEqual(store.list_customers_with_feature("race"), [])
+        del store.inner.list_customers_with_feature
+        self.assertEqual(len(store), 0)
+        self.assertEqual(self.service.list_customers_with_feature("race"), [1])
+
+
+class TestShardedFeatureFlagService(TestFeatureFlagService):
+
+    DB_PATH = "test_feature_flags_shards"
+
+    def setUp(self):
+        shutil.rmtree(self.DB_PATH, ignore_errors=True)
+        shutil.rmtree(self.DB_PATH + "_resharded", ignore_errors=True)
+        super().setUp()
+
+    def make_store(self):
+        return ShardedFeatureFlagStore(self.DB_PATH, shard_count=3)
+
+    def in_transaction(self) -> bool:
+        return self.service.store.in_transaction
+
+    def tearDown(self):
+        self.service.close()
+        shutil.rmtree(self.DB_PATH, ignore_errors=True)
+        shutil.rmtree(self.DB_PATH + "_resharded", ignore_errors=True)
+
+    def read_file(self, path, query):
+        with sqlite3.connect(path) as conn:
+            return conn.execute(query).fetchall()
+
+    def populate(self):
+        self.service.add_customers_bulk(range(3, 60))
+        self.service.add_feature("inbox", default_enabled=True)
+        self.service.add_feature("beta", default_enabled=False)
+        self.service.set_rollout("beta", 40, min_customer_id=10)
+        self.service.set_flags_bulk([("inbox", customer_id, None, False) for customer_id in range(1, 60, 5)])
+        self.service.set_flags_bulk([("beta", customer_id, customer_id * 10, True) for customer_id in range(2, 60, 7)])
+        self.service.set_flag("beta", customer_id=None, user_id=7, is_enabled=True)
+        self.service.set_flag("beta", customer_id=500, user_id=None, is_enabled=True)
+
+    def test_customers_live_in_their_shard(self):
+        self.populate()
+        self.service.close()
+        self.assertEqual(self.read_file(os.path.join(self.DB_PATH, META_FILE), "SELECT * FROM customers"), [])
+        self.assertEqual(self.read_file(os.path.join(self.DB_PATH, META_FILE),
+                                        "SELECT customer_id, user_id FROM feature_flags"), [(None, 7)])
+        placed = []
+        for index in range(3):
+            path = shard_path(self.DB_PATH, index)
+            customers = [row[0] for row in self.read_file(path, "SELECT customer_id FROM customers")]
+            self.assertTrue(customers)
+            self.assertTrue(all(shard_for_customer(customer_id, 3) == index for customer_id in customers))
+            placed.extend(customers)
+            # Global flags and rollouts are copied to every shard, which logs its own customers' writes
+            self.assertEqual(self.read_file(path, "SELECT COUNT(*) FROM global_feature_flags"), [(2,)])
+            self.assertEqual(self.read_file(path, "SELECT COUNT(*) FROM rollouts"), [(1,)])
+            self.assertGreater(self.read_file(path, "SELECT COUNT(*) FROM flag_changes")[0][0], 0)
+        self.assertEqual(sorted(placed), list(range(1, 60)))
+
+        with self.assertRaises(ValueError):
+            ShardedFeatureFlagStore(self.DB_PATH, shard_count=4)
+        self.service = FeatureFlagService(ShardedFeatureFlagStore(self.DB_PATH))
+        self.assertEqual(self.service.store.shard_count, 3)
+        self.assertEqual(self.service.storage_stats()["customers_rows"], 59)
+
+    def test_writes_to_other_shards_run_in_parallel(self):
+        store = self.service.store
+        self.service.add_feature("inbox", default_enabled=False)
+        busy, free = 1, next(c for c in range(2, 100) if shard_for_customer(c, 3) != shard_for_customer(1, 3))
+        version, customers = self.service.current_version(), set(self.service.list_all_customers())
+
+        def write():
+            self.service.add_customer(free)
+            self.service.set_flag("inbox", customer_id=free, user_id=None, is_enabled=True)
+
+        # Neither the metadata file nor another customer's shard is in the way
+        with store._meta.lock, store._shard(busy).lock:
+            writer = threading.Thread(target=write)
+            writer.start()
+            writer.join(5)
+            self.assertFalse(writer.is_alive())
+        writers = [threading.Thread(target=self.service.add_customers_bulk, args=(range(start, 300, 4),))
+                   for start in range(100, 104)]
+        for thread in writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+
+        changes = self.service.changes_since(version)
+        self.assertEqual([change["operation"] for change in changes if change["customer_id"] == free],
+                         ["add_customer", "set_flag"])
+        self.assertEqual(len(changes), 202)
+        self.assertEqual([change["version"] for change in changes], list(range(version + 1, version + 203)))
+        self.assertEqual(self.service.list_customers_with_feature("inbox"), [free])
+        self.assertEqual(set(self.service.list_all_customers()), customers | {free} | set(range(100, 300)))
+
+    def test_reshard(self):
+        self.populate()
+        expected = {
+            "customers": self.service.list_customers_with_feature("beta"),
+            "features": {customer_id: sorted(self.service.list_features_for_customer(customer_id))
+                         for customer_id in (1, 2, 16, 500)},
+            "describe": self.service.describe_all_features(),
+            "rollouts": self.service.list_rollouts(),
+            "overrides": sorted(self.service.export_flags()[1], key=repr),
+            "version": self.service.current_version(),
+        }
+        self.service.close()
+
+        target = self.DB_PATH + "_resharded"
+        self.assertEqual(reshard(self.DB_PATH, target, 5), (59, 22))
+        with self.assertRaises(ValueError):
+            reshard(self.DB_PATH, target, 2)
+        with self.assertRaises(ValueError):
+            reshard(self.DB_PATH + "_missing", self.DB_PATH + "_resharded_again", 2)
+        self.assertFalse(os.path.exists(self.DB_PATH + "_resharded_again"))
+        self.service = FeatureFlagService(ShardedFeatureFlagStore(target))
+        self.assertEqual(self.service.store.shard_count, 5)
+        self.assertEqual(expected, {
+            "customers": self.service.list_customers_with_feature("beta"),
+            "features": {customer_id: sorted(self.service.list_features_for_customer(customer_id))
+                         for customer_id in (1, 2, 16, 500)},
+            "describe": self.service.describe_all_features(),
+            "rollouts": self.service.list_rollouts(),
+            "overrides": sorted(self.service.export_flags()[1], key=repr),
+            "version": self.service.current_version(),
+        })
+        # The change log carries on from the source
+        self.service.add_customer(1000)
+        self.assertEqual(self.service.changes_since(expected["version"])[0]["customer_id"], 1000)
+
+    def test_reshard_keeps_uncollected_changes(self):
+        self.populate()
+        version = self.service.current_version()
+        # Logged by the shards only, until something reads the change log
+        self.service.add_customer(1000)
+        self.service.set_flag("inbox", customer_id=1000, user_id=None, is_enabled=False)
+        self.service.close()
+
+        def contents():
+            paths = [os.path.join(self.DB_PATH, META_FILE)] + [shard_path(self.DB_PATH, index) for index in range(3)]
+            return [open(path, "rb").read() for path in paths]
+
+        before = contents()
+        target = self.DB_PATH + "_resharded"
+        reshard(self.DB_PATH, target, 2)
+        # Read without being touched, even though its shards held uncollected changes
+        self.assertEqual(contents(), before)
+        self.service = FeatureFlagService(ShardedFeatureFlagStore(target))
+        changes = self.service.changes_since(version)
+        self.assertEqual([(change["operation"], change["customer_id"]) for change in changes],
+                         [("add_customer", 1000), ("set_flag", 1000)])
+        self.assertEqual(self.service.current_version(), version + 2)
+
+    def test_reshard_single_database(self):
+        self.service.close()
+        shutil.rmtree(self.DB_PATH)
+        source = self.DB_PATH + ".db"
+        store = SQLiteFeatureFlagStore(db_path=source)
+        try:
+            store.add_customers_bulk(range(1, 30))
+            store.add_feature("inbox", default_enabled=True)
+            store.set_flags_bulk([("inbox", customer_id, None, False) for customer_id in range(1, 30, 4)])
+            store.set_flag("inbox", customer_id=None, user_id=3, is_enabled=False)
+            expected = (sorted(store.list_customers_with_feature("inbox")), store.current_version())
+        finally:
+            store.close()
+        try:
+            self.assertEqual(reshard(source, self.DB_PATH, 4), (29, 8))
+        finally:
+            os.remove(source)
+        self.service = FeatureFlagService(ShardedFeatureFlagStore(self.DB_PATH))
+        self.assertEqual((self.service.list_customers_with_feature("inbox"), self.service.current_version()), expected)
+        self.assertFalse(self.service.is_enabled("inbox", 2, user_id=3))
+        self.assertEqual(self.read_file(os.path.join(self.DB_PATH, META_FILE), "SELECT COUNT(*) FROM customers"), [(0,)])
+
 if __name__ == '__main__':
     unittest.main()
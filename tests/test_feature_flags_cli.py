@@ -47,4 +47,183 @@ def test_rename_feature():
 def test_error_on_conflicting_flags():
     run_cli(["add-feature", "err_feature"])
     result = run_cli(["set-flag", "err_feature", "--customer-id", "1", "--enabled", "--disabled"])
-    assert result.returncode != 0 or "Specify --enabled or --disabled" in result.stderr 
\ No newline at end of file
+    assert result.returncode != 0 or "Specify --enabled or --disabled" in result.stderr 
+
+def test_bulk_import_csv_and_jsonl(tmp_path):
+    csv_path = tmp_path / "flags.csv"
+    csv_path.write_text(
+        "feature_name,customer_id,user_id,is_enabled\n"
+        ",1,,\n"
+        ",2,,\n"
+        "bulk_feature,1,,true\n"
+        "bulk_feature,2,,false\n"
+    )
+    run_cli(["add-feature", "bulk_feature"])
+    result = run_cli(["bulk-import", str(csv_path), "--chunk-size", "2"])
+    assert result.returncode == 0, result.stderr
+    assert "Imported 2 flags and 2 customers" in result.stdout
+    result = run_cli(["list-customers", "bulk_feature"])
+    assert result.stdout.strip() == "[1]"
+
+    jsonl_path = tmp_path / "flags.jsonl"
+    jsonl_path.write_text(
+        '{"feature_name": "bulk_feature", "customer_id": 2, "is_enabled": true}\n'
+        '{"customer_id": 3}\n'
+    )
+    result = run_cli(["bulk-import", str(jsonl_path)])
+    assert result.returncode == 0, result.stderr
+    result = run_cli(["list-customers", "bulk_feature"])
+    assert result.stdout.strip() == "[1, 2]"
+    result = run_cli(["list-all-customers"])
+    assert result.stdout.strip() == "[1, 2, 3]"
+
+def test_change_log_commands():
+    run_cli(["add-feature", "log_feature"])
+    run_cli(["set-global-flag", "log_feature", "--enabled"])
+    result = run_cli(["current-version"])
+    assert result.stdout.strip() == "2"
+    result = run_cli(["changes-since", "1"])
+    assert '"operation": "set_global_flag"' in result.stdout
+    result = run_cli(["compact-changes", "1"])
+    assert "Compacted 1 changes" in result.stdout
+    result = run_cli(["changes-since", "0"])
+    assert result.returncode != 0
+
+def test_export_snapshot(tmp_path):
+    run_cli(["add-feature", "snap_feature", "--default-enabled"])
+    snapshot_path = tmp_path / "flags.snap"
+    result = run_cli(["export-snapshot", str(snapshot_path)])
+    assert result.returncode == 0, result.stderr
+    assert "Wrote snapshot version 1" in result.stdout
+    assert snapshot_path.exists()
+
+def test_stats():
+    run_cli(["add-customer", "1"])
+    result = run_cli(["stats"])
+    assert result.returncode == 0, result.stderr
+    assert "customers_rows" in result.stdout
+    # A one-shot process has no method counters worth showing
+    assert "storage_stats" not in result.stdout
+    result = run_cli(["--stats", "list-all-customers"])
+    assert result.stdout.strip() == "[1]"
+    assert "list_all_customers" in result.stderr
+
+def test_stats_from_server():
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+    from feature_flag_server import FeatureFlagHTTPServer
+    from feature_flag_service import FeatureFlagService, PooledSQLiteFeatureFlagStore
+    from instrumentation import Instrumentation
+    import threading
+    service = FeatureFlagService(PooledSQLiteFeatureFlagStore(DB_PATH), instrumentation=Instrumentation())
+    server = FeatureFlagHTTPServer(("127.0.0.1", 0), service)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        service.list_all_customers()
+        url = "http://%s:%d" % server.server_address[:2]
+        result = subprocess.run([sys.executable, CLI_PATH, "stats", "--server", url],
+                                capture_output=True, text=True, check=False)
+        assert result.returncode == 0, result.stderr
+        assert "list_all_customers" in result.stdout
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
+
+def test_rebuild_effective():
+    run_cli(["add-customer", "1"])
+    run_cli(["add-customer", "2"])
+    run_cli(["add-feature", "inbox", "--default-enabled"])
+    result = run_cli(["rebuild-effective"])
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "Rebuilt effective_flags with 2 rows"
+    run_cli(["set-flag", "inbox", "--customer-id", "2", "--disabled"])
+    assert run_cli(["list-customers", "inbox"]).stdout.strip() == "[1]"
+    assert "effective_flags_rows" in run_cli(["stats"]).stdout
+    assert run_cli(["rebuild-effective"]).stdout.strip() == "Rebuilt effective_flags with 1 rows"
+    assert run_cli(["rebuild-effective", "--drop"]).returncode == 0
+    assert "effective_flags_rows" not in run_cli(["stats"]).stdout
+
+def test_reshard(tmp_path):
+    run_cli(["add-customer", "1"])
+    run_cli(["add-customer", "2"])
+    run_cli(["add-feature", "inbox", "--default-enabled"])
+    run_cli(["set-flag", "inbox", "--customer-id", "2", "--disabled"])
+    target = str(tmp_path / "shards")
+    result = run_cli(["reshard", target, "--shards", "3"])
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "Copied 2 customers and 1 overrides into 3 shards"
+    sharded = subprocess.run([sys.executable, CLI_PATH, "--db-path", target, "list-customers", "inbox"],
+                             capture_output=True, text=True, check=False)
+    assert sharded.stdout.strip() == "[1]", sharded.stderr
+    assert run_cli(["reshard", target, "--shards", "2"]).returncode != 0
+
+def test_rebuild_effective_on_sharded_store(tmp_path):
+    run_cli(["add-customer", "1"])
+    target = str(tmp_path / "shards")
+    assert run_cli(["reshard", target, "--shards", "2"]).returncode == 0
+    result = subprocess.run([sys.executable, CLI_PATH, "--db-path", target, "rebuild-effective"],
+                            capture_output=True, text=True, check=False)
+    assert result.returncode != 0
+    assert "not supported on a sharded store" in result.stderr
+    assert "Traceback" not in result.stderr
+
+def run_cli_input(args, stdin):
+    return subprocess.run(
+        [sys.executable, CLI_PATH, "--db-path", DB_PATH] + args,
+        input=stdin,
+        capture_output=True,
+        text=True,
+        check=False
+    )
+
+def test_batch_from_stdin_and_file(tmp_path):
+    commands = "\n".join([
+        "add-feature batch_feature",
+        "# comments and blank lines are skipped",
+        "",
+        "add-customer 1",
+        "add-customer 2",
+        "set-flag batch_feature --customer-id 2 --enabled",
+        "list-customers batch_feature",
+    ])
+    result = run_cli_input(["batch", "--transaction-size", "2"], commands)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "[2]"
+    assert "Ran 5 commands" in result.stderr
+
+    batch_file = tmp_path / "commands.txt"
+    batch_file.write_text("remove-customer 1\nlist-all-customers\n")
+    result = run_cli(["batch", str(batch_file)])
+    assert result.stdout.strip() == "[2]"
+
+def test_batch_stops_and_rolls_back_failing_group():
+    result = run_cli_input(["batch", "--transaction-size", "2"],
+                           "add-customer 1\nadd-customer 2\nadd-customer 3\nset-flag f --customer-id 3\n")
+    assert result.returncode != 0
+    assert "line 4" in result.stderr
+    # The first group committed, the failing one rolled back
+    assert run_cli(["list-all-customers"]).stdout.strip() == "[1, 2]"
+
+def test_shell():
+    result = run_cli_input(["shell"], "\n".join([
+        "add-customer 5",
+        "begin",
+        "add-customer 6",
+        "rollback",
+        "not-a-command",
+        "list-all-customers",
+        "quit",
+    ]))
+    assert result.returncode == 0
+    assert result.stdout.strip().endswith("[5]")
+    assert "invalid choice" in result.stderr
+
+def test_rollout_commands():
+    commands = ["add-feature gradual"] + [f"add-customer {customer_id}" for customer_id in range(1, 21)]
+    run_cli_input(["batch"], "\n".join(commands))
+    result = run_cli(["set-rollout", "gradual", "100", "--min-customer-id", "5", "--max-customer-id", "7"])
+    assert result.returncode == 0, result.stderr
+    assert run_cli(["list-customers", "gradual"]).stdout.strip() == "[5, 6, 7]"
+    assert '"salt": "gradual"' in run_cli(["list-rollouts"]).stdout
+    run_cli(["clear-rollout", "gradual"])
+    assert run_cli(["list-customers", "gradual"]).stdout.strip() == "[]"
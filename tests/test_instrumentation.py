@@ -0,0 +1,103 @@
+import sys
+sys.path.append("src")
+from feature_flag_service import FeatureFlagService, SQLiteFeatureFlagStore
+from instrumentation import Instrumentation, LatencyHistogram, count_rows
+import os
+import unittest
+
+DB_PATH = "test_instrumentation.db"
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        if os.path.exists(DB_PATH):
+            os.remove(DB_PATH)
+        self.instrumentation = Instrumentation()
+        self.service = FeatureFlagService(SQLiteFeatureFlagStore(DB_PATH), instrumentation=self.instrumentation)
+        self.service.add_customer(1)
+        self.service.add_customer(2)
+        self.service.add_feature("dashboard", default_enabled=True)
+        self.instrumentation.reset()
+
+    def tearDown(self):
+        self.service.close()
+        if os.path.exists(DB_PATH):
+            os.remove(DB_PATH)
+
+    def test_counts_calls_rows_and_statements(self):
+        self.service.list_customers_with_feature("dashboard")
+        self.service.list_customers_with_feature("dashboard")
+        self.service.set_flag("dashboard", customer_id=2, user_id=None, is_enabled=False)
+        stats = self.instrumentation.snapshot()
+        listing = stats["list_customers_with_feature"]
+        self.assertEqual(listing["calls"], 2)
+        self.assertEqual(listing["rows"], 4)
+        self.assertGreater(listing["statements"], 0)
+        self.assertEqual(sum(listing["histogram"].values()), 2)
+        self.assertEqual(stats["set_flag"]["calls"], 1)
+        self.assertGreater(stats["set_flag"]["statements"], 0)
+
+    def test_is_enabled_is_instrumented(self):
+        self.assertTrue(self.service.is_enabled("dashboard", 1))
+        building = self.instrumentation.snapshot()["is_enabled"]["statements"]
+        self.assertGreater(building, 0)
+        # Later lookups are answered from the snapshot without SQL
+        self.assertTrue(self.service.is_enabled("dashboard", 1))
+        stats = self.instrumentation.snapshot()["is_enabled"]
+        self.assertEqual(stats["calls"], 2)
+        self.assertEqual(stats["statements"], building)
+
+    def test_errors_and_exporters(self):
+        seen = []
+        self.instrumentation.add_exporter(lambda method, seconds, rows, statements, error: seen.append((method, error)))
+        self.instrumentation.add_exporter(lambda *args: 1 / 0)  # a failing exporter must not break the call
+        with self.assertLogs("instrumentation", "ERROR"):
+            self.service.list_all_features()
+        with self.assertRaises(TypeError):
+            self.service.set_flag("dashboard")
+        self.assertEqual(seen[0], ("list_all_features", None))
+        self.assertEqual(seen[1][0], "set_flag")
+        self.assertIsInstance(seen[1][1], TypeError)
+        self.assertEqual(self.instrumentation.snapshot()["set_flag"]["errors"], 1)
+
+    def test_generators_are_timed_across_iteration(self):
+        customers = self.service.iter_all_customers(page_size=1)
+        self.assertNotIn("iter_all_customers", self.instrumentation.snapshot())
+        self.assertEqual(list(customers), [1, 2])
+        stats = self.instrumentation.snapshot()["iter_all_customers"]
+        self.assertEqual((stats["calls"], stats["rows"]), (1, 2))
+        self.assertEqual(stats["statements"], 3)
+
+        # Abandoning iteration early still records the call
+        customers = self.service.iter_all_customers(page_size=1)
+        next(customers)
+        customers.close()
+        stats = self.instrumentation.snapshot()["iter_all_customers"]
+        self.assertEqual((stats["calls"], stats["rows"]), (2, 3))
+
+    def test_disabled_by_default(self):
+        service = FeatureFlagService(self.service.store)
+        self.assertNotIn("is_enabled", vars(service))
+        self.assertIs(service.list_all_features.__func__, SQLiteFeatureFlagStore.list_all_features)
+
+    def test_storage_stats(self):
+        stats = self.service.storage_stats()
+        self.assertEqual(stats["customers_rows"], 2)
+        self.assertEqual(stats["global_feature_flags_rows"], 1)
+        self.assertEqual(stats["feature_flags_rows"], 0)
+        self.assertGreater(stats["size_bytes"], 0)
+
+    def test_histogram_and_row_counting(self):
+        histogram = LatencyHistogram()
+        for seconds in (0.0001, 0.0001, 0.0001, 0.2):
+            histogram.record(seconds)
+        self.assertEqual(histogram.percentile(0.5), 0.0001)
+        self.assertEqual(histogram.percentile(0.99), 0.2)
+        self.assertEqual(count_rows([1, 2]), 2)
+        self.assertEqual(count_rows(({"a": True}, [1, 2, 3])), 4)
+        self.assertEqual(count_rows(True), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()